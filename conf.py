@@ -1,10 +1,21 @@
 import os
+from typing import Dict, Optional, Tuple
+
 from dotenv import load_dotenv
+from pydantic import BaseModel
 from pydantic_settings import BaseSettings
 
 load_dotenv()
 
 
+class GenerationProfile(BaseModel):
+    """Параметры генерации Gemini для одного типа вызова"""
+    model: str = "gemini-2.5-flash"
+    thinking_budget: Optional[int] = None  # токенов на размышления; None — по умолчанию модели, 0 — без размышлений
+    max_output_tokens: Optional[int] = None
+    temperature: Optional[float] = None
+
+
 class Settings(BaseSettings):
     API_ID: int = int(os.getenv("API_ID", ""))
     API_HASH: str = os.getenv("API_HASH", "")
@@ -26,6 +37,95 @@ class Settings(BaseSettings):
 
     CLEAN_INTERVAL_DAYS: int = 7
 
+    GEMINI_MAX_CONCURRENCY: int = 4  # одновременных запросов к Gemini
+    GEMINI_CALL_TIMEOUT: float = 60  # секунд на вопросы и анализ
+    GEMINI_DECISION_TIMEOUT: float = 180  # секунд на итоговое решение
+    GEMINI_MAX_ATTEMPTS: int = 4  # попыток на вызов при 429/503/таймаутах
+    GEMINI_RETRY_BASE_DELAY: float = 1.0  # секунд, экспоненциальная пауза с джиттером
+    GEMINI_RETRY_MAX_DELAY: float = 20.0
+    GEMINI_DEADLINES: Dict[str, float] = {  # общий дедлайн вызова со всеми повторами, секунд
+        "questions": 120,
+        "summary": 90,
+        "analysis": 300,
+        "reasoning": 300,
+        "final_decision": 600,
+    }
+    GEMINI_BREAKER_THRESHOLD: int = 5  # подряд неудач до размыкания
+    GEMINI_BREAKER_RESET: float = 30  # секунд до пробного запроса
+    GEMINI_HEDGE_ENABLED: bool = False  # дублировать запрос, если он дольше p95
+    GEMINI_HEDGE_QUANTILE: float = 0.95
+    GEMINI_HEDGE_MIN_SAMPLES: int = 20  # замеров задержки до включения дублирования
+
+    GEMINI_BACKEND: str = "google"  # "google" — API Gemini, "fake" — локальная модель для нагрузочных тестов
+    FAKE_GEMINI_LATENCY: Tuple[float, float] = (0.5, 3.0)  # секунд, равномерно между границами
+    FAKE_GEMINI_TAIL_RATE: float = 0.02  # доля медленных ответов
+    FAKE_GEMINI_TAIL_LATENCY: float = 20.0  # секунд добавляется к медленному ответу
+    FAKE_GEMINI_FAULT_RATE: float = 0.0  # доля ответов 429/500/503
+    FAKE_GEMINI_LIST_ITEMS: int = 2  # элементов в списках ответа (вопросы, факты)
+    FAKE_GEMINI_CHARS_PER_TOKEN: float = 4.0  # для подсчёта токенов в usage_metadata
+    FAKE_GEMINI_SEED: Optional[int] = None  # фиксирует задержки, ошибки и ответы
+    FAKE_GEMINI_FILE_TTL: float = 48 * 3600  # секунд хранения файлов локальным File API
+
+    MEDIA_CACHE_DIR: str = "media_cache"
+    MEDIA_CACHE_MAX_BYTES: int = 1024 * 1024 * 1024  # 1 ГБ
+    INGEST_CONCURRENCY: int = 4  # фоновых обработок файлов одновременно
+    EVIDENCE_FETCH_CONCURRENCY: int = 8  # параллельных загрузок файлов при сборке промпта
+    CHAT_HISTORY_PAGE_MESSAGES: int = 50  # пересланных сообщений в одной записи переписки
+
+    IMAGE_MAX_EDGE: int = 1536  # px, длинная сторона после уменьшения
+    IMAGE_QUALITY: int = 80
+    IMAGE_FORMAT: str = "WEBP"
+    IMAGE_DUPLICATE_DISTANCE: int = 4  # макс. расстояние Хэмминга между phash почти одинаковых скриншотов
+
+    MEDIA_UPLOAD_ENABLED: bool = True  # загружать изображения через File API один раз и ссылаться на них
+    MEDIA_UPLOAD_MIN_BYTES: int = 32 * 1024  # изображения меньше этого отправляются в запросе
+    MEDIA_UPLOAD_EXPIRY_MARGIN: float = 3600  # секунд до истечения, когда файл загружается заново
+
+    DOC_MAX_PAGES: int = 100  # страниц PDF на документ
+    DOC_MAX_CHARS: int = 200_000  # символов текста на документ
+    DOC_EXTRACT_WORKERS: int = 2
+    DOC_EXTRACT_TIMEOUT: float = 20  # секунд на документ
+    DOC_EXTRACT_MEMORY_MB: int = 1024  # лимит памяти процесса извлечения
+
+    PROMPT_BUDGET_QUESTIONS: int = 60_000  # токенов на промпт с уточняющими вопросами
+    PROMPT_BUDGET_DECISION: int = 200_000  # токенов на промпт с решением
+    PROMPT_SUMMARIZE_OVERFLOW: bool = False  # сжимать не влезающие доказательства через модель вместо обрезки
+
+    RELEVANCE_TOP_K: int = 40  # сколько фрагментов доказательств отправлять в раунд вопросов
+    RELEVANCE_CHUNK_CHARS: int = 1200  # размер фрагмента для индекса
+    RELEVANCE_MIN_CHARS: int = 20_000  # до этого объёма текста отправляем всё целиком
+    RELEVANCE_MAX_CASES: int = 256  # сколько индексов дел держать в памяти
+
+    AI_QUESTIONS_JOINT_MODE: bool = True  # один запрос вопросов к обеим сторонам, отвечают параллельно
+    CASE_SUMMARY_ENABLED: bool = True  # раунды вопросов получают сводку дела и только новые доказательства
+    CASE_SUMMARY_MAX_ITEMS: int = 15  # фактов и открытых вопросов в сводке, каждого
+
+    LLM_JOB_WORKERS: int = 2  # воркеров очереди ИИ-заданий в процессе бота; 0 — только отдельный worker.py
+    LLM_JOB_LEASE: float = 120  # секунд аренды задания, продлевается пока задание выполняется
+    LLM_JOB_POLL_INTERVAL: float = 1.0  # секунд между опросами пустой очереди
+    LLM_JOB_MAX_ATTEMPTS: int = 5
+
+    VERDICT_STREAMING: bool = True  # показывать ход вынесения решения, редактируя статусное сообщение
+    VERDICT_PROGRESS_INTERVAL: float = 4.0  # секунд между правками статуса (лимиты Telegram)
+
+    LLM_TELEMETRY_ENABLED: bool = True  # писать каждый вызов Gemini в таблицу llm_calls
+
+    RESULT_CACHE_ENABLED: bool = True
+    RESULT_CACHE_TTL: int = 3600 * 24  # секунд хранения результатов вопросов/решения в Redis
+    RESULT_CACHE_LOCK_TTL: int = 700  # секунд блокировки на время вызова модели (больше дедлайна решения)
+    RESULT_CACHE_WAIT_TIMEOUT: float = 700  # сколько ждать чужой одинаковый вызов
+
+    # Профили генерации по типам вызовов; переопределяются JSON-ом в GENERATION_PROFILES.
+    # google-generativeai 0.8.5 не передаёт thinking_config, поэтому дешёвые вызовы идут
+    # в модель без размышлений, а не в gemini-2.5-flash с бюджетом 0
+    GENERATION_PROFILES: Dict[str, GenerationProfile] = {
+        "questions": GenerationProfile(model="gemini-2.0-flash", max_output_tokens=2048, temperature=0.4),
+        "summary": GenerationProfile(model="gemini-2.0-flash", max_output_tokens=2048, temperature=0.1),
+        "analysis": GenerationProfile(thinking_budget=2048, max_output_tokens=4096, temperature=0.2),
+        "reasoning": GenerationProfile(thinking_budget=2048, max_output_tokens=4096, temperature=0.3),
+        "final_decision": GenerationProfile(thinking_budget=8192, max_output_tokens=8192, temperature=0.2),
+    }
+
     class Config:
         env_file = ".env"
         extra = "allow"
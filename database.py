@@ -1,154 +1,324 @@
+import json
 import uuid
-from typing import Optional, List, Dict
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Optional, List, Dict, NamedTuple, Tuple, Union
 import asyncpg
 from telethon import TelegramClient
 from telethon.sessions import StringSession
 
 from conf import settings, DELETE_OLDER_THAN_DAYS
+from migrations import run_migrations
+
+
+# -----------------------------
+# Запросы записи, общие для методов Database и UnitOfWork
+# -----------------------------
+
+# Дело и участник-истец создаются одной командой, то есть атомарно
+CREATE_CASE_SQL = '''
+    WITH new_case AS (
+        INSERT INTO cases (
+            case_number, chat_id, topic, category, claim_amount,
+            claim_reason, mode, plaintiff_id, plaintiff_username, status, stage, version)
+        VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12)
+        RETURNING id
+    )
+    INSERT INTO participants (case_id, user_id, username, role)
+    SELECT id, $8, $9, 'plaintiff' FROM new_case
+'''
+
+SET_DEFENDANT_SQL = '''
+    WITH updated AS (
+        UPDATE cases
+        SET defendant_id = $2, defendant_username = $3, updated_at = NOW()
+        WHERE case_number = $1
+        RETURNING id
+    ), joined AS (
+        INSERT INTO participants (case_id, user_id, username, role)
+        SELECT id, $2, $3, 'defendant' FROM updated
+        ON CONFLICT DO NOTHING
+    )
+    SELECT id FROM updated
+'''
+
+ADD_PARTICIPANT_SQL = '''
+    INSERT INTO participants (case_id, user_id, username, role)
+    SELECT id, $2, $3, $4 FROM cases WHERE case_number = $1
+'''
+
+ADD_EVIDENCE_SQL = '''
+    INSERT INTO evidence (case_id, user_id, role, type, content, file_path, file_name, round_number)
+    SELECT id, $2, $3, $4, $5, $6, $7, $8 FROM cases WHERE case_number = $1
+    RETURNING id
+'''
+
+SAVE_AI_ANSWER_SQL = '''
+    INSERT INTO ai_answers (case_id, question, answer, role, round_number)
+    SELECT id, $2, $3, $4, $5 FROM cases WHERE case_number = $1
+'''
+
+SAVE_AI_QUESTION_SQL = '''
+    INSERT INTO ai_questions (case_id, question, target_role, round_number, created_at)
+    SELECT id, $2, $3, $4, NOW() FROM cases WHERE case_number = $1
+'''
+
+# Вопросы раунда для роли сохраняются один раз: повтор задания после частичного сохранения ничего не дублирует
+SAVE_AI_QUESTIONS_SQL = '''
+    INSERT INTO ai_questions (case_id, question, target_role, round_number, created_at)
+    SELECT c.id, q.question, $3::VARCHAR, $4::INTEGER, NOW()
+    FROM cases c, unnest($2::TEXT[]) WITH ORDINALITY AS q(question, position)
+    WHERE c.case_number = $1
+      AND NOT EXISTS (
+          SELECT 1 FROM ai_questions a
+          WHERE a.case_id = c.id AND a.target_role = $3::VARCHAR AND a.round_number = $4::INTEGER
+      )
+    ORDER BY q.position
+'''
+
+SAVE_DECISION_SQL = '''
+    INSERT INTO decisions (case_id, claim_granted, file_path, file_data, created_at)
+    SELECT id, $2, $3, $4, NOW() FROM cases WHERE case_number = $1
+    ON CONFLICT (case_id)
+    DO UPDATE SET
+        claim_granted = EXCLUDED.claim_granted,
+        file_path = EXCLUDED.file_path,
+        file_data = EXCLUDED.file_data,
+        created_at = NOW()
+'''
+
+
+class EvidenceRow(NamedTuple):
+    """Строка для add_evidence_bulk; поля как у add_evidence"""
+    case_number: str
+    user_id: int
+    role: str
+    ev_type: str
+    content: Optional[str]
+    file_id: Optional[str] = None
+    file_name: Optional[str] = None
+    round_number: int = 0
+
+
+EVIDENCE_COPY_COLUMNS = ("case_id", "user_id", "role", "type", "content", "file_path", "file_name", "round_number")
+
+
+async def copy_evidence(conn: asyncpg.Connection, rows: List[EvidenceRow]) -> int:
+    """
+    Записывает доказательства через COPY: один запрос номеров дел и один поток COPY
+    вместо проверки и INSERT на каждую строку. Вызывается внутри транзакции.
+    """
+    case_numbers = list({row.case_number for row in rows})
+    case_ids = {
+        record["case_number"]: record["id"]
+        for record in await conn.fetch(
+            "SELECT case_number, id FROM cases WHERE case_number = ANY($1::VARCHAR[])", case_numbers
+        )
+    }
+    missing = [number for number in case_numbers if number not in case_ids]
+    if missing:
+        raise ValueError(f"Дело {', '.join(missing)} не найдено")
+
+    await conn.copy_records_to_table(
+        "evidence",
+        records=[
+            (case_ids[row.case_number], row.user_id, row.role, row.ev_type, row.content, row.file_id,
+             row.file_name, row.round_number)
+            for row in rows
+        ],
+        columns=EVIDENCE_COPY_COLUMNS
+    )
+    return len(rows)
+
+
+def new_case_number() -> str:
+    return f"CASE-{uuid.uuid4().hex[:8].upper()}"
+
+
+class _Statement(NamedTuple):
+    query: str
+    args: Tuple
+    # Текст ошибки, если команда не затронула ни одной строки (дело не найдено)
+    missing_error: Optional[str] = None
+
+
+class UnitOfWork:
+    """
+    Связанные записи, которые применяются вместе при выходе из `async with db.unit_of_work() as uow`.
+
+    Методы только ставят команды в очередь; соединение берётся из пула в конце блока, так что
+    оно не занято, пока обработчик ждёт Telegram. Если блок завершился исключением, ничего не пишется.
+    Изменения полей одного дела сливаются в один UPDATE, одинаковые команды подряд уходят одним
+    executemany, а транзакция открывается, только если команд больше одной.
+    """
 
-
-class Database:
     def __init__(self):
-        self.pool = None
+        # Команды по порядку; строка — место UPDATE дела с этим номером, список — доказательства для COPY
+        self._steps: List[Union[_Statement, str, List[EvidenceRow]]] = []
+        self._case_fields: Dict[str, Dict] = {}
 
-    async def connect(self):
-        self.pool = await asyncpg.create_pool(settings.DATABASE_URL)
-        await self.create_tables()
+    def execute(self, query: str, *args, missing_error: Optional[str] = None):
+        self._steps.append(_Statement(query, args, missing_error))
 
-    async def create_tables(self):
-        async with self.pool.acquire() as conn:
-            await conn.execute('''
-                CREATE TABLE IF NOT EXISTS cases (
-                    id SERIAL PRIMARY KEY,
-                    case_number VARCHAR(50) UNIQUE,
-                    chat_id BIGINT,
-                    topic TEXT,
-                    category VARCHAR(100),
-                    claim_amount DECIMAL(15,2),
-                    claim_reason VARCHAR(500),
-                    mode VARCHAR(20),
-                    version VARCHAR (10) DEFAULT 'v2', 
-                    plaintiff_id BIGINT,
-                    plaintiff_username VARCHAR(100),
-                    defendant_id BIGINT,
-                    defendant_username VARCHAR(100),
-                    status VARCHAR(50) DEFAULT 'active',
-                    stage VARCHAR(50) DEFAULT 'plaintiff',
-                    created_at TIMESTAMP DEFAULT NOW(),
-                    updated_at TIMESTAMP DEFAULT NOW()
-                )
-            ''')
-            await conn.execute('''
-                CREATE TABLE IF NOT EXISTS evidence (
-                    id BIGSERIAL PRIMARY KEY,
-                    case_number VARCHAR(50),
-                    user_id BIGINT,
-                    role VARCHAR(50),
-                    type VARCHAR(50),
-                    content TEXT,
-                    file_id VARCHAR(500),
-                    file_path TEXT,
-                    description TEXT,
-                    round_number INTEGER DEFAULT 0,
-                    question_id INTEGER,
-                    created_at TIMESTAMP DEFAULT NOW()
-                )
-                ''')
+    def update_case(self, case_number: str, **fields):
+        if case_number not in self._case_fields:
+            self._case_fields[case_number] = {}
+            self._steps.append(case_number)
+        self._case_fields[case_number].update(fields)
 
-            await conn.execute('''
-                CREATE TABLE IF NOT EXISTS participants (
-                    id SERIAL PRIMARY KEY,
-                    case_id INT NOT NULL REFERENCES cases(id) ON DELETE CASCADE,
-                    user_id BIGINT NOT NULL,
-                    username TEXT,
-                    role TEXT CHECK (role IN ('plaintiff', 'defendant', 'witness')),
-                    joined_at TIMESTAMP DEFAULT NOW(),
-                    UNIQUE(case_id, user_id, role)
-                )
-            ''')
-            await conn.execute('''
-                CREATE TABLE IF NOT EXISTS decisions (
-                    id SERIAL PRIMARY KEY,
-                    case_number VARCHAR(50) UNIQUE,
-                    claim_granted BOOLEAN NOT NULL DEFAULT FALSE,
-                    file_path TEXT,
-                    file_data BYTEA,
-                    created_at TIMESTAMP DEFAULT NOW()
-                )
-            ''')
-            await conn.execute('''
-                CREATE TABLE IF NOT EXISTS user_settings (
-                    user_id BIGINT PRIMARY KEY,
-                    bot_version VARCHAR(10) DEFAULT 'v2',
-                    created_at TIMESTAMP DEFAULT NOW(),
-                    updated_at TIMESTAMP DEFAULT NOW()
-                )
-            ''')
-            await conn.execute('''
-                CREATE TABLE IF NOT EXISTS participant_stages (
-                    case_number VARCHAR(50),
-                    user_id BIGINT,
-                    stage VARCHAR(50),
-                    updated_at TIMESTAMP DEFAULT NOW(),
-                    PRIMARY KEY (case_number, user_id)
-                )
-            ''')
-            await conn.execute("""
-                        CREATE TABLE IF NOT EXISTS verdict_files (
-                            id SERIAL PRIMARY KEY,
-                            case_number VARCHAR(50),
-                            filename TEXT NOT NULL,
-                            filepath TEXT NOT NULL,
-                            uploaded_at TIMESTAMP DEFAULT NOW(),
-                            created_at TIMESTAMP DEFAULT NOW()
-                        );
-                    """)
+    def update_case_stage(self, case_number: str, stage: str):
+        self.update_case(case_number, stage=stage)
 
-    async def create_additional_tables(self):
-        """Создание дополнительных таблиц для пользовательских сессий и групп"""
-        async with self.pool.acquire() as conn:
+    def update_case_status(self, case_number: str, status: str):
+        self.update_case(case_number, status=status)
 
-            await conn.execute('''
-                CREATE TABLE IF NOT EXISTS dispute_groups (
-                    id SERIAL PRIMARY KEY,
-                    case_number VARCHAR(50) UNIQUE,
-                    chat_id BIGINT NOT NULL,
-                    title VARCHAR(255),
-                    created_at TIMESTAMP DEFAULT NOW(),
-                    updated_at TIMESTAMP DEFAULT NOW()
-                )
-            ''')
-            await conn.execute('''
-                CREATE TABLE IF NOT EXISTS ai_answers (
-                    id SERIAL PRIMARY KEY,
-                    case_number VARCHAR(50) NOT NULL,
-                    question TEXT NOT NULL,
-                    answer TEXT NOT NULL,
-                    role VARCHAR(50) NOT NULL,
-                    round_number INTEGER NOT NULL,
-                    created_at TIMESTAMP DEFAULT NOW()
-                )
-            ''')
-            await conn.execute('''
-                CREATE TABLE IF NOT EXISTS bot_users (
-                    user_id BIGINT PRIMARY KEY,
-                    username TEXT,
-                    contacted_at TIMESTAMP DEFAULT NOW()
-                )          
-            ''')
-            # Новая таблица для AI вопросов (если её нет)
-            await conn.execute('''
-                CREATE TABLE IF NOT EXISTS ai_questions (
-                    id SERIAL PRIMARY KEY,
-                    case_number VARCHAR(50) NOT NULL,
-                    question TEXT NOT NULL,
-                    target_role VARCHAR(50) NOT NULL,
-                    round_number INTEGER NOT NULL,
-                    created_at TIMESTAMP DEFAULT NOW()
+    def create_case(
+            self,
+            topic: str,
+            category: str,
+            mode: str,
+            claim_reason: str,
+            plaintiff_id: int,
+            plaintiff_username: str,
+            chat_id: int,
+            claim_amount: Optional[float] = None,
+            status: str = "active",
+            stage: str = "plaintiff",
+            version: str = "v2",
+    ) -> str:
+        """Номер дела известен сразу, поэтому им можно пользоваться в следующих командах"""
+        case_number = new_case_number()
+        self.execute(CREATE_CASE_SQL, case_number, chat_id, topic, category, claim_amount, claim_reason, mode,
+                     plaintiff_id, plaintiff_username, status, stage, version)
+        return case_number
+
+    def set_defendant(self, case_number: str, defendant_id: int, defendant_username: str):
+        self.execute(SET_DEFENDANT_SQL, case_number, defendant_id, defendant_username,
+                     missing_error=f"Дело {case_number} не найдено")
+
+    def add_participant(self, case_number: str, user_id: int, username: str, role: str):
+        self.execute(ADD_PARTICIPANT_SQL, case_number, user_id, username, role,
+                     missing_error=f"Дело с номером {case_number} не найдено")
+
+    def add_evidence(self, case_number: str, user_id: int, role: str, ev_type: str, content: Optional[str],
+                     file_id: Optional[str], file_name: Optional[str] = None, round_number: int = 0):
+        self.execute(ADD_EVIDENCE_SQL, case_number, user_id, role, ev_type, content, file_id, file_name,
+                     round_number, missing_error=f"Дело {case_number} не найдено")
+
+    def add_evidence_bulk(self, rows: List[EvidenceRow]):
+        if rows:
+            self._steps.append(list(rows))
+
+    def save_ai_answer(self, case_number: str, question: str, answer: str, role: str, round_number: int):
+        self.execute(SAVE_AI_ANSWER_SQL, case_number, question, answer, role, round_number)
+
+    def save_ai_question(self, case_number: str, question: str, target_role: str, round_number: int):
+        self.execute(SAVE_AI_QUESTION_SQL, case_number, question, target_role, round_number)
+
+    def save_ai_questions(self, case_number: str, questions: List[str], target_role: str, round_number: int):
+        """Все вопросы раунда для роли; пропускается, если вопросы этого раунда уже сохранены"""
+        if questions:
+            self.execute(SAVE_AI_QUESTIONS_SQL, case_number, list(questions), target_role, round_number)
+
+    def save_decision(self, case_number: str, claim_granted: bool, file_path: str = None, file_data: bytes = None):
+        self.execute(SAVE_DECISION_SQL, case_number, claim_granted, file_path, file_data)
+
+    def _batches(self) -> List[Union[Tuple[str, List[Tuple], Optional[str]], List[EvidenceRow]]]:
+        """(запрос, наборы аргументов, текст ошибки) с уже слитыми UPDATE дел; списки доказательств для COPY"""
+        batches = []
+        for step in self._steps:
+            if isinstance(step, list):
+                if batches and isinstance(batches[-1], list):
+                    batches[-1].extend(step)
+                else:
+                    batches.append(list(step))
+                continue
+            if isinstance(step, str):
+                fields = self._case_fields[step]
+                set_clause = ", ".join(f"{col} = ${i + 2}" for i, col in enumerate(fields))
+                step = _Statement(
+                    f"UPDATE cases SET {set_clause}, updated_at = NOW() WHERE case_number = $1",
+                    (step, *fields.values())
                 )
-            ''')
+            last = batches[-1] if batches and isinstance(batches[-1], tuple) else None
+            # Проверку затронутых строк executemany не даёт, поэтому такие команды не группируются
+            if last and last[0] == step.query and last[2] is None and step.missing_error is None:
+                last[1].append(step.args)
+            else:
+                batches.append((step.query, [step.args], step.missing_error))
+        return batches
+
+    async def apply(self, conn: asyncpg.Connection):
+        batches = self._batches()
+        if not batches:
+            return
+        if len(batches) == 1 and isinstance(batches[0], tuple) and len(batches[0][1]) == 1:
+            # Одна команда атомарна и без явной транзакции
+            await self._run(conn, *batches[0])
+            return
+        async with conn.transaction():
+            for batch in batches:
+                if isinstance(batch, list):
+                    await copy_evidence(conn, batch)
+                else:
+                    await self._run(conn, *batch)
+
+    @staticmethod
+    async def _run(conn: asyncpg.Connection, query: str, args_list: List[Tuple], missing_error: Optional[str]):
+        if len(args_list) > 1:
+            await conn.executemany(query, args_list)
+            return
+        status = await conn.execute(query, *args_list[0])
+        # Статус вида "INSERT 0 1" / "UPDATE 1" / "SELECT 1"; ноль строк — дело не найдено
+        if missing_error and status.split()[-1] == "0":
+            raise ValueError(missing_error)
+
+
+class CaseContext(NamedTuple):
+    """Всё, что нужно заданиям ИИ по делу; строки в порядке создания"""
+    case: Dict
+    participants: List[Dict]
+    evidence: List[Dict]
+    ai_questions: List[Dict]
+    ai_answers: List[Dict]
+
+    def question_round(self, role: str) -> int:
+        """Последний раунд вопросов ИИ для роли (0, если вопросов ещё не было)"""
+        return max((q["round_number"] for q in self.ai_questions if q["target_role"] == role), default=0)
+
+    def round_questions(self, role: str, round_number: int) -> List[str]:
+        """Уже сохранённые вопросы раунда для роли"""
+        return [
+            q["question"] for q in self.ai_questions
+            if q["target_role"] == role and q["round_number"] == round_number
+        ]
+
+    def answered_round(self, role: str, round_number: int) -> bool:
+        """Роль уже начала отвечать на вопросы раунда"""
+        return any(a["role"] == role and a["round_number"] == round_number for a in self.ai_answers)
+
+    @property
+    def asked_questions(self) -> List[str]:
+        return [q["question"] for q in self.ai_questions]
 
 
+class Database:
+    def __init__(self):
+        self.pool = None
+
+    async def connect(self):
+        self.pool = await asyncpg.create_pool(settings.DATABASE_URL)
+        # Схема создаётся и обновляется версионированными миграциями (migrations.py)
+        await run_migrations(self.pool)
+
+    @asynccontextmanager
+    async def unit_of_work(self):
+        """Собирает записи блока и применяет их одной транзакцией (см. UnitOfWork)"""
+        uow = UnitOfWork()
+        yield uow
+        async with self.pool.acquire() as conn:
+            await uow.apply(conn)
+
     async def create_case(
             self,
             topic: str,
@@ -164,28 +334,17 @@ class Database:
             version: str = "v2",
     ) -> str:
         async with self.pool.acquire() as conn:
-            case_number = f"CASE-{uuid.uuid4().hex[:8].upper()}"
-            case_id = await conn.fetchval('''
-                INSERT INTO cases (
-                    case_number, chat_id, topic, category, claim_amount,
-                    claim_reason, mode, plaintiff_id, plaintiff_username, status, stage, version)
-                VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12)
-                RETURNING id
-            ''', case_number, chat_id, topic, category, claim_amount, claim_reason, mode, plaintiff_id,
-                                          plaintiff_username, status, stage, version)
-            await conn.execute('''
-                INSERT INTO participants (case_id, user_id, username, role)
-                VALUES ($1, $2, $3, 'plaintiff')
-                ON CONFLICT DO NOTHING
-            ''', case_id, plaintiff_id, plaintiff_username)
+            case_number = new_case_number()
+            await conn.execute(CREATE_CASE_SQL, case_number, chat_id, topic, category, claim_amount, claim_reason,
+                               mode, plaintiff_id, plaintiff_username, status, stage, version)
             return case_number
 
     async def update_participant_stage(self, case_number: str, user_id: int, stage: str):
         async with self.pool.acquire() as conn:
             await conn.execute("""
-                INSERT INTO participant_stages (case_number, user_id, stage, updated_at)
-                VALUES ($1, $2, $3, NOW())
-                ON CONFLICT (case_number, user_id)
+                INSERT INTO participant_stages (case_id, user_id, stage, updated_at)
+                SELECT id, $2, $3, NOW() FROM cases WHERE case_number = $1
+                ON CONFLICT (case_id, user_id)
                 DO UPDATE SET 
                     stage = EXCLUDED.stage,
                     updated_at = NOW()
@@ -197,21 +356,21 @@ class Database:
             result = await conn.execute("""
                 UPDATE verdict_files
                 SET filepath = $2
-                WHERE case_number = $1
+                WHERE case_id = (SELECT id FROM cases WHERE case_number = $1)
             """, case_number, filepath)
 
             # Если ни одна строка не обновлена — вставляем новую
             if result == "UPDATE 0":
                 await conn.execute("""
-                    INSERT INTO verdict_files (case_number, filepath)
-                    VALUES ($1, $2)
+                    INSERT INTO verdict_files (case_id, filepath)
+                    SELECT id, $2 FROM cases WHERE case_number = $1
                 """, case_number, filepath)
 
     async def get_verdict_file(self, case_number: str):
         """Получить путь к файлу вердикта"""
         async with self.pool.acquire() as conn:
             row = await conn.fetchrow(
-                "SELECT filepath FROM verdict_files WHERE case_number=$1",
+                "SELECT filepath FROM verdict_files WHERE case_id = (SELECT id FROM cases WHERE case_number = $1)",
                 case_number
             )
             return row["filepath"] if row else None
@@ -223,7 +382,7 @@ class Database:
         async with self.pool.acquire() as conn:
             row = await conn.fetchrow("""
                 SELECT stage FROM participant_stages
-                WHERE case_number = $1 AND user_id = $2
+                WHERE case_id = (SELECT id FROM cases WHERE case_number = $1) AND user_id = $2
             """, case_number, user_id)
             return row["stage"] if row else None
 
@@ -233,7 +392,7 @@ class Database:
     async def reset_participant_stages(self, case_number: str):
         async with self.pool.acquire() as conn:
             await conn.execute("""
-                DELETE FROM participant_stages WHERE case_number = $1
+                DELETE FROM participant_stages WHERE case_id = (SELECT id FROM cases WHERE case_number = $1)
             """, case_number)
 
     # -----------------------------
@@ -243,10 +402,44 @@ class Database:
         async with self.pool.acquire() as conn:
             rows = await conn.fetch("""
                 SELECT user_id, stage FROM participant_stages
-                WHERE case_number = $1
+                WHERE case_id = (SELECT id FROM cases WHERE case_number = $1)
             """, case_number)
             return {row["user_id"]: row["stage"] for row in rows}
 
+    # -----------------------------
+    # Перевести участника на стадию и проверить, дошли ли до неё все
+    # -----------------------------
+    async def complete_participant_stage(self, case_number: str, user_id: int, stage: str,
+                                         user_ids: List[int]) -> bool:
+        """
+        True ровно для одного вызова — того, который последним перевёл участника на стадию.
+        Используется, когда стороны отвечают на вопросы ИИ параллельно.
+        """
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                # Сериализуем завершения по делу, иначе оба участника могут увидеть "все готовы"
+                await conn.execute("SELECT pg_advisory_xact_lock(hashtext($1))", case_number)
+                case_id = await conn.fetchval("SELECT id FROM cases WHERE case_number = $1", case_number)
+                if case_id is None:
+                    return False
+                changed = await conn.fetchval("""
+                    INSERT INTO participant_stages (case_id, user_id, stage, updated_at)
+                    VALUES ($1, $2, $3, NOW())
+                    ON CONFLICT (case_id, user_id)
+                    DO UPDATE SET
+                        stage = EXCLUDED.stage,
+                        updated_at = NOW()
+                    WHERE participant_stages.stage IS DISTINCT FROM EXCLUDED.stage
+                    RETURNING user_id
+                """, case_id, user_id, stage)
+                if changed is None:
+                    return False
+                done = await conn.fetchval("""
+                    SELECT COUNT(*) FROM participant_stages
+                    WHERE case_id = $1 AND stage = $2 AND user_id = ANY($3::BIGINT[])
+                """, case_id, stage, user_ids)
+                return done == len(set(user_ids))
+
     async def save_bot_user(self, user_id: int, username: str):
         """Сохранить пользователя, написавшего боту"""
         async with self.pool.acquire() as conn:
@@ -270,21 +463,10 @@ class Database:
 
     async def set_defendant(self, case_number: str, defendant_id: int, defendant_username: str):
         async with self.pool.acquire() as conn:
-            case = await conn.fetchrow('SELECT id FROM cases WHERE case_number = $1', case_number)
-            if not case:
+            case_id = await conn.fetchval(SET_DEFENDANT_SQL, case_number, defendant_id, defendant_username)
+            if case_id is None:
                 print(f"❌ Дело {case_number} не найдено")
                 return
-            case_id = case['id']
-            await conn.execute('''
-                UPDATE cases
-                SET defendant_id = $1, defendant_username = $2, updated_at = NOW()
-                WHERE case_number = $3
-            ''', defendant_id, defendant_username, case_number)
-            await conn.execute('''
-                INSERT INTO participants (case_id, user_id, username, role)
-                VALUES ($1, $2, $3, 'defendant')
-                ON CONFLICT DO NOTHING
-            ''', case_id, defendant_id, defendant_username)
             print(f"✅ Ответчик {defendant_id} назначен для дела {case_number}")
 
     async def set_user_version(self, user_id: int, version: str):
@@ -346,10 +528,7 @@ class Database:
     async def save_ai_answer(self, case_number: str, question: str, answer: str, role: str, round_number: int):
         """Сохраняет ответ на вопрос ИИ"""
         async with self.pool.acquire() as conn:
-            await conn.execute('''
-                INSERT INTO ai_answers (case_number, question, answer, role, round_number)
-                VALUES ($1, $2, $3, $4, $5)
-            ''', case_number, question, answer, role, round_number)
+            await conn.execute(SAVE_AI_ANSWER_SQL, case_number, question, answer, role, round_number)
 
     async def get_user_cases(self, user_id: int) -> List[Dict]:
         async with self.pool.acquire() as conn:
@@ -408,37 +587,261 @@ class Database:
             role: str,
             ev_type: str,
             content: Optional[str],
-            file_id: Optional[str]
-    ):
+            file_id: Optional[str],
+            file_name: Optional[str] = None,
+            round_number: int = 0
+    ) -> int:
         async with self.pool.acquire() as conn:
-            exists = await conn.fetchval(
-                'SELECT 1 FROM cases WHERE case_number = $1',
-                case_number
-            )
-            if not exists:
-                raise ValueError(f"Дело {case_number} не найдено")
-
-            await conn.execute(
-                '''
-                INSERT INTO evidence (case_number, user_id, role, type, content, file_path)
-                VALUES ($1, $2, $3, $4, $5, $6)
-                ''',
+            # Пустой результат означает, что дела нет: INSERT ... SELECT не вставил ни одной строки
+            evidence_id = await conn.fetchval(
+                ADD_EVIDENCE_SQL,
                 case_number,
                 user_id,
                 role,
                 ev_type,
                 content,
-                file_id
+                file_id,
+                file_name,
+                round_number
             )
+            if evidence_id is None:
+                raise ValueError(f"Дело {case_number} не найдено")
+            return evidence_id
+
+    async def add_evidence_bulk(self, rows: List[EvidenceRow]) -> int:
+        """Несколько доказательств одним COPY; все строки пишутся вместе или не пишутся вовсе"""
+        if not rows:
+            return 0
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                return await copy_evidence(conn, rows)
+
+    # -----------------------------
+    # Очередь заданий для ИИ
+    # -----------------------------
+    async def enqueue_llm_job(self, kind: str, case_number: str, payload: Dict,
+                              dedupe_key: Optional[str] = None) -> Optional[int]:
+        async with self.pool.acquire() as conn:
+            return await conn.fetchval('''
+                INSERT INTO llm_jobs (kind, case_number, payload, dedupe_key)
+                VALUES ($1, $2, $3::jsonb, $4)
+                ON CONFLICT (dedupe_key) WHERE status IN ('queued', 'running') DO NOTHING
+                RETURNING id
+            ''', kind, case_number, json.dumps(payload), dedupe_key)
+
+    async def claim_llm_job(self, worker_id: str, lease_seconds: float, kinds: List[str]) -> Optional[Dict]:
+        """Берёт готовое задание (или задание с истекшей арендой упавшего воркера)"""
+        async with self.pool.acquire() as conn:
+            row = await conn.fetchrow('''
+                UPDATE llm_jobs
+                SET status = 'running',
+                    attempts = attempts + 1,
+                    locked_by = $1,
+                    locked_until = NOW() + make_interval(secs => $2),
+                    updated_at = NOW()
+                WHERE id = (
+                    SELECT id FROM llm_jobs
+                    WHERE kind = ANY($3::VARCHAR[])
+                      AND ((status = 'queued' AND run_after <= NOW())
+                        OR (status = 'running' AND locked_until < NOW()))
+                    ORDER BY run_after
+                    LIMIT 1
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id, kind, case_number, payload, attempts
+            ''', worker_id, float(lease_seconds), kinds)
+            if row is None:
+                return None
+            job = dict(row)
+            job["payload"] = json.loads(job["payload"])
+            return job
+
+    async def extend_llm_job_lease(self, job_id: int, worker_id: str, lease_seconds: float):
+        async with self.pool.acquire() as conn:
+            await conn.execute('''
+                UPDATE llm_jobs
+                SET locked_until = NOW() + make_interval(secs => $3), updated_at = NOW()
+                WHERE id = $1 AND locked_by = $2 AND status = 'running'
+            ''', job_id, worker_id, float(lease_seconds))
+
+    async def complete_llm_job(self, job_id: int):
+        async with self.pool.acquire() as conn:
+            await conn.execute('''
+                UPDATE llm_jobs
+                SET status = 'done', locked_by = NULL, locked_until = NULL, updated_at = NOW()
+                WHERE id = $1
+            ''', job_id)
+
+    async def fail_llm_job(self, job_id: int, error: str, retry_in: float, give_up: bool = False):
+        async with self.pool.acquire() as conn:
+            await conn.execute('''
+                UPDATE llm_jobs
+                SET status = CASE WHEN $4 THEN 'failed' ELSE 'queued' END,
+                    last_error = $2,
+                    run_after = NOW() + make_interval(secs => $3),
+                    locked_by = NULL,
+                    locked_until = NULL,
+                    updated_at = NOW()
+                WHERE id = $1
+            ''', job_id, error, float(retry_in), give_up)
+
+    async def release_llm_job(self, job_id: int):
+        """Возвращает задание в очередь при остановке воркера, попытка не засчитывается"""
+        async with self.pool.acquire() as conn:
+            await conn.execute('''
+                UPDATE llm_jobs
+                SET status = 'queued',
+                    attempts = GREATEST(attempts - 1, 0),
+                    locked_by = NULL,
+                    locked_until = NULL,
+                    updated_at = NOW()
+                WHERE id = $1 AND status = 'running'
+            ''', job_id)
+
+    # -----------------------------
+    # Сводка дела для раундов вопросов
+    # -----------------------------
+    async def get_case_summary(self, case_number: str) -> Optional[Dict]:
+        async with self.pool.acquire() as conn:
+            row = await conn.fetchrow('''
+                SELECT summary, last_evidence_id, round_number
+                FROM case_summaries
+                WHERE case_id = (SELECT id FROM cases WHERE case_number = $1)
+            ''', case_number)
+            if row is None:
+                return None
+            result = dict(row)
+            result["summary"] = json.loads(result["summary"])
+            return result
+
+    async def save_case_summary(self, case_number: str, summary: Dict, last_evidence_id: int, round_number: int):
+        """Сводка не откатывается назад, если задание предыдущего раунда завершилось позже"""
+        async with self.pool.acquire() as conn:
+            await conn.execute('''
+                INSERT INTO case_summaries (case_id, summary, last_evidence_id, round_number)
+                SELECT id, $2::jsonb, $3, $4 FROM cases WHERE case_number = $1
+                ON CONFLICT (case_id) DO UPDATE
+                SET summary = EXCLUDED.summary,
+                    last_evidence_id = EXCLUDED.last_evidence_id,
+                    round_number = EXCLUDED.round_number,
+                    updated_at = NOW()
+                WHERE case_summaries.last_evidence_id <= EXCLUDED.last_evidence_id
+            ''', case_number, json.dumps(summary, ensure_ascii=False), last_evidence_id, round_number)
+
+    # -----------------------------
+    # Телеметрия вызовов ИИ
+    # -----------------------------
+    async def add_llm_call(
+            self,
+            case_number: Optional[str],
+            call_type: str,
+            model: Optional[str],
+            prompt_tokens: Optional[int],
+            output_tokens: Optional[int],
+            total_tokens: Optional[int],
+            image_count: int,
+            payload_bytes: int,
+            latency_ms: int,
+            attempts: int,
+            outcome: str,
+            error: Optional[str] = None
+    ):
+        async with self.pool.acquire() as conn:
+            await conn.execute('''
+                INSERT INTO llm_calls (
+                    case_number, call_type, model, prompt_tokens, output_tokens, total_tokens,
+                    image_count, payload_bytes, latency_ms, attempts, outcome, error
+                )
+                VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12)
+            ''', case_number, call_type, model, prompt_tokens, output_tokens, total_tokens,
+                image_count, payload_bytes, latency_ms, attempts, outcome, error)
+
+    async def get_llm_usage_by_case(self, case_number: str) -> List[Dict]:
+        """Расход токенов и времени по этапам одного дела"""
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch('''
+                SELECT call_type,
+                       COUNT(*) AS calls,
+                       COUNT(*) FILTER (WHERE outcome <> 'ok') AS failed_calls,
+                       SUM(attempts - 1) AS retries,
+                       COALESCE(SUM(prompt_tokens), 0) AS prompt_tokens,
+                       COALESCE(SUM(output_tokens), 0) AS output_tokens,
+                       COALESCE(SUM(total_tokens), 0) AS total_tokens,
+                       SUM(image_count) AS images,
+                       SUM(payload_bytes) AS payload_bytes,
+                       SUM(latency_ms) AS total_latency_ms,
+                       MAX(latency_ms) AS max_latency_ms
+                FROM llm_calls
+                WHERE case_number = $1
+                GROUP BY call_type
+                ORDER BY total_tokens DESC
+            ''', case_number)
+            return [dict(row) for row in rows]
+
+    async def get_llm_usage_by_day(self, days: int = 30) -> List[Dict]:
+        """Расход токенов и задержки по дням и этапам за последние days дней"""
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch('''
+                SELECT created_at::date AS day,
+                       call_type,
+                       COUNT(*) AS calls,
+                       COUNT(DISTINCT case_number) AS cases,
+                       COUNT(*) FILTER (WHERE outcome <> 'ok') AS failed_calls,
+                       SUM(attempts - 1) AS retries,
+                       COALESCE(SUM(prompt_tokens), 0) AS prompt_tokens,
+                       COALESCE(SUM(output_tokens), 0) AS output_tokens,
+                       COALESCE(SUM(total_tokens), 0) AS total_tokens,
+                       SUM(payload_bytes) AS payload_bytes,
+                       AVG(latency_ms)::INTEGER AS avg_latency_ms,
+                       (PERCENTILE_CONT(0.95) WITHIN GROUP (ORDER BY latency_ms))::INTEGER AS p95_latency_ms
+                FROM llm_calls
+                WHERE created_at >= CURRENT_DATE - make_interval(days => $1)
+                GROUP BY day, call_type
+                ORDER BY day DESC, total_tokens DESC
+            ''', days)
+            return [dict(row) for row in rows]
+
+    async def save_evidence_artifacts(
+            self,
+            evidence_id: int,
+            mime_type: Optional[str],
+            file_size: Optional[int],
+            extracted_text: Optional[str] = None
+    ):
+        """Сохраняет результаты фоновой обработки файла доказательства"""
+        async with self.pool.acquire() as conn:
+            await conn.execute('''
+                UPDATE evidence
+                SET mime_type = $2, file_size = $3, extracted_text = $4, ingested_at = NOW()
+                WHERE id = $1
+            ''', evidence_id, mime_type, file_size, extracted_text)
+
+    async def save_evidence_upload(self, evidence_id: int, uri: str, mime_type: str, expires_at: datetime):
+        async with self.pool.acquire() as conn:
+            await conn.execute('''
+                UPDATE evidence
+                SET upload_uri = $2, upload_mime_type = $3, upload_expires_at = $4
+                WHERE id = $1
+            ''', evidence_id, uri, mime_type, expires_at)
+
+    async def clear_evidence_uploads(self, evidence_ids: List[int]):
+        """Забывает ссылки, которые модель больше не принимает"""
+        async with self.pool.acquire() as conn:
+            await conn.execute('''
+                UPDATE evidence
+                SET upload_uri = NULL, upload_mime_type = NULL, upload_expires_at = NULL
+                WHERE id = ANY($1::BIGINT[])
+            ''', evidence_ids)
 
     async def get_case_evidence(self, case_number: str) -> List[Dict]:
         async with self.pool.acquire() as conn:
             rows = await conn.fetch(
                 '''
-                SELECT *
-                FROM evidence
-                WHERE case_number = $1
-                ORDER BY created_at
+                SELECT e.*, c.case_number
+                FROM evidence e
+                JOIN cases c ON c.id = e.case_id
+                WHERE c.case_number = $1
+                ORDER BY e.created_at, e.id
                 ''',
                 case_number
             )
@@ -452,27 +855,12 @@ class Database:
             file_data: bytes = None
     ):
         async with self.pool.acquire() as conn:
-            await conn.execute("""
-                INSERT INTO decisions (
-                    case_number,
-                    claim_granted,
-                    file_path,
-                    file_data,
-                    created_at
-                )
-                VALUES ($1, $2, $3, $4, NOW())
-                ON CONFLICT (case_number)
-                DO UPDATE SET
-                    claim_granted = EXCLUDED.claim_granted,
-                    file_path = EXCLUDED.file_path,
-                    file_data = EXCLUDED.file_data,
-                    created_at = NOW()
-            """, case_number, claim_granted, file_path, file_data)
+            await conn.execute(SAVE_DECISION_SQL, case_number, claim_granted, file_path, file_data)
 
     async def get_decision_file(self, case_number: str):
         async with self.pool.acquire() as conn:
             row = await conn.fetchrow(
-                "SELECT file_data FROM decisions WHERE case_number = $1",
+                "SELECT file_data FROM decisions WHERE case_id = (SELECT id FROM cases WHERE case_number = $1)",
                 case_number
             )
             if row and row["file_data"]:
@@ -481,19 +869,12 @@ class Database:
 
     async def add_participant(self, case_number: str, user_id: int, username: str, role: str):
         async with self.pool.acquire() as conn:
-            case = await conn.fetchrow(
-                "SELECT id FROM cases WHERE case_number=$1", case_number
-            )
-            if not case:
+            # Поиск дела и вставка — одна команда; пустой результат означает, что дела нет
+            case_id = await conn.fetchval(ADD_PARTICIPANT_SQL + " RETURNING case_id", case_number, user_id,
+                                          username, role)
+            if case_id is None:
                 raise ValueError(f"Дело с номером {case_number} не найдено")
 
-            case_id = case["id"]
-
-            await conn.execute("""
-                INSERT INTO participants (case_id, user_id, username, role)
-                VALUES ($1, $2, $3, $4)
-            """, case_id, user_id, username, role)
-
     async def list_participants(self, case_id: int):
         async with self.pool.acquire() as conn:
             rows = await conn.fetch("""
@@ -507,15 +888,12 @@ class Database:
     async def save_ai_question(self, case_number: str, question: str, target_role: str, round_number: int):
         """Сохранение вопроса от ИИ"""
         async with self.pool.acquire() as conn:
-            await conn.execute('''
-                INSERT INTO ai_questions (case_number, question, target_role, round_number, created_at)
-                VALUES ($1, $2, $3, $4, NOW())
-            ''', case_number, question, target_role, round_number)
+            await conn.execute(SAVE_AI_QUESTION_SQL, case_number, question, target_role, round_number)
 
     async def get_ai_questions(self, case_number: str, target_role: str = None, round_number: int = None) -> List[Dict]:
         """Получение вопросов от ИИ"""
         async with self.pool.acquire() as conn:
-            query = 'SELECT * FROM ai_questions WHERE case_number = $1'
+            query = 'SELECT * FROM ai_questions WHERE case_id = (SELECT id FROM cases WHERE case_number = $1)'
             params = [case_number]
 
             if target_role:
@@ -529,7 +907,7 @@ class Database:
                     query += ' AND round_number = $2'
                 params.append(round_number)
 
-            query += ' ORDER BY created_at'
+            query += ' ORDER BY created_at, id'
 
             rows = await conn.fetch(query, *params)
             return [dict(r) for r in rows]
@@ -539,7 +917,7 @@ class Database:
         async with self.pool.acquire() as conn:
             count = await conn.fetchval('''
                 SELECT COALESCE(MAX(round_number), 0) FROM ai_questions
-                WHERE case_number = $1 AND target_role = $2
+                WHERE case_id = (SELECT id FROM cases WHERE case_number = $1) AND target_role = $2
             ''', case_number, target_role)
             return count or 0
 
@@ -548,9 +926,9 @@ class Database:
         """Сохранение информации о группе дела"""
         async with self.pool.acquire() as conn:
             await conn.execute('''
-                INSERT INTO dispute_groups (case_number, chat_id, title, created_at)
-                VALUES ($1, $2, $3, NOW())
-                ON CONFLICT (case_number) DO UPDATE SET
+                INSERT INTO dispute_groups (case_id, chat_id, title, created_at)
+                SELECT id, $2, $3, NOW() FROM cases WHERE case_number = $1
+                ON CONFLICT (case_id) DO UPDATE SET
                 chat_id = $2, title = $3, updated_at = NOW()
             ''', case_number, chat_id, title)
 
@@ -558,7 +936,10 @@ class Database:
         """Получение информации о группе дела"""
         async with self.pool.acquire() as conn:
             row = await conn.fetchrow('''
-                SELECT * FROM dispute_groups WHERE case_number = $1
+                SELECT g.*, c.case_number
+                FROM dispute_groups g
+                JOIN cases c ON c.id = g.case_id
+                WHERE c.case_number = $1
             ''', case_number)
             return dict(row) if row else None
 
@@ -581,6 +962,35 @@ class Database:
             ''')
             return dict(row) if row else None
 
+    async def load_case_context(self, case_number: str) -> Optional[CaseContext]:
+        """Дело с участниками, доказательствами, вопросами и ответами ИИ одним запросом"""
+        async with self.pool.acquire() as conn:
+            # Дочерние таблицы приходят массивами строк, поэтому типы (даты, суммы) сохраняются
+            row = await conn.fetchrow('''
+                SELECT c.*,
+                    ARRAY(SELECT p FROM participants p WHERE p.case_id = c.id ORDER BY p.joined_at, p.id)
+                        AS context_participants,
+                    ARRAY(SELECT e FROM evidence e WHERE e.case_id = c.id ORDER BY e.created_at, e.id)
+                        AS context_evidence,
+                    ARRAY(SELECT q FROM ai_questions q WHERE q.case_id = c.id ORDER BY q.created_at, q.id)
+                        AS context_ai_questions,
+                    ARRAY(SELECT a FROM ai_answers a WHERE a.case_id = c.id ORDER BY a.created_at, a.id)
+                        AS context_ai_answers
+                FROM cases c
+                WHERE c.case_number = $1
+            ''', case_number)
+            if row is None:
+                return None
+
+            case = dict(row)
+            children = {
+                name: [dict(item) for item in case.pop(f"context_{name}")]
+                for name in ("participants", "evidence", "ai_questions", "ai_answers")
+            }
+            for ev in children["evidence"]:
+                ev["case_number"] = case_number
+            return CaseContext(case=case, **children)
+
     async def get_case_with_full_info(self, case_number: str) -> Optional[Dict]:
         """Получение дела с полной информацией включая участников и доказательства"""
         async with self.pool.acquire() as conn:
@@ -594,15 +1004,15 @@ class Database:
                 SELECT role, username, user_id, joined_at
                 FROM participants 
                 WHERE case_id = $1
-                ORDER BY joined_at
+                ORDER BY joined_at, id
             ''', case_dict['id'])
             case_dict['participants'] = [dict(p) for p in participants]
 
             evidence = await conn.fetch('''
-                SELECT * FROM evidence 
-                WHERE case_id = $1 
-                ORDER BY created_at
-            ''', case_dict['id'])
+                SELECT *, $2::VARCHAR AS case_number FROM evidence
+                WHERE case_id = $1
+                ORDER BY created_at, id
+            ''', case_dict['id'], case_number)
             case_dict['evidence'] = [dict(e) for e in evidence]
 
             return case_dict
@@ -611,11 +1021,7 @@ class Database:
         """Удаление дела и всех связанных данных"""
         async with self.pool.acquire() as conn:
             try:
-                await conn.execute('DELETE FROM ai_questions WHERE case_number = $1', case_number)
-                await conn.execute('DELETE FROM ai_answers WHERE case_number = $1', case_number)
-                await conn.execute('DELETE FROM decisions WHERE case_number = $1', case_number)
-                await conn.execute('DELETE FROM dispute_groups WHERE case_number = $1', case_number)
-
+                # Участники, доказательства, вопросы, ответы и решение удаляются каскадно
                 deleted_count = await conn.fetchval(
                     'DELETE FROM cases WHERE case_number = $1 RETURNING id',
                     case_number
@@ -680,15 +1086,13 @@ class Database:
     async def get_evidence_by_role(self, case_number: str, role: str) -> List[Dict]:
         """Получение доказательств по роли участника"""
         async with self.pool.acquire() as conn:
-            case_id = await conn.fetchval('SELECT id FROM cases WHERE case_number = $1', case_number)
-            if not case_id:
-                return []
-
             rows = await conn.fetch('''
-                SELECT * FROM evidence 
-                WHERE case_id = $1 AND role = $2 
-                ORDER BY created_at
-            ''', case_id, role)
+                SELECT e.*, c.case_number
+                FROM evidence e
+                JOIN cases c ON c.id = e.case_id
+                WHERE c.case_number = $1 AND e.role = $2
+                ORDER BY e.created_at, e.id
+            ''', case_number, role)
 
             result = []
             for row in rows:
@@ -698,21 +1102,29 @@ class Database:
                 result.append(evidence_dict)
             return result
 
+    async def get_ai_answers(self, case_number: str, role: str, round_number: int) -> List[Dict]:
+        """Ответы стороны на вопросы ИИ в раунде, в порядке поступления"""
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch('''
+                SELECT * FROM ai_answers
+                WHERE case_id = (SELECT id FROM cases WHERE case_number = $1)
+                AND role = $2
+                AND round_number = $3
+                ORDER BY created_at, id
+            ''', case_number, role, round_number)
+            return [dict(r) for r in rows]
+
     async def get_answered_ai_questions_count(self, case_number: str, role: str, round_number: int) -> int:
         """Получить количество отвеченных вопросов в данном раунде"""
         async with self.pool.acquire() as conn:
-            case_id = await conn.fetchval('SELECT id FROM cases WHERE case_number = $1', case_number)
-            if not case_id:
-                return 0
-
             count = await conn.fetchval('''
-                SELECT COUNT(*) 
-                FROM evidence 
-                WHERE case_id = $1 
-                AND role = $2 
+                SELECT COUNT(*)
+                FROM evidence
+                WHERE case_id = (SELECT id FROM cases WHERE case_number = $1)
+                AND role = $2
                 AND round_number = $3
                 AND type = 'ai_response'
-            ''', case_id, role, round_number)
+            ''', case_number, role, round_number)
 
             return count or 0
 
@@ -735,51 +1147,13 @@ class Database:
                 for case in old_cases:
                     print(f"  - {case['case_number']}: {case['topic'][:50]} (создано: {case['created_at']})")
 
-                # Удаляем связанные данные
-                deleted_ai_questions = await conn.execute(f"""
-                    DELETE FROM ai_questions
-                    WHERE case_number IN (
-                        SELECT case_number FROM cases
-                        WHERE created_at < NOW() - INTERVAL '{DELETE_OLDER_THAN_DAYS} days'
-                    )
-                """)
-
-                deleted_ai_answers = await conn.execute(f"""
-                    DELETE FROM ai_answers
-                    WHERE case_number IN (
-                        SELECT case_number FROM cases
-                        WHERE created_at < NOW() - INTERVAL '{DELETE_OLDER_THAN_DAYS} days'
-                    )
-                """)
-
-                deleted_decisions = await conn.execute(f"""
-                    DELETE FROM decisions
-                    WHERE case_number IN (
-                        SELECT case_number FROM cases
-                        WHERE created_at < NOW() - INTERVAL '{DELETE_OLDER_THAN_DAYS} days'
-                    )
-                """)
-
-                deleted_groups = await conn.execute(f"""
-                    DELETE FROM dispute_groups
-                    WHERE case_number IN (
-                        SELECT case_number FROM cases
-                        WHERE created_at < NOW() - INTERVAL '{DELETE_OLDER_THAN_DAYS} days'
-                    )
-                """)
-
-                # Удаляем сами дела (CASCADE удалит evidence и participants)
+                # Связанные данные (доказательства, вопросы, ответы, решения, группы) удаляются каскадно
                 result = await conn.execute(f"""
                     DELETE FROM cases
                     WHERE created_at < NOW() - INTERVAL '{DELETE_OLDER_THAN_DAYS} days'
                 """)
 
-                print(f"✅ Очистка завершена:")
-                print(f"   - Удалено дел: {len(old_cases)}")
-                print(f"   - Удалено AI вопросов: {deleted_ai_questions}")
-                print(f"   - Удалено AI ответов: {deleted_ai_answers}")
-                print(f"   - Удалено решений: {deleted_decisions}")
-                print(f"   - Удалено групп: {deleted_groups}")
+                print(f"✅ Очистка завершена, удалено дел: {result.split()[-1]}")
 
         except Exception as e:
             print(f"❌ Ошибка при очистке старых записей: {e}")
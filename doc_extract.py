@@ -0,0 +1,222 @@
+import asyncio
+import io
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, List, Optional
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from conf import settings
+
+
+# =============================================================================
+# Extraction itself (runs inside worker processes)
+# =============================================================================
+
+class _TextBudget:
+    """Collects text parts until the character budget is spent"""
+
+    def __init__(self, max_chars: int):
+        self.max_chars = max_chars
+        self.parts: List[str] = []
+        self.size = 0
+
+    @property
+    def full(self) -> bool:
+        return self.size >= self.max_chars
+
+    def add(self, text: str):
+        if not text or self.full:
+            return
+        text = text[:self.max_chars - self.size]
+        self.parts.append(text)
+        self.size += len(text)
+
+    def result(self, note: Optional[str] = None) -> str:
+        text = "\n".join(self.parts).strip()
+        if note:
+            text += f"\n[{note}]"
+        return text
+
+
+def _extract_pdf(file_bytes: bytes, max_pages: int, max_chars: int) -> str:
+    budget = _TextBudget(max_chars)
+    try:
+        import pymupdf
+
+        with pymupdf.open(stream=file_bytes, filetype="pdf") as doc:
+            total_pages = doc.page_count
+            read_pages = 0
+            for page in doc:
+                if read_pages >= max_pages or budget.full:
+                    break
+                budget.add(page.get_text("text"))
+                read_pages += 1
+    except ImportError:
+        import PyPDF2
+
+        reader = PyPDF2.PdfReader(io.BytesIO(file_bytes))
+        total_pages = len(reader.pages)
+        read_pages = 0
+        for page in reader.pages:
+            if read_pages >= max_pages or budget.full:
+                break
+            budget.add(page.extract_text() or "")
+            read_pages += 1
+
+    note = None
+    if read_pages < total_pages:
+        note = f"Truncated: {read_pages} of {total_pages} pages read"
+    elif budget.full:
+        note = f"Truncated at {max_chars} characters"
+    return budget.result(note)
+
+
+def _extract_docx(file_bytes: bytes, max_chars: int) -> str:
+    from docx import Document
+    from docx.table import Table
+
+    budget = _TextBudget(max_chars)
+    doc = Document(io.BytesIO(file_bytes))
+    # Paragraphs and tables in document order
+    for block in doc.iter_inner_content():
+        if budget.full:
+            break
+        if isinstance(block, Table):
+            for row in block.rows:
+                cells = []
+                for cell in row.cells:
+                    # Merged cells repeat in python-docx
+                    if not cells or cells[-1] != cell.text:
+                        cells.append(cell.text)
+                budget.add(" | ".join(cells))
+        else:
+            budget.add(block.text)
+
+    return budget.result(f"Truncated at {max_chars} characters" if budget.full else None)
+
+
+def _extract_txt(file_bytes: bytes, max_chars: int) -> str:
+    # 4 bytes per character covers any UTF-8 text
+    chunk = file_bytes[:max_chars * 4]
+    try:
+        text = chunk.decode('utf-8')
+    except UnicodeDecodeError:
+        try:
+            text = chunk.decode('cp1251')
+        except UnicodeDecodeError:
+            return "Error decoding text file"
+    if len(text) > max_chars or len(file_bytes) > len(chunk):
+        return text[:max_chars] + f"\n[Truncated at {max_chars} characters]"
+    return text
+
+
+def extract_text(file_bytes: bytes, filename: str, max_pages: int, max_chars: int) -> str:
+    """Extracts text from a PDF, DOCX or TXT document within the page and character budget"""
+    filename_lower = filename.lower()
+
+    if filename_lower.endswith('.pdf'):
+        try:
+            return _extract_pdf(file_bytes, max_pages, max_chars)
+        except Exception as e:
+            return f"Error reading PDF: {e}"
+    elif filename_lower.endswith('.docx'):
+        try:
+            return _extract_docx(file_bytes, max_chars)
+        except Exception as e:
+            return f"Error reading DOCX: {e}"
+    elif filename_lower.endswith('.txt'):
+        return _extract_txt(file_bytes, max_chars)
+    else:
+        return f"Unsupported document format: {filename}"
+
+
+def _limit_worker_memory(max_bytes: int):
+    if resource and max_bytes:
+        resource.setrlimit(resource.RLIMIT_AS, (max_bytes, max_bytes))
+
+
+# =============================================================================
+# Process pool wrapper (used from the event loop)
+# =============================================================================
+
+class DocumentExtractor:
+    """
+    Runs extract_text in a pool of worker processes, so parsing a large document never
+    blocks the event loop. Each worker has an address-space cap, and a call that exceeds
+    its timeout gets its pool torn down and recreated.
+
+    extract_func runs in the workers and must be picklable (a module-level function).
+    """
+
+    def __init__(self, workers: int, timeout: float, memory_mb: int, max_pages: int, max_chars: int,
+                 extract_func: Callable[[bytes, str, int, int], str] = extract_text):
+        self.workers = workers
+        self.timeout = timeout
+        self.memory_bytes = memory_mb * 1024 * 1024
+        self.max_pages = max_pages
+        self.max_chars = max_chars
+        self.extract_func = extract_func
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                # Forking a process with a running event loop and open sockets is unsafe
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_limit_worker_memory,
+                initargs=(self.memory_bytes,)
+            )
+        return self._pool
+
+    async def extract(self, file_bytes: bytes, filename: str) -> str:
+        loop = asyncio.get_running_loop()
+        for attempt in range(2):
+            # Each call resets only the pool it used: a newer pool belongs to calls that are still fine
+            pool = self._get_pool()
+            try:
+                future = loop.run_in_executor(
+                    pool, self.extract_func, file_bytes, filename, self.max_pages, self.max_chars
+                )
+                return await asyncio.wait_for(future, timeout=self.timeout)
+            except asyncio.TimeoutError:
+                print(f"Document extraction timed out after {self.timeout}s: {filename}")
+                self._reset(pool)
+                return f"Error reading document: extraction timed out after {self.timeout:.0f}s"
+            except MemoryError:
+                return "Error reading document: memory limit exceeded"
+            except BrokenProcessPool:
+                if attempt == 0 and self._pool is not pool:
+                    # The pool was torn down because of another document, so this one is tried again
+                    continue
+                # A worker died, most likely on the memory cap
+                self._reset(pool)
+                return "Error reading document: extraction process crashed"
+
+    def _reset(self, pool: ProcessPoolExecutor):
+        if pool is None or self._pool is not pool:
+            return
+        self._pool = None
+        # The stuck worker does not react to cancellation, so it is killed
+        for process in list((pool._processes or {}).values()):
+            process.terminate()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+document_extractor = DocumentExtractor(
+    workers=settings.DOC_EXTRACT_WORKERS,
+    timeout=settings.DOC_EXTRACT_TIMEOUT,
+    memory_mb=settings.DOC_EXTRACT_MEMORY_MB,
+    max_pages=settings.DOC_MAX_PAGES,
+    max_chars=settings.DOC_MAX_CHARS
+)
@@ -0,0 +1,93 @@
+"""
+Evidence insert benchmark: per-row add_evidence against the batched paths at several batch sizes.
+
+    per-row      add_evidence once per row, a pool acquisition and an INSERT each
+    executemany  the same INSERT ... SELECT for all rows in one transaction (pipelined)
+    copy         add_evidence_bulk, one case lookup and one COPY stream
+    uow          UnitOfWork.add_evidence_bulk, the path forwarded chat history takes
+
+Needs the bot's database (DATABASE_URL); every run creates a throwaway case and deletes it,
+which removes its evidence by cascade.
+
+    python evidence_bench.py --sizes 10 100 1000 --repeat 5
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from typing import Awaitable, Callable, List
+
+from database import ADD_EVIDENCE_SQL, EvidenceRow, db
+
+
+def make_rows(case_number: str, count: int) -> List[EvidenceRow]:
+    return [
+        EvidenceRow(case_number, 1, "plaintiff" if i % 2 else "defendant", "text",
+                    f"Benchmark argument {i}: the work was delivered and payment was promised. " * 4)
+        for i in range(count)
+    ]
+
+
+async def per_row(rows: List[EvidenceRow]):
+    for row in rows:
+        await db.add_evidence(row.case_number, row.user_id, row.role, row.ev_type, row.content, row.file_id)
+
+
+async def executemany(rows: List[EvidenceRow]):
+    async with db.pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.executemany(ADD_EVIDENCE_SQL, [
+                (row.case_number, row.user_id, row.role, row.ev_type, row.content, row.file_id, row.file_name,
+                 row.round_number)
+                for row in rows
+            ])
+
+
+async def copy(rows: List[EvidenceRow]):
+    await db.add_evidence_bulk(rows)
+
+
+async def unit_of_work(rows: List[EvidenceRow]):
+    async with db.unit_of_work() as uow:
+        uow.add_evidence_bulk(rows)
+
+
+METHODS = {"per-row": per_row, "executemany": executemany, "copy": copy, "uow": unit_of_work}
+
+
+async def measure(method: Callable[[List[EvidenceRow]], Awaitable], size: int, repeat: int) -> List[float]:
+    samples = []
+    for _ in range(repeat):
+        case_number = await db.create_case(
+            topic="Evidence benchmark", category="benchmark", mode="full", claim_reason="benchmark",
+            plaintiff_id=1, plaintiff_username="benchmark", chat_id=0
+        )
+        try:
+            rows = make_rows(case_number, size)
+            started = time.perf_counter()
+            await method(rows)
+            samples.append(time.perf_counter() - started)
+        finally:
+            await db.delete_case(case_number)
+    return samples
+
+
+async def run(args: argparse.Namespace):
+    await db.connect()
+    try:
+        print(f"{'rows':>6}{'method':>14}{'median, ms':>13}{'min, ms':>10}{'rows/s':>10}")
+        for size in args.sizes:
+            for name, method in METHODS.items():
+                samples = await measure(method, size, args.repeat)
+                median = statistics.median(samples)
+                print(f"{size:>6}{name:>14}{median * 1000:>13.1f}{min(samples) * 1000:>10.1f}"
+                      f"{size / median:>10.0f}")
+    finally:
+        await db.pool.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare per-row and bulk evidence inserts")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--repeat", type=int, default=3, help="runs per size and method, the median is reported")
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,64 @@
+import asyncio
+from typing import Optional, Set
+
+from aiogram import Bot
+
+from conf import settings
+from database import db
+from gemini_servise import gemini_service
+from media_cache import media_cache
+
+INGESTED_TYPES = ("photo", "document")
+
+
+class EvidenceIngestor:
+    """
+    Background ingestion of uploaded evidence.
+
+    Right after a party sends a photo or document, the file is downloaded into the media
+    cache, its MIME type and size are detected, images are normalized and document text is
+    extracted. The results are stored on the evidence row and in the cache, so the prompt is
+    assembled from ready data at question/verdict time while the slow work overlaps with
+    the parties still typing.
+    """
+
+    def __init__(self, concurrency: int):
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._tasks: Set[asyncio.Task] = set()
+
+    def schedule(self, bot: Bot, evidence_id: int, ev_type: str, file_id: Optional[str],
+                 file_name: Optional[str] = None):
+        """Starts ingestion of a freshly saved evidence row without waiting for it"""
+        if ev_type not in INGESTED_TYPES or not file_id or not evidence_id:
+            return
+        task = asyncio.create_task(self._ingest(bot, evidence_id, ev_type, file_id, file_name))
+        # Keep a strong reference until the task finishes
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _ingest(self, bot: Bot, evidence_id: int, ev_type: str, file_id: str, file_name: Optional[str]):
+        async with self._semaphore:
+            try:
+                file_bytes = await media_cache.fetch(bot, file_id)
+                if not file_bytes:
+                    return
+
+                mime_type = gemini_service.detect_mime_type(file_bytes, file_name)
+                extracted_text = None
+                if mime_type.startswith("image/"):
+                    # Warms the normalized-image cache used by prompt assembly
+                    await gemini_service.prepare_image(bot, file_id, file_name)
+                elif ev_type == "document" and file_name:
+                    extracted_text = await gemini_service.extract_text_from_document(file_bytes, file_name)
+
+                await db.save_evidence_artifacts(
+                    evidence_id,
+                    mime_type=mime_type,
+                    file_size=len(file_bytes),
+                    extracted_text=extracted_text
+                )
+            except Exception as e:
+                print(f"Error ingesting evidence {evidence_id}: {e}")
+
+
+evidence_ingestor = EvidenceIngestor(settings.INGEST_CONCURRENCY)
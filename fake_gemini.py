@@ -0,0 +1,233 @@
+import asyncio
+import json
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from itertools import count
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from conf import settings
+from media_uploads import UploadedFile
+
+# Tokens Gemini bills for one image of up to 384px per side; a fair average for screenshots
+IMAGE_TOKENS = 258
+
+
+class FakeUsage:
+    """Same attribute names as UsageMetadata of a real response"""
+
+    def __init__(self, prompt_token_count: int, candidates_token_count: int):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+        self.total_token_count = prompt_token_count + candidates_token_count
+
+
+class FakeResponse:
+    def __init__(self, text: str, usage_metadata: Optional[FakeUsage] = None):
+        self.text = text
+        self.usage_metadata = usage_metadata
+
+
+class FakeStreamResponse(FakeResponse):
+    """Yields the answer in small chunks like a streamed Gemini response"""
+
+    def __init__(self, text: str, chunk_chars: int, chunk_delay: float, usage_metadata: Optional[FakeUsage] = None):
+        super().__init__(text, usage_metadata)
+        self.chunk_chars = chunk_chars
+        self.chunk_delay = chunk_delay
+
+    async def __aiter__(self):
+        for start in range(0, len(self.text), self.chunk_chars):
+            await asyncio.sleep(self.chunk_delay)
+            yield FakeResponse(self.text[start:start + self.chunk_chars])
+
+
+def default_faults() -> List[Exception]:
+    """The transient errors Gemini returns under load; api_core is imported only when they are needed"""
+    from google.api_core import exceptions as google_exceptions
+    return [
+        google_exceptions.ResourceExhausted("429 Resource has been exhausted (fake)"),
+        google_exceptions.ServiceUnavailable("503 The service is currently unavailable (fake)"),
+        google_exceptions.InternalServerError("500 Internal error (fake)"),
+    ]
+
+
+class FakeFileService:
+    """
+    In-memory stand-in for the Gemini File API. upload() returns a handle that expires after
+    ttl seconds; a model given this service rejects requests that reference an unknown or
+    expired file with 403, like the real API.
+    """
+
+    def __init__(self, ttl: float, latency: Sequence[float] = (0.01, 0.05)):
+        self.ttl = ttl
+        self.latency = latency
+        self.files: Dict[str, Tuple[int, datetime]] = {}
+        self.uploads = 0
+        self._ids = count(1)
+
+    async def upload(self, data: bytes, mime_type: str, display_name: str) -> UploadedFile:
+        await asyncio.sleep(random.uniform(*self.latency))
+        self.uploads += 1
+        uri = f"fake://files/{next(self._ids)}"
+        expires_at = datetime.now(timezone.utc) + timedelta(seconds=self.ttl)
+        self.files[uri] = (len(data), expires_at)
+        return UploadedFile(uri, mime_type, expires_at)
+
+    def expire(self, uri: Optional[str] = None):
+        """Makes one file (or all of them) unknown to the service, as after the provider's retention period"""
+        if uri is None:
+            self.files.clear()
+        else:
+            self.files.pop(uri, None)
+
+    def check(self, uri: str):
+        stored = self.files.get(uri)
+        if stored is None or stored[1] <= datetime.now(timezone.utc):
+            from google.api_core import exceptions as google_exceptions
+            raise google_exceptions.PermissionDenied(
+                f"403 You do not have permission to access the File {uri} or it may not exist (fake)"
+            )
+
+
+class FakeGeminiModel:
+    """
+    Local stand-in for genai.GenerativeModel with the same generate_content_async signature.
+
+    Each call sleeps for a random latency (with an optional slow tail), then either raises one of
+    the configured faults with probability fault_rate or answers. In JSON mode the answer is an
+    object matching the requested response_schema with list_items entries in every list;
+    responder can override the text. usage_metadata is estimated from the character count.
+    With a seed the sequence of latencies, faults and answers is reproducible.
+    """
+
+    def __init__(self, latency: Sequence[float] = (0.05, 0.2), fault_rate: float = 0.0,
+                 faults: Optional[Sequence[Exception]] = None, tail_rate: float = 0.0,
+                 tail_latency: float = 5.0, responder: Optional[Callable[[List, Dict], str]] = None,
+                 seed: Optional[int] = None, list_items: int = 0, chars_per_token: float = 4.0,
+                 file_service: Optional[FakeFileService] = None):
+        self.latency = latency
+        self.fault_rate = fault_rate
+        self.faults = list(faults) if faults is not None else default_faults()
+        self.tail_rate = tail_rate
+        self.tail_latency = tail_latency
+        self.responder = responder
+        self.list_items = list_items
+        self.chars_per_token = chars_per_token
+        self.file_service = file_service
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.failures = 0
+        # Load statistics: requests being served right now, the peak, and total time spent serving
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.busy_seconds = 0.0
+
+    async def generate_content_async(self, contents, generation_config: Optional[Dict] = None,
+                                     stream: bool = False, **kwargs):
+        self.calls += 1
+        generation_config = generation_config or {}
+
+        delay = self.random.uniform(*self.latency)
+        if self.random.random() < self.tail_rate:
+            delay += self.tail_latency
+        fault = self.random.choice(self.faults) if self.faults and self.random.random() < self.fault_rate else None
+
+        if self.file_service is not None:
+            for part in contents if isinstance(contents, list) else [contents]:
+                if isinstance(part, dict) and "file_data" in part:
+                    self.file_service.check(part["file_data"]["file_uri"])
+
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        started = time.monotonic()
+        try:
+            await asyncio.sleep(delay)
+        finally:
+            self.in_flight -= 1
+            self.busy_seconds += time.monotonic() - started
+
+        if fault is not None:
+            self.failures += 1
+            raise fault
+
+        schema = generation_config.get("response_schema")
+        if self.responder is not None:
+            text = self.responder(contents, generation_config)
+        elif generation_config.get("response_mime_type") == "application/json" and schema is not None:
+            text = json.dumps(sample_for_schema(schema, self.random, self.list_items))
+        else:
+            text = "Fake reasoning: the evidence was reviewed by the local fake model."
+
+        usage = FakeUsage(self._count_prompt_tokens(contents), self._count_tokens(text))
+        if stream:
+            return FakeStreamResponse(text, chunk_chars=16, chunk_delay=0.01, usage_metadata=usage)
+        return FakeResponse(text, usage)
+
+    def _count_tokens(self, text: str) -> int:
+        return int(len(text) / self.chars_per_token) + 1
+
+    def _count_prompt_tokens(self, contents) -> int:
+        if isinstance(contents, (str, dict)):
+            contents = [contents]
+        tokens = 0
+        for part in contents:
+            if isinstance(part, dict):
+                mime_type = part.get("mime_type") or part.get("file_data", {}).get("mime_type") or ""
+                tokens += IMAGE_TOKENS if mime_type.startswith("image/") else 0
+            else:
+                tokens += self._count_tokens(str(part))
+        return tokens
+
+
+def sample_for_schema(schema: Dict, rng: Optional[random.Random] = None, list_items: int = 0,
+                      name: str = "value"):
+    """
+    A value that satisfies a response schema dict (see schemas.gemini_schema).
+    Without rng it is the smallest one (first enum value, empty lists, zeros); with rng enum
+    values, numbers and booleans are drawn from it and every list gets list_items entries.
+    """
+    if schema.get("enum"):
+        return rng.choice(schema["enum"]) if rng else schema["enum"][0]
+    schema_type = schema.get("type")
+    if schema_type == "object":
+        return {
+            field: sample_for_schema(value, rng, list_items, field)
+            for field, value in schema.get("properties", {}).items()
+        }
+    if schema_type == "array":
+        if rng is None:
+            return []
+        item_name = name[:-1] if name.endswith("s") else name
+        return [
+            sample_for_schema(schema.get("items", {}), rng, list_items, f"{item_name} {i}")
+            for i in range(1, list_items + 1)
+        ]
+    if schema_type == "integer":
+        return rng.randint(0, 1000) if rng else 0
+    if schema_type == "number":
+        return round(rng.uniform(0, 1000), 2) if rng else 0
+    if schema_type == "boolean":
+        return rng.random() < 0.5 if rng else False
+    if rng is None:
+        return ""
+    return f"Fake {name.replace('_', ' ')}" + ("?" if name.startswith("question") else ".")
+
+
+def create_fake_model_factory() -> Callable[[str], FakeGeminiModel]:
+    """Model factory for GeminiService built from the FAKE_GEMINI_* settings"""
+    def factory(model_name: str) -> FakeGeminiModel:
+        return FakeGeminiModel(
+            latency=settings.FAKE_GEMINI_LATENCY,
+            fault_rate=settings.FAKE_GEMINI_FAULT_RATE,
+            tail_rate=settings.FAKE_GEMINI_TAIL_RATE,
+            tail_latency=settings.FAKE_GEMINI_TAIL_LATENCY,
+            seed=settings.FAKE_GEMINI_SEED,
+            list_items=settings.FAKE_GEMINI_LIST_ITEMS,
+            chars_per_token=settings.FAKE_GEMINI_CHARS_PER_TOKEN,
+            file_service=fake_file_service
+        )
+    return factory
+
+
+fake_file_service = FakeFileService(ttl=settings.FAKE_GEMINI_FILE_TTL)
@@ -1,38 +1,403 @@
-import base64
-import io
-import json
-from typing import List, Dict, Union
-
-import PyPDF2
-import google.generativeai as genai
+import asyncio
+import contextlib
+import functools
+import mimetypes
+import re
+import time
+from typing import TYPE_CHECKING, Awaitable, Callable, List, Dict, Union, Optional, Tuple, Type
+
+from pydantic import BaseModel, ValidationError
 from aiogram import Bot
-from aiogram.types import File
-from docx import Document
 
-from conf import settings
+from conf import GenerationProfile, settings
+from database import db
+from doc_extract import document_extractor
+from image_norm import NormalizedImage, normalize_image, hamming_distance
+from llm_resilience import CircuitBreaker, CircuitOpenError, LLMUnavailableError, ResilientCaller
+from media_cache import media_cache
+from media_uploads import UploadedPart, inline_parts, media_registry
+from prompt_budget import PromptBudget, format_report
+from relevance_index import evidence_index
+from result_cache import fingerprint, result_cache
+from schemas import (
+    AnalysisResponse, DecisionResponse, JointQuestionsResponse, QuestionsResponse, decision_progress, gemini_schema
+)
+
+
+if TYPE_CHECKING:
+    import google.generativeai as genai
+
+_FILE_WORD_RE = re.compile(r"\bfiles?\b", re.IGNORECASE)
+
+
+@functools.lru_cache(maxsize=None)
+def file_reference_errors() -> Tuple[Type[BaseException], ...]:
+    """Answers to a request that references a file the provider no longer has"""
+    from google.api_core import exceptions as google_exceptions
+    return (
+        google_exceptions.PermissionDenied,
+        google_exceptions.NotFound,
+        google_exceptions.FailedPrecondition,
+        google_exceptions.InvalidArgument,
+    )
+
+
+def stale_uploads(error: BaseException, messages: List) -> List[UploadedPart]:
+    """
+    The uploaded parts the error rejects; empty when the error is not about file references.
+    InvalidArgument is also the answer to a bad schema or an oversized prompt, so it counts only
+    when it is about a file. Only the files the message names are dropped if it names any.
+    """
+    uploaded = [part for part in messages if isinstance(part, UploadedPart)]
+    if not uploaded or not isinstance(error, file_reference_errors()):
+        return []
+    text = str(error)
+    named = [part for part in uploaded if part["file_data"]["file_uri"] in text]
+    if named:
+        return named
+    from google.api_core import exceptions as google_exceptions
+    if isinstance(error, google_exceptions.InvalidArgument) and not _FILE_WORD_RE.search(text):
+        return []
+    return uploaded
+
+
+class DecisionGenerationError(Exception):
+    """The model answered, but no valid decision could be made from the answer; the verdict job retries"""
+
+
+@functools.lru_cache(maxsize=None)
+def thinking_supported() -> bool:
+    """Older generativelanguage protos have no thinking_config; the budget is skipped there"""
+    import google.generativeai as genai
+    return "thinking_config" in genai.protos.GenerationConfig.meta.fields
+
+
+def default_model_factory() -> Callable[[str], "genai.GenerativeModel"]:
+    """
+    Model factory of the backend selected by settings.GEMINI_BACKEND.
+    The SDK (grpc, protobuf) is imported here, on the first model call, not at bot startup.
+    """
+    if settings.GEMINI_BACKEND == "fake":
+        from fake_gemini import create_fake_model_factory
+        print("Using the offline fake Gemini backend")
+        return create_fake_model_factory()
+    if settings.GEMINI_BACKEND != "google":
+        raise ValueError(f"Unknown GEMINI_BACKEND: {settings.GEMINI_BACKEND}")
+
+    import google.generativeai as genai
+    genai.configure(api_key=settings.GEMINI_API_KEY)
+    return genai.GenerativeModel
 
 
 class GeminiService:
-    def __init__(self):
-        genai.configure(api_key=settings.GEMINI_API_KEY)
-        self.model = genai.GenerativeModel('gemini-2.5-flash')
+    def __init__(self, model_factory: Callable[[str], "genai.GenerativeModel"] = None):
+        """
+        model_factory builds a model by name; by default it follows settings.GEMINI_BACKEND,
+        so a FakeGeminiModel can replace the API for load and fault tests.
+        Construction is cheap: the backend is set up on the first model call.
+        """
+        self._model_factory = model_factory
+        self._models: Dict[str, "genai.GenerativeModel"] = {}
+        # Limits how many requests to Gemini are in flight at once across all cases
+        self._semaphore = asyncio.Semaphore(settings.GEMINI_MAX_CONCURRENCY)
+        self._caller = ResilientCaller(
+            max_attempts=settings.GEMINI_MAX_ATTEMPTS,
+            base_delay=settings.GEMINI_RETRY_BASE_DELAY,
+            max_delay=settings.GEMINI_RETRY_MAX_DELAY,
+            deadlines=settings.GEMINI_DEADLINES,
+            default_deadline=settings.GEMINI_DECISION_TIMEOUT,
+            breaker=CircuitBreaker(settings.GEMINI_BREAKER_THRESHOLD, settings.GEMINI_BREAKER_RESET),
+            hedge=settings.GEMINI_HEDGE_ENABLED,
+            hedge_quantile=settings.GEMINI_HEDGE_QUANTILE,
+            hedge_min_samples=settings.GEMINI_HEDGE_MIN_SAMPLES
+        )
+        # Telemetry inserts run in the background; references are kept until they finish
+        self._telemetry_tasks: set = set()
+        self._thinking_warning_logged = False
+
+    def _get_model(self, model_name: str) -> "genai.GenerativeModel":
+        if self._model_factory is None:
+            self._model_factory = default_model_factory()
+        if model_name not in self._models:
+            self._models[model_name] = self._model_factory(model_name)
+        return self._models[model_name]
+
+    def _generation_config(self, profile: GenerationProfile, response_model: Type[BaseModel] = None) -> Dict:
+        config = {}
+        can_think = thinking_supported()
+        if profile.max_output_tokens is not None:
+            config["max_output_tokens"] = profile.max_output_tokens
+            # Gemini 2.5 counts thinking against max_output_tokens; while the budget cannot be sent
+            # separately the cap makes room for it, so thinking does not cut the answer itself
+            if profile.thinking_budget and not can_think:
+                config["max_output_tokens"] += profile.thinking_budget
+        if profile.temperature is not None:
+            config["temperature"] = profile.temperature
+        if profile.thinking_budget is not None:
+            if can_think:
+                config["thinking_config"] = {"thinking_budget": profile.thinking_budget}
+            elif not self._thinking_warning_logged:
+                self._thinking_warning_logged = True
+                print("Installed Gemini SDK does not support thinking_config: thinking budgets are not sent, "
+                      "the output caps of thinking profiles include the budget")
+        if response_model is not None:
+            config["response_mime_type"] = "application/json"
+            config["response_schema"] = gemini_schema(response_model)
+        return config
+
+    async def _generate(self, messages: List[Union[str, Dict]], profile: str, timeout: float = None,
+                        response_model: Type[BaseModel] = None,
+                        on_text: Callable[[str], Awaitable[None]] = None,
+                        case_number: Optional[str] = None):
+        """
+        Calls the model through the async client so the event loop keeps serving other chats.
+        Transient errors are retried with backoff within the deadline of the profile
+        (settings.GEMINI_DEADLINES); LLMUnavailableError is raised when that runs out.
+        timeout applies to a single attempt; waiting for a free slot is not counted towards it.
+        profile names an entry of settings.GENERATION_PROFILES (model, thinking budget, output cap).
+        With response_model the model answers in JSON mode constrained to that schema.
+        With on_text the response is streamed and on_text gets the text accumulated so far.
+        Every call is recorded in llm_calls under case_number (see _record_call).
+        """
+        generation_profile = settings.GENERATION_PROFILES.get(profile) or GenerationProfile()
+        model = self._get_model(generation_profile.model)
+        generation_config = self._generation_config(generation_profile, response_model)
+
+        async def attempt(attempt_timeout: float):
+            nonlocal messages
+            async with self._semaphore:
+                loop = asyncio.get_running_loop()
+                deadline = loop.time() + attempt_timeout
+                try:
+                    return await asyncio.wait_for(self._request(model, messages, generation_config, on_text),
+                                                  timeout=attempt_timeout)
+                except Exception as e:
+                    stale = stale_uploads(e, messages)
+                    if not stale:
+                        raise
+                    # The provider dropped an uploaded file before its expiry: resend the bytes inline
+                    evidence_ids = await media_registry.forget(stale)
+                    print(f"File references {evidence_ids} rejected ({e!r}), resending them inline")
+                    messages = inline_parts(messages)
+                    return await asyncio.wait_for(self._request(model, messages, generation_config, on_text),
+                                                  timeout=max(deadline - loop.time(), 0.001))
+
+        stats: Dict = {}
+        started = time.monotonic()
+        response, outcome, error = None, "ok", None
+        try:
+            response = await self._caller.call(
+                profile, attempt, timeout or settings.GEMINI_CALL_TIMEOUT, hedge=on_text is None, stats=stats
+            )
+            return response
+        except CircuitOpenError as e:
+            outcome, error = "circuit_open", repr(e)
+            raise
+        except LLMUnavailableError as e:
+            outcome, error = "unavailable", repr(e)
+            raise
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        except Exception as e:
+            outcome, error = "error", repr(e)
+            raise
+        finally:
+            self._record_call(
+                case_number, profile, generation_profile.model, messages, response,
+                time.monotonic() - started, stats.get("attempts", 0), outcome, error
+            )
+
+    def _record_call(self, case_number: Optional[str], call_type: str, model: str,
+                     messages: List[Union[str, Dict]], response, latency: float, attempts: int,
+                     outcome: str, error: Optional[str]):
+        """Stores token usage, payload size, latency and outcome of a call without delaying the caller"""
+        if not settings.LLM_TELEMETRY_ENABLED:
+            return
+
+        image_count = payload_bytes = 0
+        for part in messages:
+            if isinstance(part, dict):
+                payload_bytes += len(part.get("data") or b"")
+                mime_type = part.get("mime_type") or part.get("file_data", {}).get("mime_type") or ""
+                if mime_type.startswith("image/"):
+                    image_count += 1
+            else:
+                payload_bytes += len(str(part).encode("utf-8"))
+
+        usage = getattr(response, "usage_metadata", None)
+        prompt_tokens = getattr(usage, "prompt_token_count", None)
+        output_tokens = getattr(usage, "candidates_token_count", None)
+        total_tokens = getattr(usage, "total_token_count", None)
+
+        async def insert():
+            try:
+                await db.add_llm_call(
+                    case_number, call_type, model, prompt_tokens, output_tokens, total_tokens,
+                    image_count, payload_bytes, int(latency * 1000), attempts, outcome, error
+                )
+            except Exception as e:
+                print(f"Failed to record LLM call telemetry: {e}")
+
+        task = asyncio.get_running_loop().create_task(insert())
+        self._telemetry_tasks.add(task)
+        task.add_done_callback(self._telemetry_tasks.discard)
+
+    def _request(self, model, messages: List[Union[str, Dict]], generation_config: Dict,
+                 on_text: Optional[Callable[[str], Awaitable[None]]]) -> Awaitable:
+        if on_text is None:
+            return model.generate_content_async(messages, generation_config=generation_config)
+        return self._stream(model, messages, generation_config, on_text)
+
+    async def _stream(self, model, messages: List[Union[str, Dict]], generation_config: Dict,
+                      on_text: Callable[[str], Awaitable[None]]):
+        response = await model.generate_content_async(messages, generation_config=generation_config, stream=True)
+        text = ""
+        async for chunk in response:
+            try:
+                text += chunk.text
+            except ValueError:
+                # A chunk without text parts (e.g. only the finish reason)
+                continue
+            try:
+                await on_text(text)
+            except Exception as e:
+                print(f"Stream progress callback error: {e}")
+        # The response joins the streamed chunks, so .text is the full answer
+        return response
 
     async def generate_clarifying_questions(
             self,
             case_data: Dict,
             participants: List[Dict],
             evidence: List[Dict],
-            current_role: str,
+            current_role: Optional[str],
             round_number: int,
-            bot: Bot = None
-    ) -> List[str]:
+            bot: Bot = None,
+            pending_questions: List[str] = None,
+            joint: bool = False
+    ) -> Union[List[str], Dict[str, List[str]]]:
         """
-        Generates clarifying questions for a case participant
+        Generates clarifying questions for a case participant.
+        In joint mode a single call returns questions for both parties:
+        {"plaintiff": [...], "defendant": [...]}.
+        Only the evidence chunks most relevant to the claim and the questions asked so far are sent;
+        the full evidence set is reserved for the final decision.
+        After the first round the prompt carries the rolling case summary stored by the previous
+        round plus only the evidence added since; each round stores the updated summary.
+        Results are cached by input fingerprint, so a retried job or a repeated round does not
+        call the model again for the same evidence.
         """
-        role_text = "plaintiff" if current_role == "plaintiff" else "defendant"
+        case_number = case_data.get("case_number")
+        previous = await self._load_case_summary(case_number)
+        case_summary = previous["summary"] if previous else None
+        prompt_evidence = evidence
+        if previous is not None:
+            prompt_evidence = [ev for ev in evidence if (ev.get("id") or 0) > previous["last_evidence_id"]]
+
+        key = fingerprint(
+            "questions", case_data, participants, prompt_evidence,
+            role=None if joint else current_role, round=round_number,
+            pending=pending_questions or [], joint=joint, summary=case_summary
+        )
+        try:
+            result = await result_cache.get_or_compute(key, lambda: self._clarifying_questions(
+                case_data, participants, prompt_evidence, current_role, round_number, bot,
+                pending_questions, joint, case_summary
+            ), cacheable=lambda parsed: "parse_error" not in parsed)
+        except LLMUnavailableError:
+            # Left to the job queue to retry instead of skipping the round
+            raise
+        except Exception as e:
+            print(f"Error generating questions: {e}")
+            return {"plaintiff": [], "defendant": []} if joint else []
+
+        covered_evidence_id = result.get("covered_evidence_id")
+        if covered_evidence_id is None:
+            covered_evidence_id = previous["last_evidence_id"] if previous else 0
+        await self._save_case_summary(case_number, result.get("summary"), covered_evidence_id, round_number)
+        if joint:
+            return {role: list(result.get(role) or [])[:3] for role in ("plaintiff", "defendant")}
+        return result.get("questions", [])
+
+    async def _load_case_summary(self, case_number: Optional[str]) -> Optional[Dict]:
+        """Summary stored by the previous round; None means the round gets the full evidence"""
+        if not settings.CASE_SUMMARY_ENABLED or not case_number:
+            return None
+        try:
+            return await db.get_case_summary(case_number)
+        except Exception as e:
+            print(f"Failed to load summary of case {case_number}: {e}")
+            return None
+
+    async def _save_case_summary(self, case_number: Optional[str], summary: Optional[Dict],
+                                 covered_evidence_id: int, round_number: int):
+        """Stores the summary as covering the evidence rows up to covered_evidence_id"""
+        if not settings.CASE_SUMMARY_ENABLED or not case_number or not summary:
+            return
+        limit = settings.CASE_SUMMARY_MAX_ITEMS
+        summary = {
+            "established_facts": list(summary.get("established_facts") or [])[:limit],
+            "open_issues": list(summary.get("open_issues") or [])[:limit],
+        }
+        if not summary["established_facts"] and not summary["open_issues"]:
+            # Nothing usable (e.g. an unparsable answer): the next round falls back to the full evidence
+            return
+        try:
+            await db.save_case_summary(case_number, summary, covered_evidence_id, round_number)
+        except Exception as e:
+            print(f"Failed to save summary of case {case_number}: {e}")
+
+    @staticmethod
+    def _covered_evidence_id(evidence: List[Dict], sent: List[Dict]) -> Optional[int]:
+        """
+        Highest evidence id up to which every row was sent to the model. The summary covers only
+        those rows: a row the relevance index dropped, and everything after it, is sent again.
+        """
+        sent_ids = {ev.get("id") for ev in sent}
+        covered = None
+        for ev_id in sorted(ev["id"] for ev in evidence if ev.get("id") is not None):
+            if ev_id not in sent_ids:
+                break
+            covered = ev_id
+        return covered
+
+    @staticmethod
+    def _format_case_summary(case_summary: Dict) -> str:
+        lines = ["Established facts:"]
+        lines += [f"- {fact}" for fact in case_summary.get("established_facts") or []] or ["- none yet"]
+        lines.append("Open issues:")
+        lines += [f"- {issue}" for issue in case_summary.get("open_issues") or []] or ["- none"]
+        return "\n".join(lines)
+
+    async def _clarifying_questions(
+            self,
+            case_data: Dict,
+            participants: List[Dict],
+            evidence: List[Dict],
+            current_role: Optional[str],
+            round_number: int,
+            bot: Optional[Bot],
+            pending_questions: Optional[List[str]],
+            joint: bool,
+            case_summary: Optional[Dict] = None
+    ) -> Dict:
+        """
+        Uncached question generation returning the parsed response (questions and updated summary)
+        and covered_evidence_id, the watermark of the evidence the prompt actually carried;
+        errors propagate so that they are never cached
+        """
+        if joint:
+            subject = "both parties"
+            weak_points = "either party's"
+            addressing = "\n        Address each question to the party who can answer it; each party gets its own list.\n"
+        else:
+            subject = "the plaintiff" if current_role == "plaintiff" else "the defendant"
+            weak_points = "the plaintiff's" if current_role == "plaintiff" else "the defendant's"
+            addressing = ""
 
         instruction = f"""
-        You are an AI judge. Analyze the arguments and evidence of the {"plaintiff" if current_role == "plaintiff" else "defendant"} and ask clarifying questions to reveal details and fill gaps. 
+        You are an AI judge. Analyze the arguments and evidence of {subject} and ask clarifying questions to reveal details and fill gaps. 
         Focus on material evidence; without it, state that a decision cannot be made objectively.
 
         IMPORTANT: 
@@ -47,7 +412,7 @@ class GeminiService:
         1. Specification of details (exact dates, amounts, locations, participants, actions).
         2. Verification of evidence validity (e.g., "What documents confirm this?", "Are there witnesses?").
         3. Clarification of relationships between events and evidence.
-        4. Identification of weak points or contradictions in the {"plaintiff's" if current_role == "plaintiff" else "defendant's"} position.
+        4. Identification of weak points or contradictions in {weak_points} position.
         5. Focus on facts that directly affect the case outcome (not secondary details).
         6. Reference to specific messages from chat history if provided.
 
@@ -57,40 +422,45 @@ class GeminiService:
         - "What confirms the amount you are claiming?"
         - "Why do your documents show different dates?"
         - "In the chat history from [date], you mentioned X. Can you clarify this?"
-
-        Return JSON in the format:
-        {{
-                "questions": ["question1", "question2", "question3"]
-        }}
-
-        If no questions are needed, return: {{"questions": []}}
-        """
+        {addressing}
+        Also return "summary": the whole case so far in at most {settings.CASE_SUMMARY_MAX_ITEMS} established
+        facts and {settings.CASE_SUMMARY_MAX_ITEMS} open issues. Merge the previous summary (if given) with the
+        evidence below; the next round sees only this summary instead of the evidence, so keep every fact
+        that still matters and drop issues that are resolved."""
+
+        if case_summary is not None:
+            instruction += (
+                "\n\nCASE SUMMARY FROM PREVIOUS ROUNDS "
+                "(the evidence it covers is not repeated; only evidence added since then follows):\n"
+                + self._format_case_summary(case_summary)
+            )
+
+        query = " ".join(filter(None, [
+            case_data.get("topic"), case_data.get("claim_reason"), *(pending_questions or [])
+        ]))
+        selected = evidence_index.select(case_data.get("case_number"), evidence, query)
 
         messages = await self._build_multimodal_prompt(
-            instruction, case_data, participants, evidence, bot
+            instruction, case_data, participants, selected, bot,
+            token_budget=settings.PROMPT_BUDGET_QUESTIONS, call_type="joint_questions" if joint else "questions"
         )
 
-        try:
-            response = self.model.generate_content(messages)
-            result = self._parse_questions_response(response.text)
-            return result.get("questions", [])
-        except Exception as e:
-            print(f"Error generating questions: {e}")
-            return []
+        response_model = JointQuestionsResponse if joint else QuestionsResponse
+        response = await self._generate(
+            messages, "questions", response_model=response_model, case_number=case_data.get("case_number")
+        )
+        parsed = self._parse_questions_response(response.text, response_model)
+        parsed["covered_evidence_id"] = self._covered_evidence_id(evidence, selected)
+        return parsed
 
-    def _parse_questions_response(self, response_text: str) -> Dict:
-        """Parses the response from Gemini with questions"""
+    def _parse_questions_response(self, response_text: str,
+                                  response_model: Type[BaseModel] = QuestionsResponse) -> Dict:
+        """Parses the JSON-mode response from Gemini with questions; a failure is marked with parse_error"""
         try:
-            start = response_text.find('{')
-            end = response_text.rfind('}') + 1
-            if start >= 0 and end > start:
-                json_str = response_text[start:end]
-                return json.loads(json_str)
-            else:
-                return {"questions": []}
-        except Exception as e:
+            return response_model.model_validate_json(response_text).model_dump()
+        except ValidationError as e:
             print(f"Error parsing questions: {e}")
-            return {"questions": []}
+            return {**response_model().model_dump(), "parse_error": str(e)}
 
     async def analyze_case(self, case_data: Dict, participants: List[Dict], evidence: List[Dict],
                            bot: Bot = None) -> Dict:
@@ -98,12 +468,15 @@ class GeminiService:
         Basic case analysis (JSON with facts, violations, decision).
         """
         messages = await self._build_multimodal_prompt(
-            "You are an AI judge. Conduct a case analysis and return JSON in English.",
-            case_data, participants, evidence, bot
+            "You are an AI judge. Conduct a case analysis in English.",
+            case_data, participants, evidence, bot,
+            token_budget=settings.PROMPT_BUDGET_DECISION, call_type="analysis"
         )
         try:
-            response = self.model.generate_content(messages)
-            analysis = self._parse_analysis_response(response.text)
+            response = await self._generate(
+                messages, "analysis", response_model=AnalysisResponse, case_number=case_data.get("case_number")
+            )
+            analysis = self._parse_analysis_response(response.text, AnalysisResponse)
             return analysis
         except Exception as e:
             return {
@@ -122,10 +495,11 @@ class GeminiService:
         """
         messages = await self._build_multimodal_prompt(
             "You are an AI judge. Formulate only the reasoning for the decision in English (plain text).",
-            case_data, participants, evidence, bot
+            case_data, participants, evidence, bot,
+            token_budget=settings.PROMPT_BUDGET_DECISION, call_type="reasoning"
         )
         try:
-            response = self.model.generate_content(messages)
+            response = await self._generate(messages, "reasoning", case_number=case_data.get("case_number"))
             return response.text.strip()
         except Exception as e:
             return f"Failed to generate reasoning due to error: {str(e)}"
@@ -136,11 +510,33 @@ class GeminiService:
             participants: List[Dict],
             evidence: List[Dict],
             bot: Bot = None,
-            no_evidence: bool = False
+            no_evidence: bool = False,
+            on_progress: Callable[[Dict], Awaitable[None]] = None
     ) -> Dict:
         """
         Generation of full ruling and decision (JSON).
+        With on_progress the decision is streamed and on_progress receives decision_progress()
+        of the partial JSON after every chunk.
+        A decision already made for the same evidence is served from the result cache
+        (no progress is reported then).
+        Raises LLMUnavailableError on an outage and DecisionGenerationError on a malformed answer;
+        no default decision is ever returned.
         """
+        key = fingerprint("final_decision", case_data, participants, evidence, no_evidence=no_evidence)
+        return await result_cache.get_or_compute(
+            key,
+            lambda: self._full_decision(case_data, participants, evidence, bot, no_evidence, on_progress)
+        )
+
+    async def _full_decision(
+            self,
+            case_data: Dict,
+            participants: List[Dict],
+            evidence: List[Dict],
+            bot: Optional[Bot],
+            no_evidence: bool,
+            on_progress: Optional[Callable[[Dict], Awaitable[None]]]
+    ) -> Dict:
         raw_amount = case_data.get('claim_amount')
         if raw_amount is None:
             claim_amount_text = "not specified"
@@ -174,58 +570,27 @@ class GeminiService:
         4. Use specific quotes from chat messages in your reasoning
         5. Consider the timeline of events as shown in messages
 
-        ALL TEXT MUST BE IN ENGLISH.
-
-        Return STRICTLY valid JSON in this format:
-        {{
-          "established_facts": [...],
-          "violations": [...],
-          "decision": "Full verdict text IN ENGLISH, mentioning the claim amount {claim_amount_text} and referencing specific chat messages if relevant",
-          "verdict": {{
-              "claim_granted": true/false,
-              "amount_awarded": number,
-              "court_costs": number
-          }},
-          "winner": "plaintiff" | "defendant" | "draw",
-          "reasoning": "Detailed reasoning IN ENGLISH with specific references to chat history..."
-        }}"""
+        ALL TEXT MUST BE IN ENGLISH. Reference specific chat messages and their dates in the
+        "decision" and "reasoning" fields."""
 
         if no_evidence:
             instruction += "\n⚠️ Attention: no evidence provided. The decision must be made based solely on the parties' arguments."
 
-        instruction += """
-    Return JSON strictly in the format (ALL TEXT IN ENGLISH):
-    {
-      "established_facts": ["fact1 (supported by chat message from [date])", "fact2"],
-      "violations": ["violation1", "violation2"],
-      "decision": "Text of the final decision IN ENGLISH with references to chat evidence",
-      "verdict": {
-          "claim_granted": true/false,
-          "amount_awarded": number (amount awarded to plaintiff),
-          "court_costs": number
-      },
-      "winner": "plaintiff" or "defendant" or "draw",
-      "reasoning": "Detailed reasoning IN ENGLISH citing specific chat messages and their dates"
-    }
-
-    IMPORTANT about the "winner" field:
-    - "plaintiff" - if the decision is in favor of the plaintiff (claim fully or partially satisfied)
-    - "defendant" - if the decision is in favor of the defendant (claim denied)
-    - "draw" - if both parties are partially right (compromise decision)
-
-    REMEMBER: 
-    - All text content must be in English language
-    - Chat history is PRIMARY evidence and must be thoroughly analyzed
-    - Reference specific messages from chat history in your reasoning
-    """
-
         messages = await self._build_multimodal_prompt(
-            instruction, case_data, participants, evidence, bot
+            instruction, case_data, participants, evidence, bot,
+            token_budget=settings.PROMPT_BUDGET_DECISION, call_type="final_decision"
         )
 
         try:
-            response = self.model.generate_content(messages)
-            decision_data = self._parse_analysis_response(response.text)
+            on_text = None
+            if on_progress is not None:
+                on_text = lambda partial: on_progress(decision_progress(partial))  # noqa: E731
+
+            response = await self._generate(
+                messages, "final_decision", timeout=settings.GEMINI_DECISION_TIMEOUT,
+                response_model=DecisionResponse, on_text=on_text, case_number=case_data.get("case_number")
+            )
+            decision_data = self._parse_decision_response(response.text)
 
             # IMPORTANT: Determine winner if AI didn't specify
             if 'winner' not in decision_data or not decision_data['winner']:
@@ -233,20 +598,11 @@ class GeminiService:
 
             return decision_data
 
+        except (LLMUnavailableError, DecisionGenerationError):
+            # No verdict is better than a default one: the verdict job retries later
+            raise
         except Exception as e:
-            return {
-                "error": f"Error generating decision: {str(e)}",
-                "established_facts": [ev.get("description", "") for ev in evidence],
-                "violations": [],
-                "decision": "Failed to make decision due to error",
-                "verdict": {
-                    "claim_granted": False,
-                    "amount_awarded": 0,
-                    "court_costs": 0
-                },
-                "winner": "defendant",
-                "reasoning": ""
-            }
+            raise DecisionGenerationError(f"Error generating decision: {e}") from e
 
     def _determine_winner(self, decision_data: Dict) -> str:
         """
@@ -264,71 +620,95 @@ class GeminiService:
         else:
             return "defendant"
 
-    async def _download_telegram_file(self, bot: Bot, file_id: str) -> bytes:
-        """Downloads a file from Telegram by file_id"""
+    async def download_telegram_file(self, bot: Bot, file_id: str) -> Tuple[bytes, Optional[str]]:
+        """
+        Downloads a file from Telegram by file_id, reusing the local media cache.
+        Returns the bytes and the file name from the same single metadata lookup.
+        """
         try:
-            file_info: File = await bot.get_file(file_id)
-            file_bytes = io.BytesIO()
-            await bot.download_file(file_info.file_path, file_bytes)
-            return file_bytes.getvalue()
+            cached = await media_cache.fetch_file(bot, file_id)
+            filename = cached.file_path.split('/')[-1] if cached.file_path else None
+            return cached.data, filename
         except Exception as e:
             print(f"Error downloading file {file_id}: {e}")
-            return b""
+            return b"", None
 
-    async def _extract_text_from_pdf(self, file_bytes: bytes) -> str:
-        """Extracts text from PDF"""
-        try:
-            pdf_file = io.BytesIO(file_bytes)
-            pdf_reader = PyPDF2.PdfReader(pdf_file)
-            text = ""
-            for page in pdf_reader.pages:
-                text += page.extract_text() + "\n"
-            return text.strip()
-        except Exception as e:
-            return f"Error reading PDF: {e}"
+    async def prepare_image(
+            self,
+            bot: Bot,
+            file_id: str,
+            filename: str = None,
+            fetch_semaphore: asyncio.Semaphore = None
+    ) -> Optional[NormalizedImage]:
+        """
+        Loads an evidence image downscaled, re-encoded and stripped of metadata.
+        The normalized copy is cached, so only the first prompt build pays for it.
+        """
+        key = f"{settings.IMAGE_FORMAT}:{settings.IMAGE_MAX_EDGE}:{settings.IMAGE_QUALITY}:{file_id}"
+        cached = await media_cache.get_derived(key)
+        if cached:
+            data, meta = cached
+            return NormalizedImage(data, meta["mime_type"], meta.get("phash"), meta["original_size"])
+
+        async with fetch_semaphore or contextlib.nullcontext():
+            file_bytes, _ = await self.download_telegram_file(bot, file_id)
+        if not file_bytes:
+            return None
 
-    async def _extract_text_from_docx(self, file_bytes: bytes) -> str:
-        """Extracts text from DOCX"""
         try:
-            doc_file = io.BytesIO(file_bytes)
-            doc = Document(doc_file)
-            text = ""
-            for paragraph in doc.paragraphs:
-                text += paragraph.text + "\n"
-            return text.strip()
+            image = await asyncio.to_thread(
+                normalize_image, file_bytes, settings.IMAGE_MAX_EDGE, settings.IMAGE_QUALITY, settings.IMAGE_FORMAT
+            )
         except Exception as e:
-            return f"Error reading DOCX: {e}"
-
-    async def _extract_text_from_document(self, file_bytes: bytes, filename: str) -> str:
-        """Universal function for extracting text from documents"""
-        filename_lower = filename.lower()
-
-        if filename_lower.endswith('.pdf'):
-            return await self._extract_text_from_pdf(file_bytes)
-        elif filename_lower.endswith('.docx'):
-            return await self._extract_text_from_docx(file_bytes)
-        elif filename_lower.endswith('.txt'):
-            try:
-                return file_bytes.decode('utf-8')
-            except:
-                try:
-                    return file_bytes.decode('cp1251')
-                except:
-                    return "Error decoding text file"
-        else:
-            return f"Unsupported document format: {filename}"
+            # Formats Pillow cannot decode (e.g. SVG) are sent as they are
+            print(f"Error normalizing image {file_id}: {e}")
+            mime_type = self.detect_mime_type(file_bytes, filename)
+            if not mime_type.startswith("image/"):
+                mime_type = "image/jpeg"
+            return NormalizedImage(file_bytes, mime_type, None, len(file_bytes))
+
+        await media_cache.put_derived(key, image.data, {
+            "mime_type": image.mime_type,
+            "phash": image.phash,
+            "original_size": image.original_size
+        })
+        return image
+
+    async def extract_text_from_document(self, file_bytes: bytes, filename: str) -> str:
+        """Universal function for extracting text from documents (PDF, DOCX, TXT)"""
+        return await document_extractor.extract(file_bytes, filename)
 
     def _is_image(self, filename: str) -> bool:
         """Checks if the file is an image"""
         image_extensions = ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.tiff', '.tif', '.svg']
         return any(filename.lower().endswith(ext) for ext in image_extensions)
 
+    def detect_mime_type(self, file_bytes: bytes, filename: str = None) -> str:
+        """Detects MIME type by magic bytes, falling back to the file extension"""
+        if file_bytes[:4] == b'\x89PNG':
+            return "image/png"
+        if file_bytes[:4] == b'RIFF' and file_bytes[8:12] == b'WEBP':
+            return "image/webp"
+        if file_bytes[:3] == b'GIF':
+            return "image/gif"
+        if file_bytes[:3] == b'\xff\xd8\xff':
+            return "image/jpeg"
+        if file_bytes[:4] == b'%PDF':
+            return "application/pdf"
+
+        if filename:
+            mime_type, _ = mimetypes.guess_type(filename)
+            if mime_type:
+                return mime_type
+        return "image/jpeg" if not filename or self._is_image(filename) else "application/octet-stream"
+
     async def _build_multimodal_prompt(
             self, task_instruction: str, case_data: Dict, participants: List[Dict], evidence: List[Dict],
-            bot: Bot = None
+            bot: Bot = None, token_budget: int = None, call_type: str = "prompt"
     ) -> List[Union[str, Dict]]:
         """
         Forming multimodal input (text + images + document contents).
+        Every part is tagged with its segment so the prompt can be fitted into token_budget.
         """
 
         raw_amount = case_data.get('claim_amount')
@@ -357,115 +737,177 @@ class GeminiService:
     {self._format_participants(participants)}
     """
 
-        messages: List[Union[str, Dict]] = [base_prompt]
+        tagged: List[Tuple[str, Union[str, Dict]]] = [("case_header", base_prompt)]
 
         # Add chat history first with special emphasis
         if chat_history:
-            messages.append("\n" + "=" * 80 + "\n")
-            messages.append("🔴 CRITICAL EVIDENCE: CHAT HISTORY (PRIMARY SOURCE)\n")
-            messages.append("=" * 80 + "\n")
-            messages.append("This is actual communication between the parties. Analyze carefully:\n\n")
+            tagged.append(("structure", "\n" + "=" * 80 + "\n"))
+            tagged.append(("structure", "🔴 CRITICAL EVIDENCE: CHAT HISTORY (PRIMARY SOURCE)\n"))
+            tagged.append(("structure", "=" * 80 + "\n"))
+            tagged.append(("structure", "This is actual communication between the parties. Analyze carefully:\n\n"))
 
             for i, ev in enumerate(chat_history, 1):
                 role_text = "Plaintiff" if ev.get("role") == "plaintiff" else "Defendant"
                 content = ev.get('content', ev.get('description', ''))
 
                 if content and content.strip():
-                    messages.append(
-                        f"\n📱 CHAT HISTORY #{i} (Provided by {role_text}):\n"
-                        f"{'-' * 80}\n"
-                        f"{content}\n"
+                    tagged.append(("structure", f"\n📱 CHAT HISTORY #{i} (Provided by {role_text}):\n{'-' * 80}\n"))
+                    tagged.append(("chat_history", f"{content}\n"))
+                    tagged.append((
+                        "structure",
                         f"{'-' * 80}\n"
                         f"[This chat correspondence is PRIMARY EVIDENCE. Extract key facts, dates, agreements, and disputes from these messages.]\n\n"
-                    )
+                    ))
 
-            messages.append("=" * 80 + "\n")
-            messages.append("END OF CHAT HISTORY\n")
-            messages.append("=" * 80 + "\n\n")
+            tagged.append(("structure", "=" * 80 + "\n"))
+            tagged.append(("structure", "END OF CHAT HISTORY\n"))
+            tagged.append(("structure", "=" * 80 + "\n\n"))
 
         # Then add other evidence
-        messages.append("Additional Evidence and Arguments:\n\n")
-
-        for i, ev in enumerate(other_evidence, 1):
-            role_text = "Plaintiff" if ev.get("role") == "plaintiff" else "Defendant"
-
-            if ev["type"] == "text":
-                messages.append(f"\n{i}. {role_text} - Argument:\n{ev.get('content', ev.get('description', ''))}\n")
-
-            elif ev["type"] == "ai_response":
-                messages.append(
-                    f"\n{i}. {role_text} - Answer to AI question:\n{ev.get('content', ev.get('description', ''))}\n")
-
-            elif ev["type"] == "photo" and bot and ev.get("file_path"):
-                try:
-                    file_bytes = await self._download_telegram_file(bot, ev["file_path"])
-                    if file_bytes:
-                        mime_type = "image/jpeg"
-                        if len(file_bytes) >= 4:
-                            if file_bytes[:4] == b'\x89PNG':
-                                mime_type = "image/png"
-                            elif file_bytes[:4] == b'RIFF' and file_bytes[8:12] == b'WEBP':
-                                mime_type = "image/webp"
-                            elif file_bytes[:3] == b'GIF':
-                                mime_type = "image/gif"
-
-                        messages.append({
-                            "mime_type": mime_type,
-                            "data": base64.b64encode(file_bytes).decode()
-                        })
-                        caption = ev.get('content', 'Photo evidence')
-                        messages.append(f"\n{i}. {role_text} - Image: {caption}\n")
-                    else:
-                        messages.append(f"\n{i}. {role_text} - [Error loading image]\n")
-                except Exception as e:
-                    messages.append(f"\n{i}. {role_text} - [Error processing image: {e}]\n")
+        tagged.append(("structure", "Additional Evidence and Arguments:\n\n"))
+
+        # Files are fetched concurrently; gather keeps the evidence order deterministic
+        fetch_semaphore = asyncio.Semaphore(settings.EVIDENCE_FETCH_CONCURRENCY)
+        rendered = await asyncio.gather(*[
+            self._render_evidence(i, ev, bot, fetch_semaphore)
+            for i, ev in enumerate(other_evidence, 1)
+        ])
+        seen_hashes: List[int] = []
+        original_bytes = sent_bytes = duplicates = 0
+        uploads: List[Tuple[int, Dict, Dict]] = []
+        for ev, parts in zip(other_evidence, rendered):
+            for segment, part in parts:
+                if not isinstance(part, NormalizedImage):
+                    tagged.append((segment, part))
+                    continue
+
+                original_bytes += part.original_size
+                if part.phash is not None and any(
+                        hamming_distance(part.phash, seen) <= settings.IMAGE_DUPLICATE_DISTANCE
+                        for seen in seen_hashes
+                ):
+                    duplicates += 1
+                    tagged.append(("structure", "[Near-duplicate of an image above, omitted]"))
+                    continue
+
+                if part.phash is not None:
+                    seen_hashes.append(part.phash)
+                # Raw bytes go straight into the request blob, no base64 copy
+                uploads.append((len(tagged), ev, {"mime_type": part.mime_type, "data": part.data}))
+                tagged.append((segment, None))
+
+        # Images already uploaded for this case are referenced by handle instead of resent
+        media_parts = await asyncio.gather(*[media_registry.part_for(ev, inline) for _, ev, inline in uploads])
+        referenced = 0
+        for (index, _, inline), media_part in zip(uploads, media_parts):
+            tagged[index] = (tagged[index][0], media_part)
+            if isinstance(media_part, UploadedPart):
+                referenced += 1
+            else:
+                sent_bytes += len(inline["data"])
+
+        if original_bytes:
+            print(
+                f"Case {case_data.get('case_number')}: images {original_bytes} -> {sent_bytes} bytes "
+                f"({original_bytes - sent_bytes} saved, {duplicates} near-duplicates skipped, "
+                f"{referenced} sent as file references)"
+            )
+
+        if not token_budget:
+            return [part for _, part in tagged]
+
+        summarizer = None
+        if settings.PROMPT_SUMMARIZE_OVERFLOW:
+            summarizer = functools.partial(self._summarize_text, case_number=case_data.get("case_number"))
+        budget = PromptBudget(token_budget, summarizer=summarizer)
+        messages, report = await budget.apply(tagged)
+        print(f"Case {case_data.get('case_number')} [{call_type}] prompt: {format_report(report)}")
+        return messages
 
-            elif ev["type"] == "document" and bot and ev.get("file_path"):
-                try:
-                    file_bytes = await self._download_telegram_file(bot, ev["file_path"])
-                    if file_bytes:
-                        try:
-                            file_info = await bot.get_file(ev["file_path"])
-                            filename = file_info.file_path.split('/')[-1] if file_info.file_path else "document"
-                        except:
-                            filename = "document"
-
-                        if self._is_image(filename):
-                            mime_type = "image/jpeg"
-                            if filename.lower().endswith('.png'):
-                                mime_type = "image/png"
-                            elif filename.lower().endswith('.webp'):
-                                mime_type = "image/webp"
-                            elif filename.lower().endswith('.gif'):
-                                mime_type = "image/gif"
-
-                            messages.append({
-                                "mime_type": mime_type,
-                                "data": base64.b64encode(file_bytes).decode()
-                            })
-                            caption = ev.get('content', 'Image (document)')
-                            messages.append(f"\n{i}. {role_text} - Image-document: {caption}\n")
-                        else:
-                            extracted_text = await self._extract_text_from_document(file_bytes, filename)
-                            messages.append(f"\n{i}. {role_text} - Document ({filename}):\n{extracted_text}\n")
+    async def _summarize_text(self, text: str, max_chars: int, case_number: Optional[str] = None) -> str:
+        """Condenses an overflowing piece of evidence for the prompt budget (map step)"""
+        response = await self._generate([
+            f"Summarize the following case material in at most {max_chars} characters. "
+            f"Keep names, dates, amounts, promises and refusals exactly as written. "
+            f"Do not add any assessment.\n\n{text}"
+        ], "summary", case_number=case_number)
+        return response.text.strip()[:max_chars]
+
+    async def _render_evidence(
+            self, i: int, ev: Dict, bot: Optional[Bot], fetch_semaphore: asyncio.Semaphore
+    ) -> List[Tuple[str, Union[str, NormalizedImage]]]:
+        """Segment-tagged prompt parts for a single evidence item (everything except chat history)"""
+        messages: List[Tuple[str, Union[str, NormalizedImage]]] = []
+        role_text = "Plaintiff" if ev.get("role") == "plaintiff" else "Defendant"
+
+        if ev["type"] == "text":
+            messages.append(("structure", f"\n{i}. {role_text} - Argument:\n"))
+            messages.append(("arguments", f"{ev.get('content', ev.get('description', ''))}\n"))
+
+        elif ev["type"] == "ai_response":
+            messages.append(("structure", f"\n{i}. {role_text} - Answer to AI question:\n"))
+            messages.append(("ai_answers", f"{ev.get('content', ev.get('description', ''))}\n"))
+
+        elif ev["type"] == "photo" and bot and ev.get("file_path"):
+            try:
+                image = await self.prepare_image(bot, ev["file_path"], fetch_semaphore=fetch_semaphore)
+                if image:
+                    messages.append(("images", image))
+                    caption = ev.get('content', 'Photo evidence')
+                    messages.append(("structure", f"\n{i}. {role_text} - Image: {caption}\n"))
+                else:
+                    messages.append(("structure", f"\n{i}. {role_text} - [Error loading image]\n"))
+            except Exception as e:
+                messages.append(("structure", f"\n{i}. {role_text} - [Error processing image: {e}]\n"))
+
+        elif ev["type"] == "document" and ev.get("extracted_text") is not None:
+            # Text was already extracted by the ingestion stage right after upload
+            filename = ev.get("file_name") or "document"
+            messages.append(("structure", f"\n{i}. {role_text} - Document ({filename}):\n"))
+            messages.append(("documents", f"{ev['extracted_text']}\n"))
+
+        elif ev["type"] == "document" and bot and ev.get("file_path"):
+            try:
+                filename = ev.get("file_name")
+                is_image = (ev.get("mime_type") or "").startswith("image/") or bool(filename and self._is_image(filename))
+                file_bytes = None
+                if not is_image:
+                    async with fetch_semaphore:
+                        file_bytes, telegram_name = await self.download_telegram_file(bot, ev["file_path"])
+                    filename = filename or telegram_name or "document"
+                    is_image = bool(file_bytes) and self._is_image(filename)
+
+                if is_image:
+                    # The original bytes, if just downloaded, are served from the media cache
+                    image = await self.prepare_image(bot, ev["file_path"], filename, fetch_semaphore)
+                    if image:
+                        messages.append(("images", image))
+                        caption = ev.get('content', 'Image (document)')
+                        messages.append(("structure", f"\n{i}. {role_text} - Image-document: {caption}\n"))
                     else:
-                        messages.append(f"\n{i}. {role_text} - [Error loading document]\n")
-                except Exception as e:
-                    messages.append(f"\n{i}. {role_text} - [Error processing document: {e}]\n")
-
-            elif ev["type"] == "video" and ev.get("file_path"):
-                caption = ev.get('content', 'Video evidence')
-                messages.append(
-                    f"\n{i}. {role_text} - Video: {caption}\n[Video content is not automatically analyzed]\n")
+                        messages.append(("structure", f"\n{i}. {role_text} - [Error loading document]\n"))
+                elif file_bytes:
+                    extracted_text = await self.extract_text_from_document(file_bytes, filename)
+                    messages.append(("structure", f"\n{i}. {role_text} - Document ({filename}):\n"))
+                    messages.append(("documents", f"{extracted_text}\n"))
+                else:
+                    messages.append(("structure", f"\n{i}. {role_text} - [Error loading document]\n"))
+            except Exception as e:
+                messages.append(("structure", f"\n{i}. {role_text} - [Error processing document: {e}]\n"))
+
+        elif ev["type"] == "video" and ev.get("file_path"):
+            caption = ev.get('content', 'Video evidence')
+            messages.append((
+                "structure", f"\n{i}. {role_text} - Video: {caption}\n[Video content is not automatically analyzed]\n"))
+
+        elif ev["type"] == "audio" and ev.get("file_path"):
+            caption = ev.get('content', 'Audio evidence')
+            messages.append((
+                "structure", f"\n{i}. {role_text} - Audio: {caption}\n[Audio content is not automatically analyzed]\n"))
 
-            elif ev["type"] == "audio" and ev.get("file_path"):
-                caption = ev.get('content', 'Audio evidence')
-                messages.append(
-                    f"\n{i}. {role_text} - Audio: {caption}\n[Audio content is not automatically analyzed]\n")
-
-            else:
-                description = ev.get('content', ev.get('description', 'Evidence without description'))
-                messages.append(f"\n{i}. {role_text} - {ev['type']}: {description}\n")
+        else:
+            description = ev.get('content', ev.get('description', 'Evidence without description'))
+            messages.append(("arguments", f"\n{i}. {role_text} - {ev['type']}: {description}\n"))
 
         return messages
 
@@ -477,27 +919,13 @@ class GeminiService:
             result.append(f"{role_en}: @{username}")
         return ", ".join(result)
 
-    def _parse_analysis_response(self, response_text: str) -> Dict:
-        """Parses response from Gemini, extracting JSON"""
+    def _parse_analysis_response(self, response_text: str,
+                                 response_model: Type[BaseModel] = DecisionResponse) -> Dict:
+        """Parses the JSON-mode response from Gemini into the decision structure"""
         try:
-            start = response_text.find('{')
-            end = response_text.rfind('}') + 1
-            if start >= 0 and end > start:
-                json_str = response_text[start:end]
-                return json.loads(json_str)
-            else:
-                return {
-                    "established_facts": [],
-                    "violations": [],
-                    "decision": response_text,
-                    "verdict": {
-                        "claim_granted": False,
-                        "amount_awarded": 0,
-                        "court_costs": 0
-                    },
-                    "reasoning": response_text
-                }
-        except Exception as e:
+            return response_model.model_validate_json(response_text).model_dump()
+        except ValidationError as e:
+            print(f"Error parsing analysis: {e}")
             return {
                 "established_facts": [],
                 "violations": [],
@@ -511,5 +939,14 @@ class GeminiService:
                 "parse_error": str(e)
             }
 
+    @staticmethod
+    def _parse_decision_response(response_text: str) -> Dict:
+        """Parses the final decision; unlike the analysis there is no fallback, a malformed answer raises"""
+        try:
+            return DecisionResponse.model_validate_json(response_text).model_dump()
+        except ValidationError as e:
+            print(f"Error parsing decision: {e}")
+            raise DecisionGenerationError(f"Malformed decision: {e}") from e
+
 
 gemini_service = GeminiService()
\ No newline at end of file
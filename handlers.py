@@ -1,24 +1,28 @@
+import asyncio
 import os
-from typing import Dict
+from typing import Dict, List
 
-from aiogram import Router, types, F, Dispatcher
+from aiogram import Bot, Router, types, F, Dispatcher
 from aiogram.enums import ParseMode
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
-from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
 from aiogram.types import (
     ReplyKeyboardMarkup, KeyboardButton,
     FSInputFile, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, ReplyKeyboardRemove
 )
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
-from database import db
-from gemini_servise import gemini_service
-from pdf_gen import PDFGenerator
+from conf import settings
+from database import CaseContext, EvidenceRow, db
+from evidence_ingest import evidence_ingestor
+from gemini_servise import DecisionGenerationError, gemini_service
+from job_queue import enqueue_job, register_job
+from llm_resilience import LLMUnavailableError
 
 router = Router()
-pdf_generator = PDFGenerator()
 CASES_PER_PAGE = 10
 
 
@@ -430,6 +434,22 @@ async def handle_message_history_choice(message: types.Message, state: FSMContex
         await message.answer("Please choose one of the suggested options.")
 
 
+def chat_history_rows(case_number: str, user_id: int, forwarded_messages: List[Dict]) -> List[EvidenceRow]:
+    """Forwarded messages as chat_history evidence, CHAT_HISTORY_PAGE_MESSAGES messages per row"""
+    page_size = settings.CHAT_HISTORY_PAGE_MESSAGES
+    pages = [forwarded_messages[i:i + page_size] for i in range(0, len(forwarded_messages), page_size)]
+    rows = []
+    for number, page in enumerate(pages, 1):
+        if len(pages) == 1:
+            history_text = "Chat history:\n\n"
+        else:
+            history_text = f"Chat history (part {number} of {len(pages)}):\n\n"
+        for msg in page:
+            history_text += f"[{msg.get('date', 'no date')}] {msg['from_user']}: {msg['text']}\n\n"
+        rows.append(EvidenceRow(case_number, user_id, "plaintiff", "chat_history", history_text))
+    return rows
+
+
 @router.message(DisputeState.waiting_forwarded_messages)
 async def handle_forwarded_messages(message: types.Message, state: FSMContext):
     """Handling forwarded messages"""
@@ -447,25 +467,8 @@ async def handle_forwarded_messages(message: types.Message, state: FSMContext):
         case_number = data.get("case_number")
 
         if forwarded_messages and case_number:
-            chat_history_text = "📱 CHAT HISTORY:\n" + "=" * 50 + "\n\n"
-
-            for idx, msg in enumerate(forwarded_messages, 1):
-                date_str = msg.get('date', 'Unknown date')
-                from_user = msg.get('from_user', 'Unknown')
-                text = msg.get('text', '')
-
-                chat_history_text += f"[{date_str}] @{from_user}:\n{text}\n\n"
-
-            chat_history_text += "=" * 50
-
-            await db.add_evidence(
-                case_number,
-                message.from_user.id,
-                "plaintiff",
-                "chat_history",
-                chat_history_text,
-                None
-            )
+            # The whole batch in one COPY
+            await db.add_evidence_bulk(chat_history_rows(case_number, message.from_user.id, forwarded_messages))
 
             await message.answer(
                 f"✅ Added {len(forwarded_messages)} messages as chat history evidence."
@@ -548,35 +551,25 @@ async def proceed_to_defendant_selection(message: types.Message, state: FSMConte
     data = await state.get_data()
     chat_id = data.get("chat_id")
 
-    case_number = await db.create_case(
-        topic=data["topic"],
-        category=data["category"],
-        claim_reason=data["claim_reason"],
-        claim_amount=data.get("claim_amount"),
-        mode="full",
-        plaintiff_id=message.from_user.id,
-        plaintiff_username=message.from_user.username or message.from_user.full_name,
-        chat_id=chat_id,
-        version="pm"
-    )
-
-    await state.update_data(case_number=case_number)
-    await db.update_case_stage(case_number, "waiting_defendant")
+    # The case, its plaintiff and the forwarded history are written together or not at all
+    async with db.unit_of_work() as uow:
+        case_number = uow.create_case(
+            topic=data["topic"],
+            category=data["category"],
+            claim_reason=data["claim_reason"],
+            claim_amount=data.get("claim_amount"),
+            mode="full",
+            plaintiff_id=message.from_user.id,
+            plaintiff_username=message.from_user.username or message.from_user.full_name,
+            chat_id=chat_id,
+            stage="waiting_defendant",
+            version="pm"
+        )
 
-    forwarded_messages = data.get("forwarded_messages", [])
-    if forwarded_messages:
-        history_text = "Chat history:\n\n"
-        for msg in forwarded_messages:
-            history_text += f"[{msg.get('date', 'no date')}] {msg['from_user']}: {msg['text']}\n\n"
+        forwarded_messages = data.get("forwarded_messages", [])
+        uow.add_evidence_bulk(chat_history_rows(case_number, message.from_user.id, forwarded_messages))
 
-        await db.add_evidence(
-            case_number,
-            message.from_user.id,
-            "plaintiff",
-            "chat_history",
-            history_text,
-            None
-        )
+    await state.update_data(case_number=case_number)
 
     kb = ReplyKeyboardMarkup(
         keyboard=[
@@ -756,11 +749,13 @@ async def accept_defendant(callback: CallbackQuery, state: FSMContext):
         await callback.answer("⚠️ You cannot be a defendant in your own case", show_alert=True)
         return
 
-    await db.set_defendant(
-        case_number,
-        callback.from_user.id,
-        callback.from_user.username or callback.from_user.full_name
-    )
+    async with db.unit_of_work() as uow:
+        uow.set_defendant(
+            case_number,
+            callback.from_user.id,
+            callback.from_user.username or callback.from_user.full_name
+        )
+        uow.update_case_stage(case_number, "plaintiff_arguments")
 
     await callback.answer(f"✅ You have joined Case #{case_number} as the Defendant!")
 
@@ -785,8 +780,6 @@ async def accept_defendant(callback: CallbackQuery, state: FSMContext):
         except Exception as e:
             print(f"Error notifying group: {e}")
 
-    await db.update_case_stage(case_number, "plaintiff_arguments")
-
     await callback.message.answer(
         f"📋 Case #{case_number}\n"
         f"Topic: {case['topic']}\n\n"
@@ -898,6 +891,48 @@ async def reject_defendant(callback: CallbackQuery, state: FSMContext):
 # PLAINTIFF ARGUMENTATION
 # =============================================================================
 
+async def save_file_evidence(
+    message: types.Message,
+    case_number: str,
+    role: str,
+    ev_type: str,
+    description: str,
+    file_id: str,
+    file_name: str = None
+):
+    """Save a file as evidence and start its background ingestion"""
+    evidence_id = await db.add_evidence(
+        case_number,
+        message.from_user.id,
+        role,
+        ev_type,
+        description,
+        file_id,
+        file_name=file_name
+    )
+    evidence_ingestor.schedule(message.bot, evidence_id, ev_type, file_id, file_name)
+
+
+def build_evidence_info(evidence) -> list:
+    """Evidence rows in the shape expected by the AI service"""
+    return [
+        {
+            "id": e["id"],
+            "type": e["type"],
+            "content": e["content"],
+            "file_path": e["file_path"],
+            "file_name": e.get("file_name"),
+            "mime_type": e.get("mime_type"),
+            "extracted_text": e.get("extracted_text"),
+            "upload_uri": e.get("upload_uri"),
+            "upload_mime_type": e.get("upload_mime_type"),
+            "upload_expires_at": e.get("upload_expires_at"),
+            "role": e.get("role", "unknown")
+        }
+        for e in evidence
+    ]
+
+
 @router.message(DisputeState.plaintiff_arguments)
 async def plaintiff_arguments_handler(message: types.Message, state: FSMContext):
     """Handling plaintiff's arguments"""
@@ -997,9 +1032,9 @@ async def plaintiff_arguments_handler(message: types.Message, state: FSMContext)
 
     elif message.photo:
         file_id = message.photo[-1].file_id
-        await db.add_evidence(
+        await save_file_evidence(
+            message,
             case_number,
-            message.from_user.id,
             "plaintiff",
             "photo",
             message.caption or "Photo",
@@ -1009,21 +1044,22 @@ async def plaintiff_arguments_handler(message: types.Message, state: FSMContext)
 
     elif message.document:
         file_id = message.document.file_id
-        await db.add_evidence(
+        await save_file_evidence(
+            message,
             case_number,
-            message.from_user.id,
             "plaintiff",
             "document",
             message.caption or "Document",
-            file_id
+            file_id,
+            file_name=message.document.file_name
         )
         await message.answer("✅ Document added as evidence.")
 
     elif message.video:
         file_id = message.video.file_id
-        await db.add_evidence(
+        await save_file_evidence(
+            message,
             case_number,
-            message.from_user.id,
             "plaintiff",
             "video",
             message.caption or "Video",
@@ -1091,8 +1127,12 @@ async def defendant_arguments_handler(message: types.Message, state: FSMContext)
             except Exception as e:
                 print(f"Error notifying group: {e}")
 
-        # Start AI questions
-        await check_and_ask_ai_questions(message, state, case_number, "plaintiff")
+        # Start AI questions; the job sets the parties' states itself.
+        # After a failed AI review the restart continues with the first round not asked yet
+        await state.clear()
+        next_round = max(await db.get_ai_questions_count(case_number, "plaintiff"),
+                         await db.get_ai_questions_count(case_number, "defendant")) + 1
+        await enqueue_ai_questions(case_number, "plaintiff", next_round)
         return
 
     # Save argument
@@ -1112,9 +1152,9 @@ async def defendant_arguments_handler(message: types.Message, state: FSMContext)
 
     elif message.photo:
         file_id = message.photo[-1].file_id
-        await db.add_evidence(
+        await save_file_evidence(
+            message,
             case_number,
-            message.from_user.id,
             "defendant",
             "photo",
             message.caption or "Photo",
@@ -1124,21 +1164,22 @@ async def defendant_arguments_handler(message: types.Message, state: FSMContext)
 
     elif message.document:
         file_id = message.document.file_id
-        await db.add_evidence(
+        await save_file_evidence(
+            message,
             case_number,
-            message.from_user.id,
             "defendant",
             "document",
             message.caption or "Document",
-            file_id
+            file_id,
+            file_name=message.document.file_name
         )
         await message.answer("✅ Document added as evidence.")
 
     elif message.video:
         file_id = message.video.file_id
-        await db.add_evidence(
+        await save_file_evidence(
+            message,
             case_number,
-            message.from_user.id,
             "defendant",
             "video",
             message.caption or "Video",
@@ -1150,61 +1191,136 @@ async def defendant_arguments_handler(message: types.Message, state: FSMContext)
 # AI QUESTIONS
 # =============================================================================
 
-async def check_and_ask_ai_questions(message: types.Message, state: FSMContext, case_number: str, role: str):
-    """Check and generate AI clarifying questions"""
-    data = await state.get_data()
-    ai_round = data.get(f"ai_round_{role}", 0)
+async def enqueue_ai_questions(case_number: str, role: str, round_number: int):
+    """Queue a round of AI clarifying questions; one job per round (and role, when asked in turn)"""
+    if settings.AI_QUESTIONS_JOINT_MODE:
+        await enqueue_job("joint_ai_questions", case_number,
+                          dedupe_key=f"ai_questions:{case_number}:{round_number}:joint",
+                          case_number=case_number, round_number=round_number)
+    else:
+        await enqueue_job("ai_questions", case_number,
+                          dedupe_key=f"ai_questions:{case_number}:{round_number}:{role}",
+                          case_number=case_number, role=role, round_number=round_number)
 
-    if ai_round >= 3:  # Max 2 rounds of questions
-        if role == "defendant":
-            await generate_final_verdict(message, state, case_number)
-        else:
-            await check_and_ask_ai_questions(message, state, case_number, "defendant")
-        return
 
+async def enqueue_final_verdict(case_number: str):
+    await enqueue_job("final_verdict", case_number, dedupe_key=f"final_verdict:{case_number}",
+                      case_number=case_number)
+
+
+def get_user_state(bot: Bot, storage: BaseStorage, user_id: int) -> FSMContext:
+    return FSMContext(
+        storage=storage,
+        key=StorageKey(bot_id=bot.id, chat_id=user_id, user_id=user_id)
+    )
+
+
+async def ai_review_failed(bot: Bot, storage: BaseStorage, case_number: str, **_):
+    """
+    Give-up handler of the AI jobs. The case goes back to the end of the defendant's arguments,
+    where "✅ Finish arguments" starts the AI review again, and both parties are told.
+    """
     case = await db.get_case_by_number(case_number)
-    participants = await db.list_participants(case["id"])
-    evidence = await db.get_case_evidence(case_number)
+    if case is None or case.get("status") == "finished":
+        return
+    await db.update_case_stage(case_number, "defendant_arguments")
 
-    participants_info = [
-        {"role": p["role"], "username": p["username"], "description": p["role"].capitalize()}
-        for p in participants
-    ]
-    evidence_info = [
-        {
-            "type": e["type"],
-            "content": e["content"],
-            "file_path": e["file_path"],
-            "role": e.get("role", "unknown")
-        }
-        for e in evidence
-    ]
+    plaintiff_id = case["plaintiff_id"]
+    defendant_id = case.get("defendant_id")
+    await get_user_state(bot, storage, plaintiff_id).clear()
+    if defendant_id:
+        defendant_state = get_user_state(bot, storage, defendant_id)
+        await defendant_state.set_state(DisputeState.defendant_arguments)
+        await defendant_state.set_data({"case_number": case_number})
 
-    ai_questions = await gemini_service.generate_clarifying_questions(
-        case, participants_info, evidence_info, role, ai_round + 1, message.bot
+    kb = ReplyKeyboardMarkup(
+        keyboard=[
+            [KeyboardButton(text="✅ Finish arguments")],
+            [KeyboardButton(text="⛔ Pause case")],
+            [KeyboardButton(text="🔙 Back to Menu")]
+        ],
+        resize_keyboard=True
     )
+    notices = [
+        (plaintiff_id, "The defendant can restart the review.", get_back_to_menu_keyboard()),
+        (defendant_id, "Press «✅ Finish arguments» to restart the review.", kb),
+    ]
+    for user_id, action, reply_markup in notices:
+        if not user_id:
+            continue
+        try:
+            await bot.send_message(
+                user_id,
+                f"⚠️ The AI judge could not process Case #{case_number}. {action}",
+                reply_markup=reply_markup
+            )
+        except Exception as e:
+            print(f"Notify error ({user_id}): {e}")
+
+
+async def has_round_questions(state: FSMContext, context: CaseContext, role: str, round_number: int) -> bool:
+    """The party already got the questions of this round (is answering them or has answered)"""
+    if context.answered_round(role, round_number):
+        return True
+    data = await state.get_data()
+    return (await state.get_state() == DisputeState.ai_asking_questions.state
+            and data.get("case_number") == context.case["case_number"]
+            and data.get("ai_round") == round_number)
+
+
+@register_job("ai_questions", on_give_up=ai_review_failed)
+async def check_and_ask_ai_questions(bot: Bot, storage: BaseStorage, case_number: str, role: str,
+                                     round_number: int = None):
+    """
+    Check and generate AI clarifying questions (queued job).
+    Questions of a round are saved once; a retry resumes the round with the saved questions.
+    """
+    context = await db.load_case_context(case_number)
+    if context is None:
+        print(f"AI questions: case {case_number} not found")
+        return
 
-    if not ai_questions or len(ai_questions) == 0:
+    if round_number is None:
+        # Jobs queued before the round was part of the payload
+        round_number = context.question_round(role) + 1
+
+    if round_number > 3:  # Max 3 rounds of questions
         if role == "defendant":
-            await generate_final_verdict(message, state, case_number)
+            await enqueue_final_verdict(case_number)
         else:
-            await check_and_ask_ai_questions(message, state, case_number, "defendant")
+            await enqueue_ai_questions(case_number, "defendant", context.question_round("defendant") + 1)
         return
 
-    for question in ai_questions:
-        await db.save_ai_question(case_number, question, role, ai_round + 1)
+    case = context.case
+    participants_info = [
+        {"role": p["role"], "username": p["username"], "description": p["role"].capitalize()}
+        for p in context.participants
+    ]
+    evidence_info = build_evidence_info(context.evidence)
 
-    case = await db.get_case_by_number(case_number)
     target_user_id = case["plaintiff_id"] if role == "plaintiff" else case["defendant_id"]
+    target_state = get_user_state(bot, storage, target_user_id)
 
-    target_state = FSMContext(
-        storage=state.storage,
-        key=StorageKey(
-            bot_id=(await message.bot.get_me()).id,
-            chat_id=target_user_id,
-            user_id=target_user_id
+    ai_questions = context.round_questions(role, round_number)
+    if ai_questions:
+        # A retry after the questions were saved: resume the round instead of asking new ones
+        if await has_round_questions(target_state, context, role, round_number):
+            return
+    else:
+        ai_questions = await gemini_service.generate_clarifying_questions(
+            case, participants_info, evidence_info, role, round_number, bot,
+            pending_questions=context.asked_questions
         )
-    )
+
+        if not ai_questions or len(ai_questions) == 0:
+            if role == "defendant":
+                await enqueue_final_verdict(case_number)
+            else:
+                await enqueue_ai_questions(case_number, "defendant", context.question_round("defendant") + 1)
+            return
+
+        async with db.unit_of_work() as uow:
+            uow.save_ai_questions(case_number, ai_questions, role, round_number)
 
     await target_state.set_state(DisputeState.ai_asking_questions)
     await target_state.update_data(
@@ -1212,7 +1328,7 @@ async def check_and_ask_ai_questions(message: types.Message, state: FSMContext,
         ai_questions=ai_questions,
         current_question_index=0,
         answering_role=role,
-        ai_round=ai_round + 1,
+        ai_round=round_number,
         skip_count=0
     )
 
@@ -1227,7 +1343,7 @@ async def check_and_ask_ai_questions(message: types.Message, state: FSMContext,
     role_text = "Plaintiff" if role == "plaintiff" else "Defendant"
 
     try:
-        await message.bot.send_message(
+        await bot.send_message(
             target_user_id,
             f"<b>🤖 The AI Judge has clarifying questions.</b>\n\n"
             f"<b>{role_text}</b>, please answer:\n\n"
@@ -1241,7 +1357,7 @@ async def check_and_ask_ai_questions(message: types.Message, state: FSMContext,
 
     if case.get("chat_id"):
         try:
-            await message.bot.send_message(
+            await bot.send_message(
                 case["chat_id"],
                 f"Update on Case #{case_number}\n"
                 f"✅ AI judge is asking additional questions to the {role_text.lower()}."
@@ -1250,6 +1366,121 @@ async def check_and_ask_ai_questions(message: types.Message, state: FSMContext,
             pass
 
 
+@register_job("joint_ai_questions", on_give_up=ai_review_failed)
+async def ask_joint_ai_questions(bot: Bot, storage: BaseStorage, case_number: str, round_number: int = None):
+    """
+    One AI call asks both parties at once; the parties answer in parallel (queued job).
+    Questions of a round are saved once for both parties; a retry resumes the round and
+    delivers the saved questions to the parties that do not have them yet.
+    """
+    context = await db.load_case_context(case_number)
+    if context is None:
+        print(f"AI questions: case {case_number} not found")
+        return
+
+    if round_number is None:
+        # Jobs queued before the round was part of the payload
+        round_number = max(context.question_round("plaintiff"), context.question_round("defendant")) + 1
+    if round_number > 3:
+        await enqueue_final_verdict(case_number)
+        return
+
+    case = context.case
+    questions_by_role = {role: context.round_questions(role, round_number) for role in ("plaintiff", "defendant")}
+    resumed = any(questions_by_role.values())
+
+    if not resumed:
+        participants_info = [
+            {"role": p["role"], "username": p["username"], "description": p["role"].capitalize()}
+            for p in context.participants
+        ]
+        evidence_info = build_evidence_info(context.evidence)
+
+        questions_by_role = await gemini_service.generate_clarifying_questions(
+            case, participants_info, evidence_info, None, round_number, bot,
+            pending_questions=context.asked_questions, joint=True
+        )
+
+        if not any(questions_by_role.values()):
+            await enqueue_final_verdict(case_number)
+            return
+
+        # Both parties' questions in one transaction, so the round is either saved whole or not at all
+        async with db.unit_of_work() as uow:
+            for role, questions in questions_by_role.items():
+                uow.save_ai_questions(case_number, questions, role, round_number)
+
+    user_ids = {"plaintiff": case["plaintiff_id"], "defendant": case["defendant_id"]}
+    round_stage = f"ai_round_{round_number}_answered"
+
+    # A party without questions is done with the round right away,
+    # before the other party can possibly finish answering
+    for role, questions in questions_by_role.items():
+        if not questions:
+            all_answered = await db.complete_participant_stage(
+                case_number, user_ids[role], round_stage, list(user_ids.values())
+            )
+            if all_answered:
+                # Only on a resumed round: the other party has answered meanwhile
+                await enqueue_ai_questions(case_number, role, round_number + 1)
+                return
+
+    kb = ReplyKeyboardMarkup(
+        keyboard=[
+            [KeyboardButton(text="⏩ Skip question")],
+            [KeyboardButton(text="🔙 Back to Menu")]
+        ],
+        resize_keyboard=True
+    )
+
+    asked_roles = []
+    for role, questions in questions_by_role.items():
+        if not questions:
+            continue
+
+        target_user_id = user_ids[role]
+        target_state = get_user_state(bot, storage, target_user_id)
+        if resumed and await has_round_questions(target_state, context, role, round_number):
+            continue
+
+        await target_state.set_state(DisputeState.ai_asking_questions)
+        await target_state.update_data(
+            case_number=case_number,
+            ai_questions=questions,
+            current_question_index=0,
+            answering_role=role,
+            ai_round=round_number,
+            skip_count=0,
+            joint_round=True
+        )
+        asked_roles.append(role)
+
+        role_text = "Plaintiff" if role == "plaintiff" else "Defendant"
+        try:
+            await bot.send_message(
+                target_user_id,
+                f"<b>🤖 The AI Judge has clarifying questions.</b>\n\n"
+                f"<b>{role_text}</b>, please answer:\n\n"
+                f"? {questions[0]}\n\n"
+                f"Question 1 of {len(questions)}",
+                reply_markup=kb,
+                parse_mode=ParseMode.HTML
+            )
+        except Exception as e:
+            print(f"Error sending AI questions to {role}: {e}")
+
+    if asked_roles and case.get("chat_id"):
+        asked = " and ".join(asked_roles)
+        try:
+            await bot.send_message(
+                case["chat_id"],
+                f"Update on Case #{case_number}\n"
+                f"✅ AI judge is asking additional questions to the {asked}."
+            )
+        except:
+            pass
+
+
 @router.message(DisputeState.ai_asking_questions)
 async def handle_ai_question_response(message: types.Message, state: FSMContext):
     """Handling AI question responses"""
@@ -1280,17 +1511,8 @@ async def handle_ai_question_response(message: types.Message, state: FSMContext)
             return
     else:
         question_text = ai_questions[current_index]
-        response_text = f"AI Question: {question_text}\nAnswer: {message.text}"
-
-        await db.add_evidence(
-            case_number,
-            message.from_user.id,
-            answering_role,
-            "ai_response",
-            response_text,
-            None
-        )
 
+        # Stored as soon as it arrives; finish_ai_questions turns the round's answers into evidence
         await db.save_ai_answer(
             case_number,
             question_text,
@@ -1327,109 +1549,196 @@ async def handle_ai_question_response(message: types.Message, state: FSMContext)
         await finish_ai_questions(message, state, case_number, answering_role)
 
 
+async def record_round_answers(case_number: str, user_id: int, role: str, round_number: int):
+    """The party's answers of a round become ai_response evidence in one COPY, once per round"""
+    if await db.get_answered_ai_questions_count(case_number, role, round_number):
+        return
+    answers = await db.get_ai_answers(case_number, role, round_number)
+    await db.add_evidence_bulk([
+        EvidenceRow(case_number, user_id, role, "ai_response",
+                    f"AI Question: {answer['question']}\nAnswer: {answer['answer']}", round_number=round_number)
+        for answer in answers
+    ])
+
+
 async def finish_ai_questions(message: types.Message, state: FSMContext, case_number: str, answering_role: str):
     """Finish AI questions round"""
     data = await state.get_data()
     ai_round = data.get("ai_round", 1)
 
+    await record_round_answers(case_number, message.from_user.id, answering_role, ai_round)
+
     case = await db.get_case_by_number(case_number)
-    plaintiff_state = FSMContext(
-        storage=state.storage,
-        key=StorageKey(bot_id=(await message.bot.get_me()).id, chat_id=case["plaintiff_id"],
-                       user_id=case["plaintiff_id"])
-    )
-    defendant_state = FSMContext(
-        storage=state.storage,
-        key=StorageKey(bot_id=(await message.bot.get_me()).id, chat_id=case["defendant_id"],
-                       user_id=case["defendant_id"])
-    )
 
-    if answering_role == "plaintiff":
-        await plaintiff_state.update_data(ai_round_plaintiff=ai_round)
-        await check_and_ask_ai_questions(message, defendant_state, case_number, "defendant")
-    else:
-        await defendant_state.update_data(ai_round_defendant=ai_round)
-        await generate_final_verdict(message, state, case_number)
+    if data.get("joint_round"):
+        # Both parties answer in parallel; whoever finishes last starts the next round
+        await state.clear()
+        all_answered = await db.complete_participant_stage(
+            case_number, message.from_user.id, f"ai_round_{ai_round}_answered",
+            [case["plaintiff_id"], case["defendant_id"]]
+        )
+        if all_answered:
+            await enqueue_ai_questions(case_number, answering_role, ai_round + 1)
+        else:
+            await message.answer("⏳ Waiting for the other party to finish answering the AI judge.")
+        return
 
     await state.clear()
+    if answering_role == "plaintiff":
+        defendant_round = await db.get_ai_questions_count(case_number, "defendant") + 1
+        await enqueue_ai_questions(case_number, "defendant", defendant_round)
+    else:
+        await enqueue_final_verdict(case_number)
 
 
 # =============================================================================
 # FINAL VERDICT
 # =============================================================================
 
-async def generate_final_verdict(
-    message: types.Message,
-    state: FSMContext,
-    case_number: str,
-):
-    """Generate final verdict and notify all parties"""
+VERDICT_STATUS_HEADER = "<b>⚖️ AI judge is analyzing the case and rendering a decision...</b>\n\n"
+
+# What the judge is doing while a field of the streamed decision is being written
+VERDICT_FIELD_STAGES = {
+    "established_facts": "🔎 Establishing the facts",
+    "violations": "📑 Identifying violations",
+    "decision": "✍️ Drafting the decision",
+    "verdict": "⚖️ Determining the outcome",
+    "winner": "⚖️ Determining the outcome",
+    "reasoning": "🧾 Writing the reasoning",
+}
+
+
+class VerdictProgress:
+    """
+    Edits the "analyzing the case" status messages of both parties while the verdict streams in.
+    Edits are throttled per call (settings.VERDICT_PROGRESS_INTERVAL) and skipped when the text
+    has not changed, to stay within Telegram's edit rate limits.
+    """
+
+    def __init__(self, bot: Bot, messages: List[types.Message]):
+        self.bot = bot
+        self.messages = messages
+        self.interval = settings.VERDICT_PROGRESS_INTERVAL
+        self._last_text = None
+        self._next_edit_at = 0.0
+
+    async def update(self, progress: Dict):
+        now = asyncio.get_running_loop().time()
+        if now < self._next_edit_at:
+            return
 
-    case = await db.get_case_by_number(case_number)
-    if not case:
-        await message.answer("⚠️ Case not found.")
-        return
+        text = self._render(progress)
+        if text == self._last_text:
+            return
+        self._last_text = text
+        self._next_edit_at = now + self.interval
 
-    participants = await db.list_participants(case["id"])
-    evidence = await db.get_case_evidence(case_number)
+        for status in self.messages:
+            try:
+                await self.bot.edit_message_text(
+                    text, chat_id=status.chat.id, message_id=status.message_id, parse_mode=ParseMode.HTML
+                )
+            except TelegramRetryAfter as e:
+                self._next_edit_at = now + max(self.interval, e.retry_after)
+            except TelegramBadRequest:
+                # "message is not modified" or the message was deleted
+                pass
+
+    @staticmethod
+    def _render(progress: Dict) -> str:
+        lines = []
+        facts = progress["items"].get("established_facts")
+        if facts:
+            lines.append(f"🔎 Facts established: {facts}")
+        violations = progress["items"].get("violations")
+        if violations:
+            lines.append(f"📑 Violations identified: {violations}")
+        for field in ("decision", "reasoning"):
+            if field in progress["fields"] and progress["current_field"] != field:
+                lines.append(f"✅ {field.capitalize()} drafted")
+
+        stage = VERDICT_FIELD_STAGES.get(progress["current_field"])
+        if stage:
+            lines.append(f"{stage}...")
+        return VERDICT_STATUS_HEADER + "\n".join(lines or ["⏳ Reviewing the evidence..."])
+
+
+@register_job("final_verdict", on_give_up=ai_review_failed)
+async def generate_final_verdict(bot: Bot, storage: BaseStorage, case_number: str):
+    """Generate final verdict and notify all parties (queued job)"""
+
+    context = await db.load_case_context(case_number)
+    if context is None:
+        print(f"Final verdict: case {case_number} not found")
+        return
+    case = context.case
+    if case.get("status") == "finished":
+        # The job is re-run after a crash that happened once the verdict was already saved
+        return
 
     participants_info = [
         {"role": p["role"], "username": p["username"], "description": p["role"].capitalize()}
-        for p in participants
-    ]
-    evidence_info = [
-        {
-            "type": e["type"],
-            "content": e["content"],
-            "file_path": e["file_path"],
-            "role": e.get("role", "unknown")
-        }
-        for e in evidence
+        for p in context.participants
     ]
+    evidence_info = build_evidence_info(context.evidence)
 
     plaintiff_id = case["plaintiff_id"]
     defendant_id = case.get("defendant_id")
 
+    status_messages = []
     for user_id in filter(None, [plaintiff_id, defendant_id]):
         try:
-            await message.bot.send_message(
+            status_messages.append(await bot.send_message(
                 user_id,
-                "<b>⚖️ AI judge is analyzing the case and rendering a decision...</b>\n\n"
-                "⏳ Please wait, this may take a moment...",
+                VERDICT_STATUS_HEADER + "⏳ Please wait, this may take a moment...",
                 parse_mode=ParseMode.HTML
-            )
+            ))
         except Exception as e:
             print(f"Notify error ({user_id}): {e}")
 
+    progress = VerdictProgress(bot, status_messages) if settings.VERDICT_STREAMING else None
+
     try:
         decision = await gemini_service.generate_full_decision(
             case,
             participants_info,
             evidence_info,
-            bot=message.bot
+            bot=bot,
+            on_progress=progress.update if progress else None
         )
-    except Exception as e:
-        print(f"Decision generation failed: {e}")
-        decision = {
-            "decision": "Technical error during decision generation.",
-            "winner": "defendant",
-            "verdict": {
-                "claim_granted": False,
-                "amount_awarded": 0,
-                "court_costs": 0
-            },
-            "reasoning": str(e)
-        }
+    except LLMUnavailableError:
+        # The job queue retries the verdict later; the case stays open meanwhile
+        for user_id in filter(None, [plaintiff_id, defendant_id]):
+            try:
+                await bot.send_message(
+                    user_id,
+                    "⏳ The AI judge is temporarily unavailable. The verdict will be retried automatically."
+                )
+            except Exception as e:
+                print(f"Notify error ({user_id}): {e}")
+        raise
+    except DecisionGenerationError as e:
+        # A malformed decision is retried like an outage; a default verdict is never saved
+        print(f"Decision generation failed for case {case_number}: {e}")
+        for user_id in filter(None, [plaintiff_id, defendant_id]):
+            try:
+                await bot.send_message(
+                    user_id,
+                    "⏳ The AI judge could not complete the verdict. It will be retried automatically."
+                )
+            except Exception as notify_error:
+                print(f"Notify error ({user_id}): {notify_error}")
+        raise
 
     verdict = decision.get("verdict", {})
     claim_granted = verdict.get("claim_granted", False)
     winner = decision.get("winner", "defendant")
 
-    await db.update_case_stage(case_number, "final_decision")
-    await db.update_case_status(case_number, "finished")
-
     try:
-        pdf_bytes = pdf_generator.generate_verdict_pdf(
+        # reportlab and the font are loaded on the first verdict, not at bot startup
+        from pdf_gen import get_pdf_generator
+
+        pdf_bytes = get_pdf_generator().generate_verdict_pdf(
             case,
             decision,
             participants_info,
@@ -1438,34 +1747,40 @@ async def generate_final_verdict(
         filepath = f"verdict_{case_number}.pdf"
         with open(filepath, "wb") as f:
             f.write(pdf_bytes)
-
-        await db.save_decision(
-            case_number=case_number,
-            claim_granted=claim_granted,
-            file_path=filepath
-        )
     except Exception as e:
         print(f"PDF generation error: {e}")
         filepath = None
 
+    # Closing the case and storing the decision happen together, so a re-run job either
+    # finds the case finished with its decision or redoes both
+    async with db.unit_of_work() as uow:
+        uow.update_case_stage(case_number, "final_decision")
+        uow.update_case_status(case_number, "finished")
+        if filepath:
+            uow.save_decision(
+                case_number=case_number,
+                claim_granted=claim_granted,
+                file_path=filepath
+            )
+
     kb = get_main_menu_keyboard()
 
     for user_id in filter(None, [plaintiff_id, defendant_id]):
         try:
-            await message.bot.send_message(
+            await bot.send_message(
                 user_id,
                 "✅ <b>⚖️ Case Closed</b>\n\n📄 Here is the final verdict:",
                 parse_mode=ParseMode.HTML
             )
 
             if filepath:
-                await message.bot.send_document(
+                await bot.send_document(
                     user_id,
                     FSInputFile(filepath),
                     reply_markup=kb
                 )
             else:
-                await message.bot.send_message(
+                await bot.send_message(
                     user_id,
                     "⚠️ Error generating PDF document.",
                     reply_markup=kb
@@ -1494,10 +1809,10 @@ async def generate_final_verdict(
                     "📄 Tap the document below for the full reasoning and details."
                 )
 
-            await message.bot.send_message(case["chat_id"], group_text)
+            await bot.send_message(case["chat_id"], group_text)
 
             if filepath:
-                await message.bot.send_document(
+                await bot.send_document(
                     case["chat_id"],
                     FSInputFile(filepath)
                 )
@@ -1511,8 +1826,6 @@ async def generate_final_verdict(
         except Exception as e:
             print(f"File cleanup error: {e}")
 
-    await state.clear()
-
 
 # =============================================================================
 # HELP & AUXILIARY COMMANDS
@@ -1777,13 +2090,14 @@ async def media_handler(message: types.Message, state: FSMContext):
 
     if file_id:
         # Save to database with file_id (which will be used as file_path)
-        await db.add_evidence(
+        await save_file_evidence(
+            message,
             case_number,
-            message.from_user.id,
             role,
             content_type,
             file_description,
-            file_id  # This is the Telegram file_id
+            file_id,  # This is the Telegram file_id
+            file_name=message.document.file_name if message.document else None
         )
 
         role_text = "Plaintiff" if role == "plaintiff" else "Defendant"
@@ -0,0 +1,70 @@
+import io
+from typing import TYPE_CHECKING, NamedTuple, Optional
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+# Formats Pillow can write that Gemini accepts inline
+MIME_TYPES = {
+    "WEBP": "image/webp",
+    "JPEG": "image/jpeg",
+    "PNG": "image/png",
+}
+
+
+class NormalizedImage(NamedTuple):
+    data: bytes
+    mime_type: str
+    phash: Optional[int]
+    original_size: int
+
+
+def perceptual_hash(image: "Image.Image") -> int:
+    """64-bit difference hash: survives re-encoding and resizing, changes with the content"""
+    from PIL import Image
+
+    small = image.convert("L").resize((9, 8), Image.LANCZOS)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            value = (value << 1) | (1 if left > right else 0)
+    return value
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def normalize_image(file_bytes: bytes, max_edge: int, quality: int, image_format: str = "WEBP") -> NormalizedImage:
+    """
+    Downscales the image so its longest edge is at most max_edge and re-encodes it.
+    EXIF orientation is applied first; no metadata is written to the output.
+    CPU-bound, so callers on the event loop should run it in a thread.
+    Pillow is imported on the first image, not when the bot starts.
+    """
+    from PIL import Image, ImageOps
+
+    image_format = image_format.upper()
+    with Image.open(io.BytesIO(file_bytes)) as source:
+        source.seek(0)  # first frame of animated images
+        image = ImageOps.exif_transpose(source)
+
+        has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+        if has_alpha and image_format != "JPEG":
+            image = image.convert("RGBA")
+        else:
+            image = image.convert("RGB")
+
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        phash = perceptual_hash(image)
+
+        output = io.BytesIO()
+        save_kwargs = {"optimize": True}
+        if image_format in ("WEBP", "JPEG"):
+            save_kwargs["quality"] = quality
+        image.save(output, format=image_format, **save_kwargs)
+
+    return NormalizedImage(output.getvalue(), MIME_TYPES[image_format], phash, len(file_bytes))
@@ -0,0 +1,158 @@
+import asyncio
+import os
+import socket
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from aiogram import Bot
+from aiogram.fsm.storage.base import BaseStorage
+
+from conf import settings
+from database import db
+
+JobHandler = Callable[..., Awaitable[None]]
+
+# kind -> coroutine function(bot, storage, **payload); filled by register_job
+_job_handlers: Dict[str, JobHandler] = {}
+# kind -> coroutine function(bot, storage, **payload) run once a job of that kind has used up its attempts
+_give_up_handlers: Dict[str, JobHandler] = {}
+
+
+def register_job(kind: str, on_give_up: Optional[JobHandler] = None):
+    """
+    Decorator that makes a coroutine runnable as a queued job of the given kind.
+    on_give_up is called with the same arguments when the job fails for the last time.
+    """
+    def decorator(func: JobHandler) -> JobHandler:
+        _job_handlers[kind] = func
+        if on_give_up is not None:
+            _give_up_handlers[kind] = on_give_up
+        return func
+    return decorator
+
+
+async def enqueue_job(kind: str, case_number: str, dedupe_key: Optional[str] = None, **payload) -> Optional[int]:
+    """
+    Stores a job in llm_jobs and returns its id. A job whose dedupe_key matches a job that is
+    still queued or running is not added again (None is returned).
+    """
+    return await db.enqueue_llm_job(kind, case_number, payload, dedupe_key)
+
+
+class JobWorkerPool:
+    """
+    Pulls jobs from the llm_jobs table and runs them with bounded concurrency.
+
+    A job is claimed with a lease (FOR UPDATE SKIP LOCKED, so several processes can share the
+    table); the lease is extended while the job runs. If the process dies, the lease expires
+    and the job is picked up again, so a verdict in progress survives a restart. Failed jobs
+    are retried with exponential backoff up to LLM_JOB_MAX_ATTEMPTS, then the give-up handler
+    of the kind runs. Errors of the queue bookkeeping are logged and never stop a worker.
+    """
+
+    def __init__(self, bot: Bot, storage: BaseStorage, concurrency: int, lease_seconds: float,
+                 poll_interval: float, max_attempts: int):
+        self.bot = bot
+        self.storage = storage
+        self.concurrency = concurrency
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._workers: List[asyncio.Task] = []
+        self._stopping = asyncio.Event()
+
+    def start(self):
+        self._stopping.clear()
+        self._workers = [
+            asyncio.create_task(self._worker_loop(f"{self.worker_id}:{i}"))
+            for i in range(self.concurrency)
+        ]
+
+    async def stop(self):
+        """Stops taking jobs; running jobs are cancelled and handed back to the queue"""
+        self._stopping.set()
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def _worker_loop(self, worker_id: str):
+        while not self._stopping.is_set():
+            try:
+                job = await db.claim_llm_job(worker_id, self.lease_seconds, list(_job_handlers))
+            except Exception as e:
+                print(f"Job queue error: {e}")
+                job = None
+
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            try:
+                await self._run_job(job, worker_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # The lease runs out and the job is picked up again
+                print(f"Job queue error on job {job['id']}: {e!r}")
+
+    async def _run_job(self, job: Dict, worker_id: str):
+        heartbeat = asyncio.create_task(self._keep_lease(job["id"], worker_id))
+        try:
+            handler = _job_handlers[job["kind"]]
+            await handler(self.bot, self.storage, **job["payload"])
+        except asyncio.CancelledError:
+            # Shutdown: hand the job back right away instead of waiting for the lease to expire
+            await asyncio.shield(self._bookkeeping(db.release_llm_job(job["id"]), job))
+            raise
+        except Exception as e:
+            print(f"Job {job['id']} ({job['kind']}, case {job['case_number']}) failed "
+                  f"on attempt {job['attempts']}: {e!r}")
+            retry_in = min(30 * 2 ** (job["attempts"] - 1), 600)
+            give_up = job["attempts"] >= self.max_attempts
+            await self._bookkeeping(db.fail_llm_job(job["id"], repr(e), retry_in, give_up=give_up), job)
+            if give_up:
+                await self._give_up(job)
+        else:
+            await self._bookkeeping(db.complete_llm_job(job["id"]), job)
+        finally:
+            heartbeat.cancel()
+
+    @staticmethod
+    async def _bookkeeping(command: Awaitable, job: Dict):
+        """A lost status update only means the job runs again after its lease"""
+        try:
+            await command
+        except Exception as e:
+            print(f"Failed to update job {job['id']} ({job['kind']}): {e!r}")
+
+    async def _give_up(self, job: Dict):
+        handler = _give_up_handlers.get(job["kind"])
+        if handler is None:
+            return
+        try:
+            await handler(self.bot, self.storage, **job["payload"])
+        except Exception as e:
+            print(f"Give-up handler of job {job['id']} ({job['kind']}) failed: {e!r}")
+
+    async def _keep_lease(self, job_id: int, worker_id: str):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                await db.extend_llm_job_lease(job_id, worker_id, self.lease_seconds)
+            except Exception as e:
+                print(f"Failed to extend lease of job {job_id}: {e}")
+
+
+def create_worker_pool(bot: Bot, storage: BaseStorage) -> JobWorkerPool:
+    return JobWorkerPool(
+        bot,
+        storage,
+        concurrency=settings.LLM_JOB_WORKERS,
+        lease_seconds=settings.LLM_JOB_LEASE,
+        poll_interval=settings.LLM_JOB_POLL_INTERVAL,
+        max_attempts=settings.LLM_JOB_MAX_ATTEMPTS
+    )
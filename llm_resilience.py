@@ -0,0 +1,203 @@
+import asyncio
+import functools
+import random
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Optional, Tuple, Type, TypeVar
+
+T = TypeVar("T")
+
+
+@functools.lru_cache(maxsize=None)
+def retryable_errors() -> Tuple[Type[BaseException], ...]:
+    """
+    Transient server-side failures: worth another attempt after a pause.
+    api_core pulls in grpc and protobuf, so it is imported on the first failure, not at startup.
+    """
+    from google.api_core import exceptions as google_exceptions
+    return (
+        google_exceptions.TooManyRequests,
+        google_exceptions.ResourceExhausted,
+        google_exceptions.ServiceUnavailable,
+        google_exceptions.InternalServerError,
+        google_exceptions.GatewayTimeout,
+        google_exceptions.DeadlineExceeded,
+        google_exceptions.Aborted,
+        asyncio.TimeoutError,
+        ConnectionError,
+    )
+
+
+class LLMUnavailableError(Exception):
+    """The model did not answer within the attempts and the deadline of the call"""
+
+
+class CircuitOpenError(LLMUnavailableError):
+    """Calls are short-circuited after a run of failures"""
+
+
+def is_retryable(error: BaseException) -> bool:
+    return isinstance(error, retryable_errors())
+
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive transient failures and rejects calls for
+    reset_timeout seconds. Then a single probe call is let through: its success closes
+    the circuit, its failure opens it again.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probe_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def before_call(self):
+        state = self.state
+        if state == "open":
+            raise CircuitOpenError("Gemini circuit is open after repeated failures")
+        if state == "half_open":
+            if self._probe_in_flight:
+                raise CircuitOpenError("Gemini circuit is half-open, waiting for the probe call")
+            self._probe_in_flight = True
+
+    def record_success(self):
+        self._failures = 0
+        self._opened_at = None
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self._failures += 1
+        if self._probe_in_flight or self._failures >= self.failure_threshold:
+            self._opened_at = time.monotonic()
+        self._probe_in_flight = False
+
+    def release_probe(self):
+        """The probe ended with an error that says nothing about the service (e.g. a bad request)"""
+        self._probe_in_flight = False
+
+
+class LatencyTracker:
+    """Sliding window of successful call latencies per call type"""
+
+    def __init__(self, window: int = 200):
+        self.window = window
+        self._samples: Dict[str, Deque[float]] = {}
+
+    def add(self, call_type: str, seconds: float):
+        self._samples.setdefault(call_type, deque(maxlen=self.window)).append(seconds)
+
+    def quantile(self, call_type: str, q: float, min_samples: int) -> Optional[float]:
+        samples = self._samples.get(call_type)
+        if not samples or len(samples) < min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(int(len(ordered) * q), len(ordered) - 1)]
+
+
+class ResilientCaller:
+    """
+    Runs a model call with classified retries (full-jitter exponential backoff),
+    an overall deadline per call type, a circuit breaker shared by all calls and,
+    optionally, a hedged duplicate request once the attempt outlives the observed
+    latency quantile of its call type.
+
+    attempt(timeout) performs one request and must finish within timeout seconds.
+    """
+
+    def __init__(self, max_attempts: int, base_delay: float, max_delay: float,
+                 deadlines: Dict[str, float], default_deadline: float,
+                 breaker: CircuitBreaker, hedge: bool = False,
+                 hedge_quantile: float = 0.95, hedge_min_samples: int = 20):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadlines = deadlines
+        self.default_deadline = default_deadline
+        self.breaker = breaker
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples
+        self.latency = LatencyTracker()
+
+    async def call(self, call_type: str, attempt: Callable[[float], Awaitable[T]], attempt_timeout: float,
+                   hedge: bool = True, stats: Optional[Dict] = None) -> T:
+        """
+        hedge=False disables the duplicate request, e.g. for streamed calls with side effects.
+        stats, if given, receives the number of attempts made ("attempts") and of hedged duplicates ("hedges").
+        """
+        stats = {} if stats is None else stats
+        stats.update(attempts=0, hedges=0)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.deadlines.get(call_type, self.default_deadline)
+        last_error: Optional[BaseException] = None
+
+        for attempt_number in range(1, self.max_attempts + 1):
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            self.breaker.before_call()
+
+            stats["attempts"] = attempt_number
+            started = loop.time()
+            try:
+                result = await self._run_attempt(call_type, attempt, min(attempt_timeout, remaining), hedge, stats)
+            except Exception as e:
+                if not is_retryable(e):
+                    self.breaker.release_probe()
+                    raise
+                self.breaker.record_failure()
+                last_error = e
+                print(f"Gemini {call_type} attempt {attempt_number}/{self.max_attempts} failed: {e!r}")
+
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt_number - 1)))
+                if attempt_number == self.max_attempts or loop.time() + delay >= deadline:
+                    break
+                await asyncio.sleep(delay)
+                continue
+
+            self.breaker.record_success()
+            self.latency.add(call_type, loop.time() - started)
+            return result
+
+        raise LLMUnavailableError(f"Gemini {call_type} call failed: {last_error!r}") from last_error
+
+    async def _run_attempt(self, call_type: str, attempt: Callable[[float], Awaitable[T]], timeout: float,
+                           hedge: bool, stats: Dict) -> T:
+        hedge_after = None
+        if self.hedge and hedge:
+            hedge_after = self.latency.quantile(call_type, self.hedge_quantile, self.hedge_min_samples)
+
+        primary = asyncio.ensure_future(attempt(timeout))
+        if hedge_after is None or hedge_after >= timeout:
+            return await primary
+
+        pending = {primary}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=hedge_after)
+            if not done:
+                # The primary request is slower than usual: race a duplicate against it
+                pending.add(asyncio.ensure_future(attempt(timeout - hedge_after)))
+                stats["hedges"] += 1
+
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
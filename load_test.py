@@ -0,0 +1,138 @@
+"""
+Offline load test of the AI pipeline against the fake Gemini backend.
+
+Runs many cases at once through the same GeminiService calls the job handlers make
+(question rounds, then the final decision) and reports throughput, end-to-end latency
+per stage and how long calls queued for a free model slot (GEMINI_MAX_CONCURRENCY).
+
+    python load_test.py --cases 300 --rounds 2 --latency 0.5 3 --fault-rate 0.05 --concurrency 8
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+from typing import Dict, List
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Load test the AI judge pipeline with a fake Gemini backend")
+    parser.add_argument("--cases", type=int, default=200, help="cases processed at the same time")
+    parser.add_argument("--rounds", type=int, default=2, help="question rounds per case before the decision")
+    parser.add_argument("--evidence", type=int, default=20, help="text evidence items per case")
+    parser.add_argument("--latency", type=float, nargs=2, default=(0.5, 3.0), metavar=("MIN", "MAX"))
+    parser.add_argument("--tail-rate", type=float, default=0.02)
+    parser.add_argument("--tail-latency", type=float, default=20.0)
+    parser.add_argument("--fault-rate", type=float, default=0.0)
+    parser.add_argument("--concurrency", type=int, default=None, help="GEMINI_MAX_CONCURRENCY override")
+    parser.add_argument("--seed", type=int, default=1)
+    return parser.parse_args()
+
+
+def configure_environment(args: argparse.Namespace):
+    """Settings are read from the environment on import, so this must run before importing the service"""
+    os.environ.update({
+        "GEMINI_BACKEND": "fake",
+        "FAKE_GEMINI_LATENCY": f"[{args.latency[0]}, {args.latency[1]}]",
+        "FAKE_GEMINI_TAIL_RATE": str(args.tail_rate),
+        "FAKE_GEMINI_TAIL_LATENCY": str(args.tail_latency),
+        "FAKE_GEMINI_FAULT_RATE": str(args.fault_rate),
+        "FAKE_GEMINI_SEED": str(args.seed),
+        # No database or Redis is needed: telemetry, the result cache and case summaries are switched off
+        "LLM_TELEMETRY_ENABLED": "false",
+        "RESULT_CACHE_ENABLED": "false",
+        "CASE_SUMMARY_ENABLED": "false",
+    })
+    if args.concurrency is not None:
+        os.environ["GEMINI_MAX_CONCURRENCY"] = str(args.concurrency)
+
+
+def make_case(index: int, evidence_count: int) -> Dict:
+    case_number = f"LOAD-{index:05d}"
+    case_data = {
+        "case_number": case_number,
+        "topic": f"Unpaid invoice #{index}",
+        "category": "services",
+        "claim_reason": "The defendant did not pay for the delivered design work",
+        "claim_amount": 100 + index,
+    }
+    participants = [
+        {"role": "plaintiff", "username": f"plaintiff{index}"},
+        {"role": "defendant", "username": f"defendant{index}"},
+    ]
+    evidence = [
+        {
+            "id": i,
+            "type": "text",
+            "role": "plaintiff" if i % 2 else "defendant",
+            "content": f"Argument {i} of case {case_number}: the work was delivered on day {i} "
+                       f"and payment of {10 * i} USD was promised in the chat. " * 5,
+        }
+        for i in range(1, evidence_count + 1)
+    ]
+    return {"case_data": case_data, "participants": participants, "evidence": evidence}
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * q), len(ordered) - 1)] if ordered else 0.0
+
+
+async def run(args: argparse.Namespace):
+    from conf import settings
+    from gemini_servise import gemini_service
+    from llm_resilience import LLMUnavailableError
+
+    timings: Dict[str, List[float]] = {"questions": [], "final_decision": [], "case": []}
+    failures: Dict[str, int] = {"questions": 0, "final_decision": 0}
+
+    async def timed(stage: str, coro):
+        started = time.monotonic()
+        try:
+            return await coro
+        except LLMUnavailableError:
+            failures[stage] += 1
+        finally:
+            timings[stage].append(time.monotonic() - started)
+
+    async def process_case(index: int):
+        case = make_case(index, args.evidence)
+        started = time.monotonic()
+        for round_number in range(1, args.rounds + 1):
+            await timed("questions", gemini_service.generate_clarifying_questions(
+                case["case_data"], case["participants"], case["evidence"], None, round_number, joint=True
+            ))
+        await timed("final_decision", gemini_service.generate_full_decision(
+            case["case_data"], case["participants"], case["evidence"]
+        ))
+        timings["case"].append(time.monotonic() - started)
+
+    started = time.monotonic()
+    await asyncio.gather(*[process_case(i) for i in range(args.cases)])
+    elapsed = time.monotonic() - started
+
+    models = list(gemini_service._models.values())
+    calls = sum(model.calls for model in models)
+    model_failures = sum(model.failures for model in models)
+    busy = sum(model.busy_seconds for model in models)
+    stage_total = sum(timings["questions"]) + sum(timings["final_decision"])
+
+    print(f"\n{args.cases} cases x {args.rounds} question rounds, "
+          f"GEMINI_MAX_CONCURRENCY={settings.GEMINI_MAX_CONCURRENCY}, fake latency {args.latency[0]}-{args.latency[1]} s")
+    print(f"Wall time: {elapsed:.1f} s, throughput: {args.cases / elapsed:.2f} cases/s")
+    print(f"Model calls: {calls} ({model_failures} injected faults), "
+          f"peak in flight: {max(model.max_in_flight for model in models)}")
+    print(f"Time spent waiting (slots, backoff) per stage call: "
+          f"{max(stage_total - busy, 0) / max(len(timings['questions']) + len(timings['final_decision']), 1):.2f} s")
+    print(f"{'stage':<16}{'count':>7}{'failed':>8}{'p50':>9}{'p95':>9}{'max':>9}")
+    for stage, values in timings.items():
+        if not values:
+            continue
+        print(f"{stage:<16}{len(values):>7}{failures.get(stage, 0):>8}"
+              f"{statistics.median(values):>9.2f}{percentile(values, 0.95):>9.2f}{max(values):>9.2f}")
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    configure_environment(arguments)
+    asyncio.run(run(arguments))
@@ -11,7 +11,10 @@ from redis.asyncio import Redis
 
 from conf import settings, CLEAN_INTERVAL_DAYS
 from database import db
+from doc_extract import document_extractor
 from handlers import register_handlers
+from job_queue import create_worker_pool
+from media_cache import media_cache
 
 logging.basicConfig(
     level=logging.INFO,
@@ -33,6 +36,7 @@ class BotApplication:
         self.bot = None
         self.dp = None
         self.scheduler = None
+        self.job_workers = None
         self.is_running = False
 
     async def initialize(self):
@@ -75,7 +79,6 @@ class BotApplication:
         # Подключение к базе данных
         try:
             await db.connect()
-            await db.create_additional_tables()
             logger.info("✅ Подключение к базе данных успешно")
         except Exception as e:
             logger.error(f"❌ Ошибка подключения к базе данных: {e}")
@@ -104,9 +107,21 @@ class BotApplication:
             days=CLEAN_INTERVAL_DAYS,
             id="clean_old_records"
         )
+        self.scheduler.add_job(
+            media_cache.evict,
+            "interval",
+            days=1,
+            id="evict_media_cache"
+        )
         self.scheduler.start()
         logger.info(f"🕒 Планировщик запущен: очистка каждые {CLEAN_INTERVAL_DAYS} дня")
 
+        # Воркеры очереди ИИ-заданий (вопросы, вердикт); незавершённые задания подхватываются после рестарта
+        if settings.LLM_JOB_WORKERS > 0:
+            self.job_workers = create_worker_pool(self.bot, self.storage)
+            self.job_workers.start()
+            logger.info(f"🧵 Запущено воркеров очереди ИИ: {settings.LLM_JOB_WORKERS}")
+
         self.is_running = True
         logger.info("✅ Инициализация завершена")
 
@@ -126,6 +141,14 @@ class BotApplication:
             except Exception as e:
                 logger.error(f"❌ Ошибка при остановке планировщика: {e}")
 
+        # Остановка воркеров очереди (задания возвращаются в очередь)
+        if self.job_workers:
+            try:
+                await self.job_workers.stop()
+                logger.info("✅ Воркеры очереди остановлены")
+            except Exception as e:
+                logger.error(f"❌ Ошибка при остановке воркеров очереди: {e}")
+
         # Остановка polling если активен
         if self.dp:
             try:
@@ -150,6 +173,12 @@ class BotApplication:
             except Exception as e:
                 logger.error(f"❌ Ошибка при закрытии storage: {e}")
 
+        # Остановка процессов извлечения текста
+        try:
+            document_extractor.shutdown()
+        except Exception as e:
+            logger.error(f"❌ Ошибка при остановке пула извлечения текста: {e}")
+
         # Закрытие подключения к базе данных
         if db.pool:
             try:
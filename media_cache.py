@@ -0,0 +1,237 @@
+import asyncio
+import hashlib
+import io
+import json
+import os
+import tempfile
+import time
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.types import File
+
+from conf import settings, DELETE_OLDER_THAN_DAYS
+
+TEMP_SUFFIX = ".tmp"
+# A temp file this old was left behind by a write that died before its rename
+STALE_TEMP_SECONDS = 3600
+
+
+class CachedFile(NamedTuple):
+    data: bytes
+    file_path: Optional[str]
+
+
+class MediaCache:
+    """
+    Content-addressed on-disk cache for files downloaded from Telegram.
+
+    File bytes live in blobs/<sha256>, and small JSON refs map a Telegram file_id or
+    file_unique_id to the blob. A blob's mtime is its last access time: it drives both
+    the LRU eviction and the TTL, which matches how long cases are kept in the database.
+    """
+
+    def __init__(self, root: str, max_bytes: int, ttl_seconds: int):
+        self.root = root
+        self.blobs_dir = os.path.join(root, "blobs")
+        self.refs_dir = os.path.join(root, "refs")
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._size: Optional[int] = None
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    # ===== Public API =====
+
+    async def fetch(self, bot: Bot, file_id: str) -> bytes:
+        """Returns file bytes, going to Telegram only when neither key is cached"""
+        return (await self.fetch_file(bot, file_id)).data
+
+    async def fetch_file(self, bot: Bot, file_id: str) -> CachedFile:
+        """Returns file bytes together with the Telegram file_path, with at most one get_file call"""
+        # Concurrent requests for the same file share a single download
+        task = self._inflight.get(file_id)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(bot, file_id))
+            self._inflight[file_id] = task
+            task.add_done_callback(lambda _: self._inflight.pop(file_id, None))
+        return await asyncio.shield(task)
+
+    async def get_derived(self, key: str) -> Optional[Tuple[bytes, Dict]]:
+        """Returns a derived artifact (e.g. a normalized image) and its metadata"""
+        return await asyncio.to_thread(self._read_entry, f"derived:{key}")
+
+    async def put_derived(self, key: str, data: bytes, meta: Dict):
+        """Stores a derived artifact in the same content-addressed store as the originals"""
+        await asyncio.to_thread(self._store, data, meta, [f"derived:{key}"])
+
+    async def evict(self):
+        """Removes expired blobs, then least recently used ones until the cache fits its budget"""
+        removed, freed = await asyncio.to_thread(self._evict_sync)
+        if removed:
+            print(f"🧹 Кэш медиа: удалено {removed} файлов ({freed} байт)")
+
+    # ===== Internals =====
+
+    async def _fetch(self, bot: Bot, file_id: str) -> CachedFile:
+        cached = await asyncio.to_thread(self._read_by_key, f"id:{file_id}")
+        if cached is not None:
+            return cached
+
+        file_info: File = await bot.get_file(file_id)
+        unique_key = f"uid:{file_info.file_unique_id}"
+        cached = await asyncio.to_thread(self._read_by_key, unique_key)
+        if cached is not None:
+            data = cached.data
+        else:
+            buffer = io.BytesIO()
+            await bot.download_file(file_info.file_path, buffer)
+            data = buffer.getvalue()
+
+        ref = {
+            "file_unique_id": file_info.file_unique_id,
+            "file_path": file_info.file_path,
+            "size": len(data),
+        }
+        await asyncio.to_thread(self._store, data, ref, [f"id:{file_id}", unique_key])
+        return CachedFile(data, file_info.file_path)
+
+    def _ref_path(self, key: str) -> str:
+        digest = hashlib.sha1(key.encode()).hexdigest()
+        return os.path.join(self.refs_dir, digest[:2], f"{digest}.json")
+
+    def _blob_path(self, sha256: str) -> str:
+        return os.path.join(self.blobs_dir, sha256[:2], sha256)
+
+    def _read_ref(self, key: str) -> Optional[Dict]:
+        try:
+            with open(self._ref_path(key), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _read_entry(self, key: str) -> Optional[Tuple[bytes, Dict]]:
+        ref = self._read_ref(key)
+        if not ref:
+            return None
+        blob_path = self._blob_path(ref["sha256"])
+        try:
+            if time.time() - os.path.getmtime(blob_path) > self.ttl_seconds:
+                return None
+            with open(blob_path, "rb") as f:
+                data = f.read()
+            os.utime(blob_path)
+            return data, ref
+        except OSError:
+            return None
+
+    def _read_by_key(self, key: str) -> Optional[CachedFile]:
+        entry = self._read_entry(key)
+        if entry is None:
+            return None
+        data, ref = entry
+        return CachedFile(data, ref.get("file_path"))
+
+    def _write_atomic(self, path: str, data: bytes):
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        # A unique temp name per write: stores run in worker threads and may write the same path at once
+        f = tempfile.NamedTemporaryFile(dir=directory, suffix=TEMP_SUFFIX, delete=False)
+        try:
+            with f:
+                f.write(data)
+            os.replace(f.name, path)
+        except BaseException:
+            try:
+                os.unlink(f.name)
+            except OSError:
+                pass
+            raise
+
+    def _store(self, data: bytes, ref: Dict, keys):
+        sha256 = hashlib.sha256(data).hexdigest()
+        blob_path = self._blob_path(sha256)
+        if os.path.exists(blob_path):
+            os.utime(blob_path)
+        else:
+            self._write_atomic(blob_path, data)
+            if self._size is not None:
+                self._size += len(data)
+
+        payload = json.dumps({**ref, "sha256": sha256}).encode()
+        for key in keys:
+            self._write_atomic(self._ref_path(key), payload)
+
+        if self._size is None or self._size > self.max_bytes:
+            self._evict_sync()
+
+    def _scan(self, directory: str):
+        """
+        Yields the cache files under directory. Temp files are skipped: eviction runs in a thread
+        while other stores write, and removing a half-written file would fail their rename.
+        Stale ones, left by a crashed write, are deleted on the way.
+        """
+        now = time.time()
+        for dirpath, _, filenames in os.walk(directory):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                try:
+                    stat = os.stat(path)
+                    if name.endswith(TEMP_SUFFIX):
+                        if now - stat.st_mtime > STALE_TEMP_SECONDS:
+                            os.remove(path)
+                        continue
+                except OSError:
+                    continue
+                yield path, stat
+
+    def _evict_sync(self):
+        now = time.time()
+        removed = 0
+        freed = 0
+        live = []
+
+        for path, stat in self._scan(self.blobs_dir):
+            if now - stat.st_mtime > self.ttl_seconds:
+                try:
+                    os.remove(path)
+                    removed += 1
+                    freed += stat.st_size
+                except OSError:
+                    pass
+            else:
+                live.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in live)
+        live.sort()
+        while total > self.max_bytes and live:
+            _, size, path = live.pop(0)
+            try:
+                os.remove(path)
+                removed += 1
+                freed += size
+                total -= size
+            except OSError:
+                pass
+        self._size = total
+
+        # Refs are tiny; drop the ones whose blob is gone
+        for path, _ in self._scan(self.refs_dir):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    sha256 = json.load(f)["sha256"]
+                if not os.path.exists(self._blob_path(sha256)):
+                    os.remove(path)
+            except (OSError, ValueError, KeyError):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+        return removed, freed
+
+
+media_cache = MediaCache(
+    settings.MEDIA_CACHE_DIR,
+    settings.MEDIA_CACHE_MAX_BYTES,
+    DELETE_OLDER_THAN_DAYS * 24 * 3600
+)
@@ -0,0 +1,161 @@
+import asyncio
+import io
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, NamedTuple, Optional, Protocol
+
+from conf import settings
+from database import db
+
+
+class UploadedFile(NamedTuple):
+    uri: str
+    mime_type: str
+    expires_at: datetime
+
+
+class FileService(Protocol):
+    async def upload(self, data: bytes, mime_type: str, display_name: str) -> UploadedFile:
+        ...
+
+
+class GeminiFileService:
+    """Gemini File API; Google keeps uploaded files for 48 hours"""
+
+    async def upload(self, data: bytes, mime_type: str, display_name: str) -> UploadedFile:
+        import google.generativeai as genai
+
+        genai.configure(api_key=settings.GEMINI_API_KEY)
+        # The SDK upload is blocking, so it runs in a thread
+        file = await asyncio.to_thread(
+            genai.upload_file, io.BytesIO(data), mime_type=mime_type, display_name=display_name
+        )
+        return UploadedFile(file.uri, file.mime_type, file.expiration_time)
+
+
+class UploadedPart(dict):
+    """
+    A file_data prompt part that remembers the inline part it replaces, so a request can be
+    resent with the bytes if the provider no longer knows the file.
+    """
+
+    def __init__(self, evidence_id: int, handle: UploadedFile, inline: Dict):
+        super().__init__(file_data={"mime_type": handle.mime_type, "file_uri": handle.uri})
+        self.evidence_id = evidence_id
+        self.inline = inline
+
+
+class MediaRegistry:
+    """
+    Uploads each evidence image once through the provider's file API and reuses the handle,
+    stored on the evidence row, in every later prompt of the case instead of the inline bytes.
+
+    A handle that expires within expiry_margin is replaced by a new upload; if the upload
+    fails the image is sent inline as before.
+    """
+
+    def __init__(self, expiry_margin: float, min_bytes: int, file_service: Optional[FileService] = None,
+                 max_handles: int = 4096):
+        """file_service defaults to the one of settings.GEMINI_BACKEND, resolved on first use"""
+        self.expiry_margin = timedelta(seconds=expiry_margin)
+        self.min_bytes = min_bytes
+        self.max_handles = max_handles
+        self._file_service = file_service
+        self._file_service_resolved = file_service is not None
+        # evidence id -> handle, so concurrent prompts of a case see an upload made a moment ago
+        self._handles: "OrderedDict[int, UploadedFile]" = OrderedDict()
+        # evidence id -> upload lock and the number of callers holding or waiting for it
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._lock_users: Dict[int, int] = {}
+
+    @property
+    def file_service(self) -> Optional[FileService]:
+        if not self._file_service_resolved:
+            self._file_service = default_file_service()
+            self._file_service_resolved = True
+        return self._file_service
+
+    def _usable(self, handle: Optional[UploadedFile]) -> bool:
+        return handle is not None and handle.expires_at - self.expiry_margin > datetime.now(timezone.utc)
+
+    def _remember(self, evidence_id: int, handle: UploadedFile):
+        self._handles[evidence_id] = handle
+        self._handles.move_to_end(evidence_id)
+        while len(self._handles) > self.max_handles:
+            self._handles.popitem(last=False)
+
+    async def part_for(self, ev: Dict, inline: Dict) -> Dict:
+        """Prompt part for an evidence image: a file reference when possible, otherwise the inline part"""
+        evidence_id = ev.get("id")
+        if self.file_service is None or evidence_id is None or len(inline["data"]) < self.min_bytes:
+            return inline
+
+        handle = self._handles.get(evidence_id)
+        if handle is None and ev.get("upload_uri") and ev.get("upload_expires_at"):
+            handle = UploadedFile(ev["upload_uri"], ev.get("upload_mime_type") or inline["mime_type"],
+                                  ev["upload_expires_at"])
+        if self._usable(handle):
+            return UploadedPart(evidence_id, handle, inline)
+
+        # One upload per evidence row even if several prompts of the case are built at once.
+        # The lock lives while anyone holds or waits for it, so a late caller queues behind them
+        lock = self._locks.setdefault(evidence_id, asyncio.Lock())
+        self._lock_users[evidence_id] = self._lock_users.get(evidence_id, 0) + 1
+        try:
+            async with lock:
+                handle = self._handles.get(evidence_id)
+                if not self._usable(handle):
+                    handle = await self._upload(ev, evidence_id, inline)
+        finally:
+            self._lock_users[evidence_id] -= 1
+            if not self._lock_users[evidence_id]:
+                del self._lock_users[evidence_id]
+                del self._locks[evidence_id]
+        return inline if handle is None else UploadedPart(evidence_id, handle, inline)
+
+    async def _upload(self, ev: Dict, evidence_id: int, inline: Dict) -> Optional[UploadedFile]:
+        try:
+            handle = await self.file_service.upload(
+                inline["data"], inline["mime_type"], f"evidence-{ev.get('case_number') or ''}-{evidence_id}"
+            )
+        except Exception as e:
+            print(f"Upload of evidence {evidence_id} failed, sending it inline: {e}")
+            return None
+        self._remember(evidence_id, handle)
+        try:
+            await db.save_evidence_upload(evidence_id, handle.uri, handle.mime_type, handle.expires_at)
+        except Exception as e:
+            print(f"Failed to store upload handle of evidence {evidence_id}: {e}")
+        return handle
+
+    async def forget(self, parts: Iterable) -> List[int]:
+        """Drops the handles referenced by the given prompt parts; returns their evidence ids"""
+        evidence_ids = [part.evidence_id for part in parts if isinstance(part, UploadedPart)]
+        for evidence_id in evidence_ids:
+            self._handles.pop(evidence_id, None)
+        if evidence_ids:
+            try:
+                await db.clear_evidence_uploads(evidence_ids)
+            except Exception as e:
+                print(f"Failed to clear upload handles {evidence_ids}: {e}")
+        return evidence_ids
+
+
+def default_file_service() -> Optional[FileService]:
+    if not settings.MEDIA_UPLOAD_ENABLED:
+        return None
+    if settings.GEMINI_BACKEND == "fake":
+        from fake_gemini import fake_file_service
+        return fake_file_service
+    return GeminiFileService()
+
+
+def inline_parts(messages: List) -> List:
+    """The prompt with every file reference replaced by the inline bytes it stands for"""
+    return [part.inline if isinstance(part, UploadedPart) else part for part in messages]
+
+
+media_registry = MediaRegistry(
+    expiry_margin=settings.MEDIA_UPLOAD_EXPIRY_MARGIN,
+    min_bytes=settings.MEDIA_UPLOAD_MIN_BYTES
+)
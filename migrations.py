@@ -0,0 +1,360 @@
+from typing import Awaitable, Callable, List, NamedTuple
+
+import asyncpg
+
+# Shared by every bot and worker process, so only one of them migrates at a time
+MIGRATIONS_LOCK_ID = 0x4A554447
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    apply: Callable[[asyncpg.Connection], Awaitable[None]]
+
+
+# Ordered by version; filled by the migration decorator
+MIGRATIONS: List[Migration] = []
+
+
+def migration(version: int, name: str):
+    """Registers a schema change. Versions are applied in order, each exactly once, in a transaction"""
+    def decorator(func: Callable[[asyncpg.Connection], Awaitable[None]]):
+        if MIGRATIONS and MIGRATIONS[-1].version >= version:
+            raise ValueError(f"Migration {version} is out of order")
+        MIGRATIONS.append(Migration(version, name, func))
+        return func
+    return decorator
+
+
+async def run_migrations(pool: asyncpg.Pool) -> List[int]:
+    """
+    Brings the schema up to the latest version and returns the versions applied.
+    An up-to-date database costs two cheap queries and no lock, so a restart does not
+    re-run the DDL. Otherwise the pending migrations run under an advisory lock, and a
+    process that started at the same time waits and then finds nothing left to do.
+    """
+    async with pool.acquire() as conn:
+        if await _current_version(conn) >= MIGRATIONS[-1].version:
+            return []
+
+        await conn.execute("SELECT pg_advisory_lock($1)", MIGRATIONS_LOCK_ID)
+        try:
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    applied_at TIMESTAMP DEFAULT NOW()
+                )
+            ''')
+            applied = {row["version"] for row in await conn.fetch("SELECT version FROM schema_migrations")}
+            done = []
+            for item in MIGRATIONS:
+                if item.version in applied:
+                    continue
+                async with conn.transaction():
+                    await item.apply(conn)
+                    await conn.execute(
+                        "INSERT INTO schema_migrations (version, name) VALUES ($1, $2)", item.version, item.name
+                    )
+                print(f"Applied migration {item.version}: {item.name}")
+                done.append(item.version)
+            return done
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock($1)", MIGRATIONS_LOCK_ID)
+
+
+async def _current_version(conn: asyncpg.Connection) -> int:
+    if not await conn.fetchval("SELECT to_regclass('schema_migrations') IS NOT NULL"):
+        return 0
+    return await conn.fetchval("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+
+
+# =============================================================================
+# Migrations
+# =============================================================================
+
+# The schema create_tables/create_additional_tables used to (re)create on every start.
+# Every statement is idempotent, so the baseline also applies cleanly to existing databases.
+BASELINE = (
+    '''
+        CREATE TABLE IF NOT EXISTS cases (
+            id SERIAL PRIMARY KEY,
+            case_number VARCHAR(50) UNIQUE,
+            chat_id BIGINT,
+            topic TEXT,
+            category VARCHAR(100),
+            claim_amount DECIMAL(15,2),
+            claim_reason VARCHAR(500),
+            mode VARCHAR(20),
+            version VARCHAR (10) DEFAULT 'v2',
+            plaintiff_id BIGINT,
+            plaintiff_username VARCHAR(100),
+            defendant_id BIGINT,
+            defendant_username VARCHAR(100),
+            status VARCHAR(50) DEFAULT 'active',
+            stage VARCHAR(50) DEFAULT 'plaintiff',
+            created_at TIMESTAMP DEFAULT NOW(),
+            updated_at TIMESTAMP DEFAULT NOW()
+        )
+    ''',
+    '''
+        CREATE TABLE IF NOT EXISTS evidence (
+            id BIGSERIAL PRIMARY KEY,
+            case_number VARCHAR(50),
+            user_id BIGINT,
+            role VARCHAR(50),
+            type VARCHAR(50),
+            content TEXT,
+            file_id VARCHAR(500),
+            file_path TEXT,
+            description TEXT,
+            round_number INTEGER DEFAULT 0,
+            question_id INTEGER,
+            created_at TIMESTAMP DEFAULT NOW()
+        )
+    ''',
+    '''
+        ALTER TABLE evidence
+            ADD COLUMN IF NOT EXISTS file_name TEXT,
+            ADD COLUMN IF NOT EXISTS mime_type VARCHAR(100),
+            ADD COLUMN IF NOT EXISTS file_size BIGINT,
+            ADD COLUMN IF NOT EXISTS extracted_text TEXT,
+            ADD COLUMN IF NOT EXISTS ingested_at TIMESTAMP
+    ''',
+    '''
+        ALTER TABLE evidence
+            ADD COLUMN IF NOT EXISTS upload_uri TEXT,
+            ADD COLUMN IF NOT EXISTS upload_mime_type VARCHAR(100),
+            ADD COLUMN IF NOT EXISTS upload_expires_at TIMESTAMPTZ
+    ''',
+    '''
+        CREATE TABLE IF NOT EXISTS participants (
+            id SERIAL PRIMARY KEY,
+            case_id INT NOT NULL REFERENCES cases(id) ON DELETE CASCADE,
+            user_id BIGINT NOT NULL,
+            username TEXT,
+            role TEXT CHECK (role IN ('plaintiff', 'defendant', 'witness')),
+            joined_at TIMESTAMP DEFAULT NOW(),
+            UNIQUE(case_id, user_id, role)
+        )
+    ''',
+    '''
+        CREATE TABLE IF NOT EXISTS decisions (
+            id SERIAL PRIMARY KEY,
+            case_number VARCHAR(50) UNIQUE,
+            claim_granted BOOLEAN NOT NULL DEFAULT FALSE,
+            file_path TEXT,
+            file_data BYTEA,
+            created_at TIMESTAMP DEFAULT NOW()
+        )
+    ''',
+    '''
+        CREATE TABLE IF NOT EXISTS user_settings (
+            user_id BIGINT PRIMARY KEY,
+            bot_version VARCHAR(10) DEFAULT 'v2',
+            created_at TIMESTAMP DEFAULT NOW(),
+            updated_at TIMESTAMP DEFAULT NOW()
+        )
+    ''',
+    '''
+        CREATE TABLE IF NOT EXISTS participant_stages (
+            case_number VARCHAR(50),
+            user_id BIGINT,
+            stage VARCHAR(50),
+            updated_at TIMESTAMP DEFAULT NOW(),
+            PRIMARY KEY (case_number, user_id)
+        )
+    ''',
+    '''
+        CREATE TABLE IF NOT EXISTS llm_jobs (
+            id BIGSERIAL PRIMARY KEY,
+            kind VARCHAR(50) NOT NULL,
+            case_number VARCHAR(50),
+            payload JSONB NOT NULL DEFAULT '{}',
+            dedupe_key TEXT,
+            status VARCHAR(20) NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            run_after TIMESTAMP NOT NULL DEFAULT NOW(),
+            locked_by TEXT,
+            locked_until TIMESTAMP,
+            created_at TIMESTAMP DEFAULT NOW(),
+            updated_at TIMESTAMP DEFAULT NOW()
+        )
+    ''',
+    '''
+        CREATE INDEX IF NOT EXISTS llm_jobs_ready_idx
+            ON llm_jobs (run_after) WHERE status IN ('queued', 'running')
+    ''',
+    '''
+        CREATE UNIQUE INDEX IF NOT EXISTS llm_jobs_dedupe_idx
+            ON llm_jobs (dedupe_key) WHERE status IN ('queued', 'running')
+    ''',
+    '''
+        CREATE TABLE IF NOT EXISTS case_summaries (
+            case_number VARCHAR(50) PRIMARY KEY,
+            summary JSONB NOT NULL,
+            last_evidence_id BIGINT NOT NULL,
+            round_number INTEGER NOT NULL,
+            updated_at TIMESTAMP DEFAULT NOW()
+        )
+    ''',
+    '''
+        CREATE TABLE IF NOT EXISTS llm_calls (
+            id BIGSERIAL PRIMARY KEY,
+            case_number VARCHAR(50),
+            call_type VARCHAR(50) NOT NULL,
+            model VARCHAR(100),
+            prompt_tokens INTEGER,
+            output_tokens INTEGER,
+            total_tokens INTEGER,
+            image_count INTEGER NOT NULL DEFAULT 0,
+            payload_bytes BIGINT NOT NULL DEFAULT 0,
+            latency_ms INTEGER NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 1,
+            outcome VARCHAR(20) NOT NULL,
+            error TEXT,
+            created_at TIMESTAMP DEFAULT NOW()
+        )
+    ''',
+    '''
+        CREATE INDEX IF NOT EXISTS llm_calls_case_idx ON llm_calls (case_number)
+    ''',
+    '''
+        CREATE INDEX IF NOT EXISTS llm_calls_created_idx ON llm_calls (created_at)
+    ''',
+    '''
+        CREATE TABLE IF NOT EXISTS verdict_files (
+            id SERIAL PRIMARY KEY,
+            case_number VARCHAR(50),
+            filename TEXT NOT NULL,
+            filepath TEXT NOT NULL,
+            uploaded_at TIMESTAMP DEFAULT NOW(),
+            created_at TIMESTAMP DEFAULT NOW()
+        )
+    ''',
+    '''
+        CREATE TABLE IF NOT EXISTS dispute_groups (
+            id SERIAL PRIMARY KEY,
+            case_number VARCHAR(50) UNIQUE,
+            chat_id BIGINT NOT NULL,
+            title VARCHAR(255),
+            created_at TIMESTAMP DEFAULT NOW(),
+            updated_at TIMESTAMP DEFAULT NOW()
+        )
+    ''',
+    '''
+        CREATE TABLE IF NOT EXISTS ai_answers (
+            id SERIAL PRIMARY KEY,
+            case_number VARCHAR(50) NOT NULL,
+            question TEXT NOT NULL,
+            answer TEXT NOT NULL,
+            role VARCHAR(50) NOT NULL,
+            round_number INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT NOW()
+        )
+    ''',
+    '''
+        CREATE TABLE IF NOT EXISTS bot_users (
+            user_id BIGINT PRIMARY KEY,
+            username TEXT,
+            contacted_at TIMESTAMP DEFAULT NOW()
+        )
+    ''',
+    '''
+        CREATE TABLE IF NOT EXISTS ai_questions (
+            id SERIAL PRIMARY KEY,
+            case_number VARCHAR(50) NOT NULL,
+            question TEXT NOT NULL,
+            target_role VARCHAR(50) NOT NULL,
+            round_number INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT NOW()
+        )
+    ''',
+)
+
+
+@migration(1, "baseline schema")
+async def baseline(conn: asyncpg.Connection):
+    for statement in BASELINE:
+        await conn.execute(statement)
+
+
+@migration(2, "indexes for hot lookups")
+async def hot_path_indexes(conn: asyncpg.Connection):
+    # Evidence of a case in upload order (get_case_evidence, get_evidence_by_role)
+    await conn.execute('''
+        CREATE INDEX IF NOT EXISTS evidence_case_number_idx ON evidence (case_number, created_at)
+    ''')
+    # Cases of a user (get_user_cases, get_case_statistics, search_cases)
+    await conn.execute('''
+        CREATE INDEX IF NOT EXISTS participants_user_id_idx ON participants (user_id)
+    ''')
+    # Active case of a group chat (get_case_by_chat)
+    await conn.execute('''
+        CREATE INDEX IF NOT EXISTS cases_chat_id_status_idx ON cases (chat_id, status)
+    ''')
+    # Old cases for clean_old_records
+    await conn.execute('''
+        CREATE INDEX IF NOT EXISTS cases_created_at_idx ON cases (created_at)
+    ''')
+    # Questions of a case and role (get_ai_questions, get_ai_questions_count)
+    await conn.execute('''
+        CREATE INDEX IF NOT EXISTS ai_questions_case_role_idx ON ai_questions (case_number, target_role, round_number)
+    ''')
+    await conn.execute('''
+        CREATE INDEX IF NOT EXISTS ai_answers_case_number_idx ON ai_answers (case_number)
+    ''')
+    # Case-insensitive lookup of the latest user with a username (get_defendant_by_username)
+    await conn.execute('''
+        CREATE INDEX IF NOT EXISTS bot_users_username_lower_idx ON bot_users (LOWER(username), contacted_at DESC)
+    ''')
+    await conn.execute('''
+        CREATE INDEX IF NOT EXISTS verdict_files_case_number_idx ON verdict_files (case_number)
+    ''')
+
+
+# Tables that belong to a case; they are keyed by cases.id instead of the case number string
+CASE_TABLES = (
+    "evidence",
+    "ai_questions",
+    "ai_answers",
+    "decisions",
+    "dispute_groups",
+    "verdict_files",
+    "participant_stages",
+    "case_summaries",
+)
+
+
+@migration(3, "case_id foreign keys")
+async def case_id_foreign_keys(conn: asyncpg.Connection):
+    for table in CASE_TABLES:
+        await conn.execute(f'ALTER TABLE {table} ADD COLUMN IF NOT EXISTS case_id INTEGER')
+        await conn.execute(f'''
+            UPDATE {table} t
+            SET case_id = c.id
+            FROM cases c
+            WHERE c.case_number = t.case_number AND t.case_id IS NULL
+        ''')
+        # Rows of deleted cases: nothing could read them without their case anyway
+        orphans = await conn.execute(f'DELETE FROM {table} WHERE case_id IS NULL')
+        if orphans != "DELETE 0":
+            print(f"Migration 3: {table}: {orphans} rows without a case")
+        # Dropping the column also drops its unique/primary keys and the indexes of migration 2
+        await conn.execute(f'''
+            ALTER TABLE {table}
+                ALTER COLUMN case_id SET NOT NULL,
+                ADD CONSTRAINT {table}_case_id_fkey FOREIGN KEY (case_id) REFERENCES cases(id) ON DELETE CASCADE,
+                DROP COLUMN case_number
+        ''')
+
+    await conn.execute('ALTER TABLE decisions ADD CONSTRAINT decisions_case_id_key UNIQUE (case_id)')
+    await conn.execute('ALTER TABLE dispute_groups ADD CONSTRAINT dispute_groups_case_id_key UNIQUE (case_id)')
+    await conn.execute('ALTER TABLE participant_stages ADD PRIMARY KEY (case_id, user_id)')
+    await conn.execute('ALTER TABLE case_summaries ADD PRIMARY KEY (case_id)')
+
+    await conn.execute('CREATE INDEX evidence_case_id_idx ON evidence (case_id, created_at)')
+    await conn.execute('CREATE INDEX ai_questions_case_role_idx ON ai_questions (case_id, target_role, round_number)')
+    await conn.execute('CREATE INDEX ai_answers_case_id_idx ON ai_answers (case_id)')
+    await conn.execute('CREATE INDEX verdict_files_case_id_idx ON verdict_files (case_id)')
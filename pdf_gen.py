@@ -9,7 +9,7 @@ from reportlab.lib.enums import TA_CENTER, TA_JUSTIFY
 import os
 import io
 from datetime import datetime
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional
 
 
 class PDFGenerator:
@@ -262,4 +262,12 @@ class PDFGenerator:
         return filepath
 
 
-pdf_generator = PDFGenerator()
\ No newline at end of file
+_pdf_generator: Optional[PDFGenerator] = None
+
+
+def get_pdf_generator() -> PDFGenerator:
+    """Общий генератор; шрифт загружается при первом вердикте, а не при запуске бота"""
+    global _pdf_generator
+    if _pdf_generator is None:
+        _pdf_generator = PDFGenerator()
+    return _pdf_generator
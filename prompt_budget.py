@@ -0,0 +1,166 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple, Union
+
+# Rough Gemini tokenization: ~4 characters of text per token, a fixed cost per inline image
+CHARS_PER_TOKEN = 4
+IMAGE_TOKENS = 258
+
+# Segments in the order they are kept when the budget is tight.
+# "case_header" and "structure" (framing lines, captions) are never cut.
+FIXED_SEGMENTS = ("case_header", "structure")
+SEGMENT_PRIORITY = ("ai_answers", "arguments", "chat_history", "documents", "images")
+
+# Every segment present in the prompt is guaranteed this share of the flexible budget
+# (or its whole size if smaller), so low-priority evidence is not dropped entirely.
+MIN_SEGMENT_SHARE = 0.1
+
+Part = Union[str, Dict]
+TaggedPart = Tuple[str, Part]
+Summarizer = Callable[[str, int], Awaitable[str]]
+
+
+def estimate_tokens(part: Part) -> int:
+    if isinstance(part, str):
+        return (len(part) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+    return IMAGE_TOKENS
+
+
+def truncate_middle(text: str, max_chars: int) -> str:
+    """Keeps the beginning and the end of a text, which usually carry the key facts"""
+    if len(text) <= max_chars:
+        return text
+    marker = "\n[... {} characters omitted to fit the prompt budget ...]\n"
+    keep = max(max_chars - len(marker) - 8, 0)
+    head = keep * 2 // 3
+    tail = keep - head
+    omitted = len(text) - head - tail
+    return text[:head] + marker.format(omitted) + (text[-tail:] if tail else "")
+
+
+class PromptBudget:
+    """
+    Fits a tagged multimodal prompt into a token budget.
+
+    Each part is tagged with its segment (case header, chat history, arguments, AI answers,
+    documents, images). Segments get their allowance by priority, and overflowing segments
+    are truncated, or summarized map-reduce style when a summarizer is given. The report
+    returned by apply() shows, per segment, how many tokens were requested and kept.
+    """
+
+    def __init__(self, max_tokens: int, summarizer: Optional[Summarizer] = None,
+                 summary_chunk_chars: int = 24_000):
+        self.max_tokens = max_tokens
+        self.summarizer = summarizer
+        self.summary_chunk_chars = summary_chunk_chars
+
+    async def apply(self, tagged: List[TaggedPart]) -> Tuple[List[Part], Dict]:
+        needs: Dict[str, int] = {}
+        for segment, part in tagged:
+            needs[segment] = needs.get(segment, 0) + estimate_tokens(part)
+
+        allowances = self._allocate(needs)
+        report = {
+            "budget": self.max_tokens,
+            "requested": sum(needs.values()),
+            "segments": {}
+        }
+
+        result: List[Optional[Part]] = [part for _, part in tagged]
+        for segment, need in needs.items():
+            allowed = allowances[segment]
+            stats = {"requested": need, "allowed": allowed, "kept": need,
+                     "truncated": 0, "summarized": 0, "dropped": 0}
+            report["segments"][segment] = stats
+            if need <= allowed:
+                continue
+
+            indexes = [i for i, (s, _) in enumerate(tagged) if s == segment]
+            await self._fit_segment(result, indexes, allowed, stats)
+
+        parts = [part for part in result if part is not None]
+        report["sent"] = sum(estimate_tokens(part) for part in parts)
+        return parts, report
+
+    def _allocate(self, needs: Dict[str, int]) -> Dict[str, int]:
+        allowances = {segment: need for segment, need in needs.items() if segment in FIXED_SEGMENTS}
+        remaining = max(self.max_tokens - sum(allowances.values()), 0)
+
+        flexible = [s for s in SEGMENT_PRIORITY if s in needs]
+        flexible += [s for s in needs if s not in allowances and s not in flexible]
+
+        floor = int(remaining * MIN_SEGMENT_SHARE)
+        for segment in flexible:
+            allowances[segment] = min(needs[segment], floor)
+        remaining -= sum(allowances[s] for s in flexible)
+
+        for segment in flexible:
+            extra = min(needs[segment] - allowances[segment], max(remaining, 0))
+            allowances[segment] += extra
+            remaining -= extra
+        return allowances
+
+    async def _fit_segment(self, result: List[Optional[Part]], indexes: List[int], allowed: int, stats: Dict):
+        text_indexes = [i for i in indexes if isinstance(result[i], str)]
+        blob_indexes = [i for i in indexes if not isinstance(result[i], str)]
+
+        # Inline files (images) are all-or-nothing: keep them in order while they fit
+        used = 0
+        for i in blob_indexes:
+            cost = estimate_tokens(result[i])
+            if used + cost <= allowed:
+                used += cost
+            else:
+                result[i] = "[Image omitted to fit the prompt budget]"
+                stats["dropped"] += 1
+                used += estimate_tokens(result[i])
+
+        text_allowed_chars = max(allowed - used, 0) * CHARS_PER_TOKEN
+        text_total_chars = sum(len(result[i]) for i in text_indexes)
+        if text_total_chars > text_allowed_chars:
+            # Each text part gives up space in proportion to its size
+            jobs = []
+            for i in text_indexes:
+                share = len(result[i]) * text_allowed_chars // max(text_total_chars, 1)
+                if len(result[i]) > share:
+                    jobs.append(self._shrink_text(result, i, share, stats))
+            await asyncio.gather(*jobs)
+
+        stats["kept"] = sum(estimate_tokens(result[i]) for i in indexes)
+
+    async def _shrink_text(self, result: List[Optional[Part]], index: int, max_chars: int, stats: Dict):
+        text = result[index]
+        if self.summarizer and max_chars >= 500:
+            try:
+                result[index] = await self._map_reduce(text, max_chars)
+                stats["summarized"] += 1
+                return
+            except Exception as e:
+                print(f"Summarization failed, falling back to truncation: {e}")
+        result[index] = truncate_middle(text, max_chars)
+        stats["truncated"] += 1
+
+    async def _map_reduce(self, text: str, max_chars: int) -> str:
+        """Summarizes chunks in parallel, then the joined summaries again until they fit"""
+        while len(text) > max_chars:
+            chunks = [text[i:i + self.summary_chunk_chars] for i in range(0, len(text), self.summary_chunk_chars)]
+            per_chunk = max(max_chars // len(chunks), 200)
+            summaries = await asyncio.gather(*[self.summarizer(chunk, per_chunk) for chunk in chunks])
+            joined = "\n".join(summaries)
+            if len(joined) >= len(text):
+                return truncate_middle(joined, max_chars)
+            text = joined
+        return "[Summarized to fit the prompt budget]\n" + text
+
+
+def format_report(report: Dict) -> str:
+    """One-line summary of what the budget cut, for logs"""
+    cut = []
+    for segment, stats in report["segments"].items():
+        if stats["kept"] < stats["requested"]:
+            details = [f"{stats['requested']}->{stats['kept']}"]
+            for key in ("truncated", "summarized", "dropped"):
+                if stats[key]:
+                    details.append(f"{key}={stats[key]}")
+            cut.append(f"{segment}({', '.join(details)})")
+    summary = f"{report['requested']} -> {report['sent']} tokens (budget {report['budget']})"
+    return f"{summary}; cut: {'; '.join(cut)}" if cut else summary
@@ -1,9 +1,15 @@
 from datetime import datetime, timedelta
-from conf import Settings
+from conf import settings
 
 import redis.asyncio as redis
 
-r = redis.Redis(host='localhost', port=6379, password="38856", decode_responses=True)
+r = redis.Redis(
+    host=settings.REDIS_HOST or "localhost",
+    port=settings.REDIS_PORT or 6379,
+    password=settings.REDIS_PASSWORD or "38856",
+    db=settings.REDIS_DB or 0,
+    decode_responses=True
+)
 
 MAX_START_PER_DAY = 3
 
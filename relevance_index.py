@@ -0,0 +1,201 @@
+import math
+import re
+from collections import Counter, OrderedDict
+from typing import Dict, List, NamedTuple, Optional, Set
+
+from conf import settings
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# Evidence types whose text is chunked and ranked; everything else is always sent as is
+INDEXED_TYPES = ("text", "chat_history", "document")
+
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in _TOKEN_RE.findall(text.lower()) if len(token) > 1 or token.isdigit()]
+
+
+def chunk_text(text: str, chunk_chars: int) -> List[str]:
+    """Splits text into chunks of about chunk_chars, preferring line boundaries"""
+    chunks: List[str] = []
+    current: List[str] = []
+    size = 0
+    for line in text.splitlines(keepends=True):
+        # A single huge line (e.g. a PDF page without breaks) is cut hard
+        while len(line) > chunk_chars:
+            if current:
+                chunks.append("".join(current))
+                current, size = [], 0
+            chunks.append(line[:chunk_chars])
+            line = line[chunk_chars:]
+        if size + len(line) > chunk_chars and current:
+            chunks.append("".join(current))
+            current, size = [], 0
+        current.append(line)
+        size += len(line)
+    if current:
+        chunks.append("".join(current))
+    return [chunk for chunk in chunks if chunk.strip()]
+
+
+class Chunk(NamedTuple):
+    evidence_id: int
+    position: int
+    text: str
+
+
+class BM25Index:
+    """Okapi BM25 over text chunks; documents are added incrementally"""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.chunks: List[Chunk] = []
+        self._term_freqs: List[Counter] = []
+        self._doc_freqs: Counter = Counter()
+        self._total_length = 0
+
+    def add(self, chunk: Chunk):
+        terms = Counter(tokenize(chunk.text))
+        self.chunks.append(chunk)
+        self._term_freqs.append(terms)
+        self._doc_freqs.update(terms.keys())
+        self._total_length += sum(terms.values())
+
+    def search(self, query: str, k: int, evidence_ids: Optional[Set[int]] = None) -> List[Chunk]:
+        """Top-k chunks for the query; with evidence_ids only chunks of those rows compete"""
+        query_terms = set(tokenize(query))
+        if not query_terms or not self.chunks:
+            return []
+
+        n = len(self.chunks)
+        avg_length = self._total_length / n or 1
+        idf = {
+            term: math.log(1 + (n - self._doc_freqs[term] + 0.5) / (self._doc_freqs[term] + 0.5))
+            for term in query_terms if self._doc_freqs[term]
+        }
+
+        scored = []
+        for index, terms in enumerate(self._term_freqs):
+            if evidence_ids is not None and self.chunks[index].evidence_id not in evidence_ids:
+                continue
+            length = sum(terms.values())
+            score = 0.0
+            for term, weight in idf.items():
+                tf = terms.get(term)
+                if tf:
+                    score += weight * tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * length / avg_length))
+            if score > 0:
+                scored.append((score, index))
+
+        scored.sort(reverse=True)
+        return [self.chunks[index] for _, index in scored[:k]]
+
+
+class _CaseIndex:
+    def __init__(self):
+        self.index = BM25Index()
+        self.indexed_ids: Set[int] = set()
+
+
+class EvidenceIndex:
+    """
+    Per-case lexical index of evidence text (arguments, chat history, extracted documents).
+
+    Each evidence row is chunked and indexed once, the first time it is seen with text, so the
+    index grows with the case instead of being rebuilt for every question round. select() keeps
+    only the chunks most relevant to the claim and pending questions, in their original order.
+    """
+
+    def __init__(self, top_k: int, chunk_chars: int, min_chars: int, max_cases: int):
+        self.top_k = top_k
+        self.chunk_chars = chunk_chars
+        self.min_chars = min_chars
+        self.max_cases = max_cases
+        self._cases: "OrderedDict[str, _CaseIndex]" = OrderedDict()
+
+    def _get_case(self, case_number: str) -> _CaseIndex:
+        case_index = self._cases.get(case_number)
+        if case_index is None:
+            case_index = self._cases[case_number] = _CaseIndex()
+            while len(self._cases) > self.max_cases:
+                self._cases.popitem(last=False)
+        self._cases.move_to_end(case_number)
+        return case_index
+
+    def sync(self, case_number: str, evidence: List[Dict]) -> _CaseIndex:
+        """Indexes evidence rows that were not indexed yet"""
+        case_index = self._get_case(case_number)
+        for ev in evidence:
+            ev_id = ev.get("id")
+            text = _indexed_text(ev)
+            if ev_id is None or ev_id in case_index.indexed_ids or text is None:
+                continue
+            for position, chunk in enumerate(chunk_text(text, self.chunk_chars)):
+                case_index.index.add(Chunk(ev_id, position, chunk))
+            case_index.indexed_ids.add(ev_id)
+        return case_index
+
+    def select(self, case_number: str, evidence: List[Dict], query: str) -> List[Dict]:
+        """
+        Returns the evidence list with indexed text cut down to the top-K relevant chunks.
+        Small cases, a query without terms, and evidence that is not text are passed through unchanged.
+        Only chunks of the given rows are ranked: rows indexed in earlier rounds but not passed
+        (already covered by the case summary) do not take the top-K slots.
+        """
+        indexed_chars = sum(len(_indexed_text(ev) or "") for ev in evidence)
+        if indexed_chars <= self.min_chars or not tokenize(query):
+            return evidence
+
+        case_index = self.sync(case_number, evidence)
+        evidence_ids = {ev["id"] for ev in evidence if ev.get("id") is not None}
+        selected: Dict[int, List[Chunk]] = {}
+        for chunk in case_index.index.search(query, self.top_k, evidence_ids):
+            selected.setdefault(chunk.evidence_id, []).append(chunk)
+
+        result = []
+        for ev in evidence:
+            if ev.get("id") not in case_index.indexed_ids:
+                result.append(ev)
+                continue
+            chunks = selected.get(ev["id"])
+            if not chunks:
+                continue
+            chunks.sort(key=lambda chunk: chunk.position)
+            parts = []
+            expected_position = 0
+            for chunk in chunks:
+                # Marks the places where irrelevant text was skipped
+                if chunk.position != expected_position:
+                    parts.append("[...]\n")
+                parts.append(chunk.text)
+                expected_position = chunk.position + 1
+            text = "".join(parts)
+            if ev["type"] == "document":
+                result.append({**ev, "extracted_text": text})
+            else:
+                result.append({**ev, "content": text})
+
+        candidates = sum(1 for chunk in case_index.index.chunks if chunk.evidence_id in evidence_ids)
+        print(f"Case {case_number}: relevance index kept "
+              f"{sum(len(c) for c in selected.values())} of {candidates} chunks")
+        return result
+
+    def forget(self, case_number: str):
+        self._cases.pop(case_number, None)
+
+
+def _indexed_text(ev: Dict) -> Optional[str]:
+    if ev.get("type") not in INDEXED_TYPES:
+        return None
+    if ev["type"] == "document":
+        return ev.get("extracted_text")
+    return ev.get("content") or None
+
+
+evidence_index = EvidenceIndex(
+    top_k=settings.RELEVANCE_TOP_K,
+    chunk_chars=settings.RELEVANCE_CHUNK_CHARS,
+    min_chars=settings.RELEVANCE_MIN_CHARS,
+    max_cases=settings.RELEVANCE_MAX_CASES
+)
@@ -0,0 +1,143 @@
+import asyncio
+import hashlib
+import json
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from redis.asyncio import Redis
+
+from conf import settings
+from redis_service import r
+
+# Bump when prompts or response schemas change, so old results are not served for new prompts
+RESULT_CACHE_VERSION = 3
+
+CASE_FIELDS = ("case_number", "topic", "category", "claim_amount", "claim_reason")
+EVIDENCE_FIELDS = ("id", "type", "role", "content", "file_path", "file_name", "extracted_text")
+
+# Deletes the lock only if it still belongs to the caller
+_RELEASE_LOCK = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+def fingerprint(kind: str, case_data: Dict, participants: List[Dict], evidence: List[Dict], **params) -> str:
+    """Stable hash of everything that goes into a prompt: case fields, participants, evidence and call params"""
+    payload = {
+        "version": RESULT_CACHE_VERSION,
+        "kind": kind,
+        "case": {field: case_data.get(field) for field in CASE_FIELDS},
+        "participants": sorted(
+            (p.get("role") or "", p.get("username") or "") for p in participants
+        ),
+        "evidence": sorted(
+            ({field: ev.get(field) for field in EVIDENCE_FIELDS} for ev in evidence),
+            key=lambda ev: (ev["id"] is None, ev["id"] or 0)
+        ),
+        "params": params,
+    }
+    encoded = json.dumps(payload, sort_keys=True, default=str, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class ResultCache:
+    """
+    Redis cache of model results keyed by input fingerprint, with single-flight de-duplication.
+
+    Concurrent identical requests in one process share one in-flight future; across processes
+    the first caller takes a short Redis lock and the others wait for its result instead of
+    calling the model again. Results that compute() marks as not cacheable (e.g. error
+    fallbacks) are returned but not stored. With enabled=False every call computes directly.
+    """
+
+    def __init__(self, redis: Redis, ttl: int, lock_ttl: int, wait_timeout: float, prefix: str = "llm_result",
+                 enabled: bool = True):
+        self.redis = redis
+        self.enabled = enabled
+        self.ttl = ttl
+        self.lock_ttl = lock_ttl
+        self.wait_timeout = wait_timeout
+        self.prefix = prefix
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[Any]],
+                             cacheable: Callable[[Any], bool] = lambda result: True) -> Any:
+        if not self.enabled:
+            return await compute()
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await self._get_or_compute(key, compute, cacheable)
+        except BaseException as e:
+            future.set_exception(e)
+            # Retrieved here so an unawaited failure does not log "exception was never retrieved"
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            self._inflight.pop(key, None)
+
+    async def _get_or_compute(self, key: str, compute: Callable[[], Awaitable[Any]],
+                              cacheable: Callable[[Any], bool]) -> Any:
+        result_key = f"{self.prefix}:{key}"
+        lock_key = f"{self.prefix}:lock:{key}"
+        token = uuid.uuid4().hex
+        loop = asyncio.get_running_loop()
+        give_up_at = loop.time() + self.wait_timeout
+
+        while True:
+            cached = await self._read(result_key)
+            if cached is not None:
+                return cached
+            try:
+                if await self.redis.set(lock_key, token, nx=True, ex=self.lock_ttl):
+                    break
+            except Exception as e:
+                print(f"Result cache error: {e}")
+                token = None
+                break
+            if loop.time() >= give_up_at:
+                # The other caller is taking too long (or died holding the lock); compute ourselves
+                token = None
+                break
+            await asyncio.sleep(0.5)
+
+        try:
+            result = await compute()
+            if cacheable(result):
+                await self._safe(self.redis.set(result_key, json.dumps(result, default=str), ex=self.ttl))
+            return result
+        finally:
+            if token is not None:
+                await self._safe(self.redis.eval(_RELEASE_LOCK, 1, lock_key, token))
+
+    async def _read(self, result_key: str) -> Optional[Any]:
+        raw = await self._safe(self.redis.get(result_key))
+        return json.loads(raw) if raw else None
+
+    @staticmethod
+    async def _safe(command: Awaitable) -> Any:
+        """Redis problems degrade to a cache miss instead of failing the model call"""
+        try:
+            return await command
+        except Exception as e:
+            print(f"Result cache error: {e}")
+            return None
+
+
+result_cache = ResultCache(
+    r,
+    ttl=settings.RESULT_CACHE_TTL,
+    lock_ttl=settings.RESULT_CACHE_LOCK_TTL,
+    wait_timeout=settings.RESULT_CACHE_WAIT_TIMEOUT,
+    enabled=settings.RESULT_CACHE_ENABLED
+)
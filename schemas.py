@@ -0,0 +1,170 @@
+from typing import Any, Dict, List, Literal, Optional, Type
+
+from pydantic import BaseModel, Field
+
+# =============================================================================
+# Structured responses of the AI judge
+# =============================================================================
+
+
+class CaseSummary(BaseModel):
+    established_facts: List[str] = Field(
+        default_factory=list,
+        description="Facts established so far, each with its source (party, chat message date, document)"
+    )
+    open_issues: List[str] = Field(
+        default_factory=list,
+        description="Contradictions and questions that are still unresolved"
+    )
+
+
+_SUMMARY_DESCRIPTION = "Updated summary of the whole case: the previous summary merged with the new evidence"
+
+
+class QuestionsResponse(BaseModel):
+    questions: List[str] = Field(
+        default_factory=list,
+        description="At most 3 clarifying questions; empty if there is enough information for a decision"
+    )
+    summary: CaseSummary = Field(default_factory=CaseSummary, description=_SUMMARY_DESCRIPTION)
+
+
+class JointQuestionsResponse(BaseModel):
+    plaintiff: List[str] = Field(default_factory=list, description="At most 3 questions for the plaintiff")
+    defendant: List[str] = Field(default_factory=list, description="At most 3 questions for the defendant")
+    summary: CaseSummary = Field(default_factory=CaseSummary, description=_SUMMARY_DESCRIPTION)
+
+
+class Verdict(BaseModel):
+    claim_granted: bool = False
+    amount_awarded: float = Field(0, description="Amount awarded to the plaintiff")
+    court_costs: float = 0
+
+
+class AnalysisResponse(BaseModel):
+    established_facts: List[str] = Field(default_factory=list)
+    violations: List[str] = Field(default_factory=list)
+    decision: str = ""
+    verdict: Verdict = Field(default_factory=Verdict)
+    additional_questions: List[str] = Field(default_factory=list)
+
+
+class DecisionResponse(BaseModel):
+    established_facts: List[str] = Field(
+        default_factory=list,
+        description="Facts established by the evidence, e.g. 'fact (supported by chat message from [date])'"
+    )
+    violations: List[str] = Field(default_factory=list)
+    decision: str = Field("", description="Text of the final decision in English, mentioning the claim amount")
+    verdict: Verdict = Field(default_factory=Verdict)
+    winner: Optional[Literal["plaintiff", "defendant", "draw"]] = Field(
+        None,
+        description="plaintiff: claim fully or partially satisfied; defendant: claim denied; "
+                    "draw: both parties are partially right"
+    )
+    reasoning: str = Field("", description="Detailed reasoning in English citing specific chat messages and dates")
+
+
+# =============================================================================
+# Conversion to the Gemini response schema
+# =============================================================================
+
+# The subset of JSON Schema that Gemini's Schema message understands
+_SCHEMA_KEYS = ("type", "format", "description", "nullable", "enum", "properties", "required", "items")
+
+
+def gemini_schema(model: Type[BaseModel]) -> Dict[str, Any]:
+    """
+    JSON schema of a pydantic model in the form accepted as response_schema:
+    references inlined, Optional turned into nullable, titles and defaults dropped.
+    Unlike passing the class itself, this keeps the list of required fields.
+    """
+    schema = model.model_json_schema()
+    return _convert(schema, schema.get("$defs", {}))
+
+
+def _convert(schema: Dict[str, Any], defs: Dict[str, Any]) -> Dict[str, Any]:
+    if "$ref" in schema:
+        schema = {**defs[schema["$ref"].split("/")[-1]], **{k: v for k, v in schema.items() if k != "$ref"}}
+
+    if "anyOf" in schema:
+        variants = [variant for variant in schema["anyOf"] if variant.get("type") != "null"]
+        if len(variants) != 1:
+            raise ValueError("Only Optional unions are supported in response schemas")
+        merged = {**_convert(variants[0], defs), "nullable": True}
+        if "description" in schema:
+            merged["description"] = schema["description"]
+        return merged
+
+    if "const" in schema:
+        schema = {**schema, "enum": [schema["const"]]}
+
+    result = {key: schema[key] for key in _SCHEMA_KEYS if key in schema}
+    if "properties" in result:
+        result["type"] = "object"
+        result["properties"] = {name: _convert(value, defs) for name, value in result["properties"].items()}
+        # Every field is requested, so the model never leaves one out
+        result["required"] = list(result["properties"])
+    if "items" in result:
+        result["items"] = _convert(result["items"], defs)
+    return result
+
+
+# =============================================================================
+# Progress of a streamed decision
+# =============================================================================
+
+def decision_progress(partial_json: str) -> Dict[str, Any]:
+    """
+    Scans an incomplete DecisionResponse JSON as it streams in and reports how far it got:
+    the top-level fields started so far (in order), the number of completed items per list
+    field and the length of the field currently being written.
+    """
+    stack: List[str] = []
+    in_string = escaped = False
+    expecting_key = False
+    string_start = 0
+    pending_key: Optional[str] = None
+    current_field: Optional[str] = None
+    fields: List[str] = []
+    items: Dict[str, int] = {}
+    field_start = 0
+
+    for i, char in enumerate(partial_json):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+                if len(stack) == 1 and expecting_key:
+                    pending_key = partial_json[string_start:i]
+                elif len(stack) == 2 and stack[-1] == "[" and current_field:
+                    items[current_field] = items.get(current_field, 0) + 1
+            continue
+
+        if char == '"':
+            in_string = True
+            string_start = i + 1
+        elif char in "{[":
+            stack.append(char)
+            if len(stack) == 1:
+                expecting_key = True
+        elif char in "}]":
+            if stack:
+                stack.pop()
+        elif len(stack) == 1 and char == ":" and pending_key is not None:
+            current_field, pending_key = pending_key, None
+            fields.append(current_field)
+            field_start = i + 1
+            expecting_key = False
+        elif len(stack) == 1 and char == ",":
+            expecting_key = True
+
+    return {
+        "fields": fields,
+        "items": items,
+        "current_field": current_field,
+        "current_length": len(partial_json) - field_start if current_field else 0,
+    }
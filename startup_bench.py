@@ -0,0 +1,112 @@
+"""
+Startup cost of the bot: cold import time of each project module and the cost of the
+subsystems that are initialized lazily on first use.
+
+Every measurement runs in a fresh interpreter, so nothing is served from sys.modules.
+The environment (.env / variables) must be the same as for the bot, since conf reads it.
+
+    python startup_bench.py --repeat 5 --top 15
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+# Project modules in dependency order; each one is timed on its own, including its imports
+MODULES = [
+    "conf",
+    "database",
+    "redis_service",
+    "schemas",
+    "llm_resilience",
+    "result_cache",
+    "doc_extract",
+    "media_cache",
+    "gemini_servise",
+    "evidence_ingest",
+    "job_queue",
+    "handlers",
+    "main",
+]
+
+# (name, setup, first use) for the subsystems that are deferred until they are needed
+DEFERRED = [
+    ("gemini backend", "from gemini_servise import gemini_service",
+     "gemini_service._get_model('gemini-2.5-flash')"),
+    ("pdf generator", "", "from pdf_gen import get_pdf_generator; get_pdf_generator()"),
+    ("pillow", "import image_norm", "from PIL import Image, ImageOps"),
+    ("pymupdf", "import doc_extract", "import pymupdf"),
+    ("python-docx", "import doc_extract", "import docx"),
+]
+
+_TIMER = """
+import time
+{setup}
+started = time.perf_counter()
+{code}
+print(time.perf_counter() - started)
+"""
+
+
+def run_timed(setup: str, code: str) -> float:
+    result = subprocess.run(
+        [sys.executable, "-c", _TIMER.format(setup=setup, code=code)],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "failed")
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def measure(setup: str, code: str, repeat: int) -> Tuple[float, float]:
+    samples = [run_timed(setup, code) for _ in range(repeat)]
+    return statistics.median(samples), min(samples)
+
+
+def import_profile(module: str) -> List[Tuple[str, float]]:
+    """Self import time per top-level package (python -X importtime), largest first"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    totals: Dict[str, float] = defaultdict(float)
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|", 2)
+        totals[name.strip().split(".")[0]] += int(self_us) / 1_000_000
+    return sorted(totals.items(), key=lambda item: item[1], reverse=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure import and lazy initialization cost of the bot")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per measurement, the median is reported")
+    parser.add_argument("--top", type=int, default=10, help="packages to list in the import profile of main")
+    args = parser.parse_args()
+
+    print(f"{'cold import':<22}{'median, ms':>12}{'min, ms':>10}")
+    for module in MODULES:
+        try:
+            median, best = measure("", f"import {module}", args.repeat)
+            print(f"{module:<22}{median * 1000:>12.1f}{best * 1000:>10.1f}")
+        except RuntimeError as e:
+            print(f"{module:<22}  failed: {e}")
+
+    print(f"\n{'first use (deferred)':<22}{'median, ms':>12}{'min, ms':>10}")
+    for name, setup, code in DEFERRED:
+        try:
+            median, best = measure(setup, code, args.repeat)
+            print(f"{name:<22}{median * 1000:>12.1f}{best * 1000:>10.1f}")
+        except RuntimeError as e:
+            print(f"{name:<22}  failed: {e}")
+
+    print("\nimport main: self time by package")
+    for package, seconds in import_profile("main")[:args.top]:
+        print(f"  {package:<20}{seconds * 1000:>10.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
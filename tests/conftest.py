@@ -0,0 +1,24 @@
+import os
+import sys
+
+# conf.Settings is built on import and needs these; the tests never reach Telegram, Postgres or Gemini
+for name, value in {
+    "API_ID": "1",
+    "API_HASH": "test",
+    "BOT_TOKEN": "1:test",
+    "GEMINI_API_KEY": "test",
+    "DATABASE_URL": "postgresql://localhost/test",
+    "DISPUTE_TOKEN_WALLET": "test",
+    "BOT_USERNAME": "test_bot",
+    "REDIS_HOST": "localhost",
+    "REDIS_PORT": "6379",
+    "REDIS_PASSWORD": "test",
+    "DECODE_RESPONSE": "true",
+    "REDIS_DB": "0",
+    "GEMINI_BACKEND": "fake",
+    "LLM_TELEMETRY_ENABLED": "false",
+    "CASE_SUMMARY_ENABLED": "false",
+}.items():
+    os.environ.setdefault(name, value)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
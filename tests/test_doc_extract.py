@@ -0,0 +1,41 @@
+import asyncio
+import time
+
+from doc_extract import DocumentExtractor
+
+
+def sleepy_extract(file_bytes: bytes, filename: str, max_pages: int, max_chars: int) -> str:
+    """Worker function: sleeps for the number of seconds in the file"""
+    time.sleep(float(file_bytes.decode()))
+    return f"text of {filename}"
+
+
+def test_timeout_of_one_document_does_not_fail_a_concurrent_one():
+    extractor = DocumentExtractor(workers=2, timeout=3, memory_mb=0, max_pages=10, max_chars=1000,
+                                  extract_func=sleepy_extract)
+    resets = []
+    reset = extractor._reset
+
+    def counting_reset(pool):
+        resets.append(pool is extractor._pool)
+        reset(pool)
+
+    extractor._reset = counting_reset
+
+    async def innocent():
+        # Still running when the stuck document times out and its pool is killed
+        await asyncio.sleep(2)
+        return await extractor.extract(b"2", "good.txt")
+
+    async def run():
+        return await asyncio.gather(extractor.extract(b"60", "stuck.pdf"), innocent())
+
+    try:
+        stuck, good = asyncio.run(run())
+    finally:
+        extractor.shutdown()
+
+    assert "timed out" in stuck
+    assert good == "text of good.txt"
+    # Only the stuck call tore a pool down; the innocent one retried on the new pool
+    assert resets == [True]
@@ -0,0 +1,87 @@
+import asyncio
+import contextlib
+
+import handlers
+from database import UnitOfWork
+
+
+class RecordingConnection:
+    """Records what UnitOfWork sends to asyncpg; every case number resolves to id 1"""
+
+    def __init__(self):
+        self.statements = []
+        self.copies = []
+        self.transactions = 0
+
+    async def execute(self, query, *args):
+        self.statements.append(query)
+        return "INSERT 0 1"
+
+    async def executemany(self, query, args_list):
+        self.statements.extend(query for _ in args_list)
+
+    async def fetch(self, query, case_numbers):
+        return [{"case_number": number, "id": 1} for number in case_numbers]
+
+    async def copy_records_to_table(self, table, records, columns):
+        self.copies.append((table, list(records), columns))
+
+    @contextlib.asynccontextmanager
+    async def transaction(self):
+        self.transactions += 1
+        yield
+
+
+FORWARDED = [
+    {"date": f"2024-05-01T10:{i % 60:02d}:00", "from_user": "alice" if i % 2 else "bob", "text": f"message {i}"}
+    for i in range(120)
+]
+
+
+def test_forwarded_history_is_written_in_one_copy(monkeypatch):
+    monkeypatch.setattr(handlers.settings, "CHAT_HISTORY_PAGE_MESSAGES", 50)
+    conn = RecordingConnection()
+    uow = UnitOfWork()
+    case_number = uow.create_case(topic="Unpaid invoice", category="services", mode="full",
+                                  claim_reason="not paid", plaintiff_id=1, plaintiff_username="alice", chat_id=0)
+    uow.add_evidence_bulk(handlers.chat_history_rows(case_number, 1, FORWARDED))
+    asyncio.run(uow.apply(conn))
+
+    assert conn.transactions == 1
+    assert len(conn.statements) == 1  # the case itself
+    assert len(conn.copies) == 1
+    table, records, columns = conn.copies[0]
+    assert table == "evidence"
+    assert [record[columns.index("type")] for record in records] == ["chat_history"] * 3
+    text = "".join(record[columns.index("content")] for record in records)
+    assert all(f"message {i}\n" in text for i in range(120))
+
+
+class AnswersDb:
+    def __init__(self, answers):
+        self.answers = answers
+        self.bulk_calls = []
+
+    async def get_answered_ai_questions_count(self, case_number, role, round_number):
+        return sum(len(rows) for rows in self.bulk_calls)
+
+    async def get_ai_answers(self, case_number, role, round_number):
+        return self.answers
+
+    async def add_evidence_bulk(self, rows):
+        self.bulk_calls.append(rows)
+        return len(rows)
+
+
+def test_round_answers_are_recorded_in_one_bulk_insert_once(monkeypatch):
+    answers = [{"question": f"Question {i}?", "answer": f"Answer {i}"} for i in range(3)]
+    fake_db = AnswersDb(answers)
+    monkeypatch.setattr(handlers, "db", fake_db)
+
+    asyncio.run(handlers.record_round_answers("CASE-TEST", 7, "defendant", 2))
+    asyncio.run(handlers.record_round_answers("CASE-TEST", 7, "defendant", 2))
+
+    assert len(fake_db.bulk_calls) == 1
+    rows = fake_db.bulk_calls[0]
+    assert [row.content for row in rows] == [f"AI Question: Question {i}?\nAnswer: Answer {i}" for i in range(3)]
+    assert {(row.role, row.ev_type, row.round_number) for row in rows} == {("defendant", "ai_response", 2)}
@@ -0,0 +1,73 @@
+import asyncio
+import json
+
+import google.generativeai as genai
+
+import gemini_servise
+from gemini_servise import GeminiService
+
+CASE = {"case_number": "CASE-TEST", "topic": "Unpaid invoice", "claim_reason": "The work was not paid"}
+PARTICIPANTS = [{"role": "plaintiff", "username": "alice"}, {"role": "defendant", "username": "bob"}]
+EVIDENCE = [{"id": 1, "type": "text", "role": "plaintiff", "content": "I delivered the design on May 1."}]
+
+
+class RecordingClient:
+    """Stands in for the SDK's transport and keeps the GenerateContentRequest protos it was given"""
+
+    def __init__(self, text: str):
+        self.text = text
+        self.requests = []
+
+    async def generate_content(self, request, **request_options):
+        self.requests.append(request)
+        return genai.protos.GenerateContentResponse(
+            candidates=[{"content": {"parts": [{"text": self.text}], "role": "model"}, "finish_reason": 1}]
+        )
+
+
+def sdk_service(text: str):
+    """GeminiService over the real google-generativeai models, with only the network call replaced"""
+    client = RecordingClient(text)
+
+    def factory(model_name):
+        model = genai.GenerativeModel(model_name)
+        model._async_client = client
+        return model
+
+    return GeminiService(model_factory=factory), client
+
+
+def test_question_calls_send_the_cap_to_a_model_without_thinking(monkeypatch):
+    monkeypatch.setattr(gemini_servise.result_cache, "enabled", False)
+    service, client = sdk_service(json.dumps({"questions": ["When was the invoice sent?"]}))
+
+    questions = asyncio.run(service.generate_clarifying_questions(CASE, PARTICIPANTS, EVIDENCE, "plaintiff", 1))
+
+    assert questions == ["When was the invoice sent?"]
+    request = client.requests[0]
+    assert request.model == "models/gemini-2.0-flash"
+    assert request.generation_config.max_output_tokens == 2048
+    assert abs(request.generation_config.temperature - 0.4) < 1e-6
+
+
+def test_thinking_profiles_cap_includes_the_budget_when_it_cannot_be_sent(monkeypatch):
+    monkeypatch.setattr(gemini_servise.result_cache, "enabled", False)
+    monkeypatch.setattr(gemini_servise, "thinking_supported", lambda: False)
+    service, client = sdk_service(json.dumps({"decision": "Claim granted", "winner": "plaintiff"}))
+
+    decision = asyncio.run(service.generate_full_decision(CASE, PARTICIPANTS, EVIDENCE))
+
+    assert decision["winner"] == "plaintiff"
+    request = client.requests[0]
+    assert request.model == "models/gemini-2.5-flash"
+    assert request.generation_config.max_output_tokens == 8192 + 8192
+
+
+def test_thinking_budget_is_sent_when_the_sdk_supports_it(monkeypatch):
+    monkeypatch.setattr(gemini_servise, "thinking_supported", lambda: True)
+    profile = gemini_servise.settings.GENERATION_PROFILES["final_decision"]
+
+    config = GeminiService(model_factory=lambda name: None)._generation_config(profile)
+
+    assert config["thinking_config"] == {"thinking_budget": 8192}
+    assert config["max_output_tokens"] == 8192
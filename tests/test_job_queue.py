@@ -0,0 +1,80 @@
+import asyncio
+
+import job_queue
+from job_queue import JobWorkerPool, register_job
+
+
+class QueueDb:
+    """llm_jobs in memory; complete_llm_job fails the first time, like a dropped connection"""
+
+    def __init__(self, jobs):
+        self.jobs = list(jobs)
+        self.completed = []
+        self.failed = []
+        self.complete_errors = 1
+
+    async def claim_llm_job(self, worker_id, lease_seconds, kinds):
+        return self.jobs.pop(0) if self.jobs else None
+
+    async def complete_llm_job(self, job_id):
+        if self.complete_errors:
+            self.complete_errors -= 1
+            raise ConnectionError("connection was closed in the middle of operation")
+        self.completed.append(job_id)
+
+    async def fail_llm_job(self, job_id, error, retry_in, give_up=False):
+        self.failed.append((job_id, give_up))
+
+    async def extend_llm_job_lease(self, job_id, worker_id, lease_seconds):
+        pass
+
+
+def job(job_id, kind, attempts=1):
+    return {"id": job_id, "kind": kind, "case_number": "CASE-TEST", "payload": {"case_number": "CASE-TEST"},
+            "attempts": attempts}
+
+
+async def run_pool(fake_db, until):
+    pool = JobWorkerPool(bot=None, storage=None, concurrency=1, lease_seconds=30, poll_interval=0.01,
+                         max_attempts=3)
+    pool.start()
+    for _ in range(200):
+        if until():
+            break
+        await asyncio.sleep(0.01)
+    await pool.stop()
+
+
+def test_bookkeeping_errors_do_not_stop_the_worker(monkeypatch):
+    ran = []
+
+    @register_job("test_ok")
+    async def ok_job(bot, storage, case_number):
+        ran.append(case_number)
+
+    fake_db = QueueDb([job(1, "test_ok"), job(2, "test_ok")])
+    monkeypatch.setattr(job_queue, "db", fake_db)
+
+    asyncio.run(run_pool(fake_db, until=lambda: fake_db.completed))
+
+    assert len(ran) == 2
+    assert fake_db.completed == [2]
+
+
+def test_give_up_handler_runs_only_after_the_last_attempt(monkeypatch):
+    gave_up = []
+
+    async def on_give_up(bot, storage, case_number):
+        gave_up.append(case_number)
+
+    @register_job("test_broken", on_give_up=on_give_up)
+    async def broken_job(bot, storage, case_number):
+        raise ValueError("malformed model answer")
+
+    fake_db = QueueDb([job(1, "test_broken", attempts=1), job(2, "test_broken", attempts=3)])
+    monkeypatch.setattr(job_queue, "db", fake_db)
+
+    asyncio.run(run_pool(fake_db, until=lambda: len(fake_db.failed) == 2 and gave_up))
+
+    assert fake_db.failed == [(1, False), (2, True)]
+    assert gave_up == ["CASE-TEST"]
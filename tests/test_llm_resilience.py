@@ -0,0 +1,72 @@
+import asyncio
+import time
+
+import pytest
+from google.api_core import exceptions as google_exceptions
+
+from fake_gemini import FakeGeminiModel
+from llm_resilience import CircuitBreaker, CircuitOpenError, LLMUnavailableError, ResilientCaller
+
+
+def caller(failure_threshold=100, deadline=10.0, hedge=False, max_attempts=5):
+    return ResilientCaller(max_attempts=max_attempts, base_delay=0.001, max_delay=0.005,
+                           deadlines={"questions": deadline}, default_deadline=deadline,
+                           breaker=CircuitBreaker(failure_threshold, reset_timeout=60), hedge=hedge)
+
+
+def attempt_on(model, before=None):
+    async def attempt(timeout):
+        if before is not None:
+            before()
+        return await asyncio.wait_for(model.generate_content_async("When was the invoice sent?"), timeout)
+    return attempt
+
+
+def test_breaker_opens_after_consecutive_failures():
+    model = FakeGeminiModel(latency=(0, 0), fault_rate=1.0, seed=1,
+                            faults=[google_exceptions.ServiceUnavailable("overloaded")])
+    resilient = caller(failure_threshold=3)
+
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(resilient.call("questions", attempt_on(model), attempt_timeout=1))
+    assert model.calls == 3
+    assert resilient.breaker.state == "open"
+
+    # While open, calls fail fast without reaching the model
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(resilient.call("questions", attempt_on(model), attempt_timeout=1))
+    assert model.calls == 3
+
+
+def test_hedge_answers_when_the_first_request_is_slow():
+    model = FakeGeminiModel(latency=(0.01, 0.02), tail_latency=5.0, seed=1)
+    resilient = caller(hedge=True)
+    for _ in range(resilient.hedge_min_samples):
+        resilient.latency.add("questions", 0.02)
+
+    def slow_first():
+        # Only the first request lands in the slow tail
+        model.tail_rate = 1.0 if model.calls == 0 else 0.0
+
+    stats = {}
+    started = time.monotonic()
+    response = asyncio.run(resilient.call("questions", attempt_on(model, slow_first), attempt_timeout=10,
+                                          stats=stats))
+
+    assert response.text
+    assert time.monotonic() - started < 1
+    assert model.calls == 2
+    assert stats == {"attempts": 1, "hedges": 1}
+
+
+def test_deadline_bounds_the_call_across_retries():
+    model = FakeGeminiModel(latency=(1.0, 1.0), seed=1)
+    resilient = caller(deadline=0.3)
+
+    started = time.monotonic()
+    with pytest.raises(LLMUnavailableError) as error:
+        asyncio.run(resilient.call("questions", attempt_on(model), attempt_timeout=10))
+
+    assert not isinstance(error.value, CircuitOpenError)
+    assert isinstance(error.value.__cause__, asyncio.TimeoutError)
+    assert time.monotonic() - started < 0.6
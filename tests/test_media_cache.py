@@ -0,0 +1,25 @@
+import os
+import time
+
+from media_cache import STALE_TEMP_SECONDS, MediaCache
+
+
+def test_eviction_leaves_in_flight_temp_files_and_removes_stale_ones(tmp_path):
+    cache = MediaCache(str(tmp_path), max_bytes=10, ttl_seconds=3600)
+    cache._store(b"x" * 8, {"file_path": "photos/a.jpg"}, ["id:a"])
+
+    blob_dir = os.path.dirname(cache._blob_path("0" * 64))
+    os.makedirs(blob_dir, exist_ok=True)
+    writing = os.path.join(blob_dir, "tmpwriting.tmp")
+    crashed = os.path.join(blob_dir, "tmpcrashed.tmp")
+    for path in (writing, crashed):
+        with open(path, "wb") as f:
+            f.write(b"y" * 64)
+    old = time.time() - STALE_TEMP_SECONDS - 1
+    os.utime(crashed, (old, old))
+
+    cache._evict_sync()
+
+    assert os.path.exists(writing)
+    assert not os.path.exists(crashed)
+    assert cache._read_by_key("id:a").data == b"x" * 8
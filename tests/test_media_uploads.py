@@ -0,0 +1,86 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from google.api_core import exceptions as google_exceptions
+
+import media_uploads
+from gemini_servise import stale_uploads
+from media_uploads import MediaRegistry, UploadedFile, UploadedPart
+
+INLINE = {"mime_type": "image/jpeg", "data": b"\xff" * 64}
+
+
+class ScriptedFileService:
+    """Uploads take `latency` seconds; the first `failures` of them fail. Tracks overlapping uploads."""
+
+    def __init__(self, latency: float, failures: int = 0):
+        self.latency = latency
+        self.failures = failures
+        self.uploads = 0
+        self.running = 0
+        self.max_running = 0
+
+    async def upload(self, data, mime_type, display_name):
+        self.uploads += 1
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            await asyncio.sleep(self.latency)
+            if self.failures:
+                self.failures -= 1
+                raise ConnectionError("upload reset")
+            expires_at = datetime.now(timezone.utc) + timedelta(hours=48)
+            return UploadedFile(f"fake://files/{self.uploads}", mime_type, expires_at)
+        finally:
+            self.running -= 1
+
+
+class NoDb:
+    async def save_evidence_upload(self, *args):
+        pass
+
+
+def test_caller_arriving_after_a_failed_upload_waits_for_the_retry(monkeypatch):
+    monkeypatch.setattr(media_uploads, "db", NoDb())
+    service = ScriptedFileService(latency=0.05, failures=1)
+    registry = MediaRegistry(expiry_margin=60, min_bytes=0, file_service=service)
+    ev = {"id": 1, "case_number": "CASE-TEST"}
+
+    async def late_part():
+        # after the first upload failed, while the second waiter is uploading
+        await asyncio.sleep(0.07)
+        return await registry.part_for(ev, INLINE)
+
+    async def scenario():
+        return await asyncio.gather(registry.part_for(ev, INLINE), registry.part_for(ev, INLINE), late_part())
+
+    first, second, late = asyncio.run(scenario())
+
+    assert first is INLINE
+    assert isinstance(second, UploadedPart) and isinstance(late, UploadedPart)
+    assert second["file_data"]["file_uri"] == late["file_data"]["file_uri"]
+    assert service.uploads == 2
+    assert service.max_running == 1
+    assert not registry._locks and not registry._lock_users
+
+
+def uploaded(evidence_id):
+    handle = UploadedFile(f"fake://files/{evidence_id}", "image/jpeg", datetime.now(timezone.utc))
+    return UploadedPart(evidence_id, handle, INLINE)
+
+
+def test_only_file_errors_drop_upload_handles():
+    messages = ["Case materials", uploaded(1), uploaded(2)]
+
+    schema_error = google_exceptions.InvalidArgument("Unknown name \"winner\" at 'generation_config'")
+    assert stale_uploads(schema_error, messages) == []
+    assert stale_uploads(ValueError("fake://files/1"), messages) == []
+
+    named = google_exceptions.InvalidArgument("Unsupported file uri: fake://files/2")
+    assert [part.evidence_id for part in stale_uploads(named, messages)] == [2]
+    unnamed = google_exceptions.InvalidArgument("The file is not in an ACTIVE state")
+    assert [part.evidence_id for part in stale_uploads(unnamed, messages)] == [1, 2]
+    denied = google_exceptions.PermissionDenied("You do not have permission to access it")
+    assert [part.evidence_id for part in stale_uploads(denied, messages)] == [1, 2]
+
+    assert stale_uploads(denied, ["Case materials"]) == []
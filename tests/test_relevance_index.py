@@ -0,0 +1,66 @@
+import asyncio
+
+import gemini_servise
+from fake_gemini import FakeGeminiModel
+from gemini_servise import GeminiService
+from relevance_index import EvidenceIndex
+
+
+def make_index() -> EvidenceIndex:
+    return EvidenceIndex(top_k=2, chunk_chars=60, min_chars=0, max_cases=10)
+
+
+def text_evidence(ev_id: int, content: str) -> dict:
+    return {"id": ev_id, "type": "text", "role": "plaintiff", "content": content}
+
+
+def test_rows_from_earlier_rounds_do_not_take_top_k_slots():
+    index = make_index()
+    old = [text_evidence(i, "invoice payment invoice payment delivered on time") for i in range(1, 5)]
+    index.select("CASE-1", old, "invoice payment")
+
+    new = [text_evidence(10, "the invoice was paid late, payment arrived in May")]
+    selected = index.select("CASE-1", new, "invoice payment")
+
+    assert [ev["id"] for ev in selected] == [10]
+    assert "invoice" in selected[0]["content"]
+
+
+def test_query_without_terms_keeps_all_evidence():
+    index = make_index()
+    evidence = [text_evidence(1, "first argument about the contract"), text_evidence(2, "second argument")]
+
+    assert index.select("CASE-2", evidence, "  ? ") == evidence
+
+
+class SummaryDb:
+    def __init__(self):
+        self.saved = []
+
+    async def get_case_summary(self, case_number):
+        return None
+
+    async def save_case_summary(self, case_number, summary, last_evidence_id, round_number):
+        self.saved.append(last_evidence_id)
+
+
+def test_summary_does_not_cover_evidence_the_index_dropped(monkeypatch):
+    summary_db = SummaryDb()
+    monkeypatch.setattr(gemini_servise, "db", summary_db)
+    monkeypatch.setattr(gemini_servise, "evidence_index", make_index())
+    monkeypatch.setattr(gemini_servise.settings, "CASE_SUMMARY_ENABLED", True)
+    monkeypatch.setattr(gemini_servise.result_cache, "enabled", False)
+    answer = '{"questions": [], "summary": {"established_facts": ["The design was delivered"], "open_issues": []}}'
+    model = FakeGeminiModel(latency=(0, 0), responder=lambda contents, config: answer)
+    service = GeminiService(model_factory=lambda name: model)
+
+    evidence = [
+        text_evidence(1, "the invoice for the design was never paid"),
+        text_evidence(2, "unrelated remark about the weather and holidays"),
+        text_evidence(3, "invoice reminder sent, payment still missing"),
+    ]
+    case = {"case_number": "CASE-3", "topic": "Unpaid invoice", "claim_reason": "invoice payment"}
+    asyncio.run(service.generate_clarifying_questions(case, [], evidence, "plaintiff", 1))
+
+    # Row 2 was not in the prompt, so the summary only covers row 1 and rows 2-3 come again next round
+    assert summary_db.saved == [1]
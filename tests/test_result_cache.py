@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+
+import gemini_servise
+from fake_gemini import FakeGeminiModel
+from gemini_servise import DecisionGenerationError, GeminiService
+from result_cache import ResultCache
+
+
+class MemoryRedis:
+    """The few Redis commands ResultCache uses"""
+
+    def __init__(self):
+        self.data = {}
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value
+        return True
+
+    async def eval(self, script, numkeys, key, token):
+        if self.data.get(key) == token:
+            del self.data[key]
+
+
+CASE = {"case_number": "CASE-TEST", "topic": "Unpaid invoice", "claim_reason": "The work was not paid"}
+PARTICIPANTS = [{"role": "plaintiff", "username": "alice"}, {"role": "defendant", "username": "bob"}]
+EVIDENCE = [{"id": 1, "type": "text", "role": "plaintiff", "content": "I delivered the design on May 1."}]
+
+
+def test_unparsable_questions_are_not_cached(monkeypatch):
+    redis = MemoryRedis()
+    monkeypatch.setattr(gemini_servise, "result_cache",
+                        ResultCache(redis, ttl=60, lock_ttl=60, wait_timeout=1))
+    answers = iter(["not json at all", '{"questions": ["When was the invoice sent?"]}'])
+    model = FakeGeminiModel(latency=(0, 0), responder=lambda contents, config: next(answers))
+    service = GeminiService(model_factory=lambda name: model)
+
+    async def ask():
+        return await service.generate_clarifying_questions(CASE, PARTICIPANTS, EVIDENCE, "plaintiff", 1)
+
+    assert asyncio.run(ask()) == []
+    assert not [key for key in redis.data if ":lock:" not in key]
+
+    # The retry reaches the model again and its valid answer is cached
+    assert asyncio.run(ask()) == ["When was the invoice sent?"]
+    assert model.calls == 2
+    assert asyncio.run(ask()) == ["When was the invoice sent?"]
+    assert model.calls == 2
+
+
+def test_malformed_decision_raises_instead_of_a_default_verdict(monkeypatch):
+    redis = MemoryRedis()
+    monkeypatch.setattr(gemini_servise, "result_cache",
+                        ResultCache(redis, ttl=60, lock_ttl=60, wait_timeout=1))
+    answers = iter(['{"verdict": "granted"', '{"decision": "Claim granted", "winner": "plaintiff"}'])
+    model = FakeGeminiModel(latency=(0, 0), responder=lambda contents, config: next(answers))
+    service = GeminiService(model_factory=lambda name: model)
+
+    async def decide():
+        return await service.generate_full_decision(CASE, PARTICIPANTS, EVIDENCE)
+
+    with pytest.raises(DecisionGenerationError):
+        asyncio.run(decide())
+    assert not [key for key in redis.data if ":lock:" not in key]
+
+    # The job retry gets a fresh model call and the real decision
+    assert asyncio.run(decide())["winner"] == "plaintiff"
+    assert model.calls == 2
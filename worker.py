@@ -0,0 +1,64 @@
+import asyncio
+import logging
+import sys
+
+from aiogram import Bot
+from aiogram.client.default import DefaultBotProperties
+from aiogram.fsm.storage.redis import RedisStorage
+from redis.asyncio import Redis
+
+import handlers  # noqa: F401 - registers the job handlers
+from conf import settings
+from database import db
+from doc_extract import document_extractor
+from job_queue import JobWorkerPool
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    handlers=[logging.StreamHandler(sys.stdout)]
+)
+logger = logging.getLogger(__name__)
+
+
+async def main(concurrency: int):
+    """Отдельный процесс для ИИ-заданий: python worker.py [кол-во воркеров]"""
+    redis = Redis(
+        host=settings.REDIS_HOST or "localhost",
+        port=settings.REDIS_PORT or 6379,
+        password=settings.REDIS_PASSWORD or "38856",
+        db=settings.REDIS_DB or 0,
+        decode_responses=True
+    )
+    storage = RedisStorage(redis=redis, state_ttl=3600 * 24 * 7, data_ttl=3600 * 24 * 7)
+    bot = Bot(token=settings.BOT_TOKEN, default=DefaultBotProperties(parse_mode="HTML"))
+    await db.connect()
+
+    pool = JobWorkerPool(
+        bot,
+        storage,
+        concurrency=concurrency,
+        lease_seconds=settings.LLM_JOB_LEASE,
+        poll_interval=settings.LLM_JOB_POLL_INTERVAL,
+        max_attempts=settings.LLM_JOB_MAX_ATTEMPTS
+    )
+    pool.start()
+    logger.info(f"🧵 Воркер очереди ИИ запущен, воркеров: {concurrency}")
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await pool.stop()
+        document_extractor.shutdown()
+        await bot.session.close()
+        await storage.close()
+        await db.pool.close()
+        logger.info("✅ Воркер очереди остановлен")
+
+
+if __name__ == "__main__":
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else max(settings.LLM_JOB_WORKERS, 1)
+    try:
+        asyncio.run(main(workers))
+    except KeyboardInterrupt:
+        logger.info("👋 Воркер остановлен пользователем")